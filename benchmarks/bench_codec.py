@@ -0,0 +1,63 @@
+# Benchmark for the wire codecs.
+#
+# For each codec installed (json, msgpack, cbor), parses --count pub frames
+# the way a socket Peer does (PacketParser.parse_packet) and encodes as many
+# push frames (EncodedPacket.socket_frame), for a small packet, a 1 KiB
+# document and a 4 KiB binary payload (base64 inside JSON). Reports the
+# packets per second of each direction and the frame size.
+#
+#   python3 bench_codec.py [--count 50000]
+
+import os
+import sys
+import time
+import random
+import argparse
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.constants import Protocol
+from pyjmqt.server.core.packets import CODECS, EncodedPacket, PacketParser, PacketGenerator
+
+def payloads():
+    random.seed(1)
+    document = {'id': 1234, 'user': 'sensor-17', 'tags': ['a', 'b', 'c'],
+                'readings': [{'t': 1544000000 + i, 'v': round(random.random() * 100, 3)} for i in range(30)]}
+    return [
+        ('small', {'t': 1544000000, 'v': 21.5}),
+        ('1 KiB doc', document),
+        ('4 KiB binary', bytes(random.getrandbits(8) for _ in range(4096)))
+    ]
+
+def measure(codec, payload, count):
+    pub = {'pub': {'cn': 'sensors/17', 'dt': payload, 'q': 1, 'id': '42'}}
+    # the frame of the socket transport without its delimiter or length prefix
+    body = codec.dumps(pub)
+    start = time.perf_counter()
+    for _ in range(count):
+        PacketParser.parse_packet(body, Protocol.SOCKET, codec)
+    parse = count / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(count):
+        frame = EncodedPacket(PacketGenerator.generate_push_req('sensors/17', payload, '42', 'client-1', False, 1)).socket_frame(codec)
+    generate = count / (time.perf_counter() - start)
+    return parse, generate, len(frame)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=50000)
+    args = parser.parse_args()
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+    print('codecs: ' + ', '.join(CODECS.keys()))
+    print('{0:>14} {1:>10} {2:>16} {3:>16} {4:>18}'.format('payload', 'codec', 'parse (pck/s)', 'push (pck/s)', 'push frame (B)'))
+    for name, payload in payloads():
+        for codec in CODECS.values():
+            parse, generate, size = measure(codec, payload, args.count)
+            print('{0:>14} {1:>10} {2:>16.0f} {3:>16.0f} {4:>18}'.format(name, codec.name, parse, generate, size))
+
+if __name__ == '__main__':
+    main()
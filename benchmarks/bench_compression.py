@@ -0,0 +1,102 @@
+# Benchmark for the compression of the socket frames.
+#
+# For a 16 KiB JSON document, a 16 KiB log text and a 16 KiB random binary
+# payload (already compressed data), reports the push frame size and the
+# compression and decompression time of each zlib level, then the CPU time
+# of a push fanned out to --subscribers socket peers, compressing the frame
+# for each subscriber vs compressing it once (EncodedPacket.socket_frame).
+#
+#   python3 bench_compression.py [--count 200] [--subscribers 100]
+
+import os
+import sys
+import time
+import zlib
+import random
+import argparse
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.framing import LengthPrefixedBuffer, LENGTH_FRAMING, COMPRESSED_FRAMING
+from pyjmqt.server.core.packets import JSONCodec, MessagePackCodec, CODECS, EncodedPacket, PacketGenerator
+
+SIZE = 16 * 1024
+
+def payloads():
+    random.seed(1)
+    readings = []
+    while len(str(readings)) < SIZE:
+        readings.append({'sensor': 'sensor-' + str(random.randrange(50)), 't': 1544000000 + len(readings), 'v': round(random.random() * 100, 2)})
+    lines = []
+    while sum(len(line) for line in lines) < SIZE:
+        lines.append('2018-12-05 10:{0:02d}:{1:02d} INFO worker-{2} handled request /api/v1/items/{3} in {4} ms'.format(
+            random.randrange(60), random.randrange(60), random.randrange(8), random.randrange(10000), random.randrange(500)))
+    return [
+        ('json doc', {'readings': readings}),
+        ('log text', '\n'.join(lines)),
+        ('binary', bytes(random.getrandbits(8) for _ in range(SIZE)))
+    ]
+
+def push(payload):
+    return EncodedPacket(PacketGenerator.generate_push_req('sensors/17', payload, '42', 'client-1', False, 1))
+
+def measure_level(codec, payload, level, count):
+    plain = push(payload).socket_frame(codec, LENGTH_FRAMING)
+    start = time.perf_counter()
+    for _ in range(count):
+        frame = push(payload).socket_frame(codec, COMPRESSED_FRAMING, level)
+    compress = (time.perf_counter() - start) / count * 1e6
+    buffer = LengthPrefixedBuffer(None)
+    start = time.perf_counter()
+    for _ in range(count):
+        buffer.feed(frame)
+    decompress = (time.perf_counter() - start) / count * 1e6
+    return len(plain), len(frame), compress, decompress
+
+def measure_fanout(codec, payload, subscribers, count, level):
+    start = time.perf_counter()
+    for _ in range(count):
+        packet = push(payload)
+        for _ in range(subscribers):
+            # the frame of each subscriber compressed on its own
+            LengthPrefixedBuffer.frame(zlib.compress(codec.dumps_bytes(packet.packet), level), True)
+    each = (time.perf_counter() - start) / count * 1e3
+    start = time.perf_counter()
+    for _ in range(count):
+        packet = push(payload)
+        for _ in range(subscribers):
+            packet.socket_frame(codec, COMPRESSED_FRAMING, level)
+    once = (time.perf_counter() - start) / count * 1e3
+    return each, once
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--subscribers', type=int, default=100)
+    args = parser.parse_args()
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+    codecs = [codec for codec in (JSONCodec, MessagePackCodec) if codec.name in CODECS]
+
+    print('{0:>10} {1:>8} {2:>6} {3:>10} {4:>12} {5:>8} {6:>16} {7:>18}'.format(
+        'payload', 'codec', 'level', 'frame (B)', 'zlib (B)', 'ratio', 'compress (us)', 'decompress (us)'))
+    for name, payload in payloads():
+        for codec in codecs:
+            for level in (1, 6, 9):
+                plain, compressed, compress, decompress = measure_level(codec, payload, level, args.count)
+                print('{0:>10} {1:>8} {2:>6} {3:>10} {4:>12} {5:>8.2f} {6:>16.1f} {7:>18.1f}'.format(
+                    name, codec.name, level, plain, compressed, compressed / plain, compress, decompress))
+
+    print()
+    print('push to {0} subscribers, level 6'.format(args.subscribers))
+    print('{0:>10} {1:>8} {2:>26} {3:>26}'.format('payload', 'codec', 'per subscriber (ms/push)', 'compressed once (ms/push)'))
+    for name, payload in payloads():
+        for codec in codecs:
+            each, once = measure_fanout(codec, payload, args.subscribers, max(1, args.count // 10), 6)
+            print('{0:>10} {1:>8} {2:>26.2f} {3:>26.2f}'.format(name, codec.name, each, once))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# Benchmark for the database layer under QoS1 traffic.
+#
+# Runs the database calls made by a QoS1 publish (one packet, one pubmap per
+# subscriber, then the pending packet lookups of a reconnecting client)
+# against a temporary SQLite database, while a ticker measures how late the
+# event loop wakes up (loop lag). DB_THREADS = 0 runs the queries on the
+# event loop, which is how the server worked before the db executor.
+#
+#   python3 bench_db_loop_lag.py [--publishes 300] [--subscribers 20]
+
+import os
+import sys
+import time
+import uuid
+import asyncio
+import argparse
+import tempfile
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.settings import ServerSettings
+from pyjmqt.server.core.services.dbservice import SQLiteService
+
+async def ticker(lags, state, interval = 0.001):
+    while state['run']:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+async def qos1_publish(db, subscribers):
+    pck_id = str(uuid.uuid1())
+    await db.insert_packet(pck_id, 'sender', 'bench', {'value': pck_id}, ['client-' + str(i) for i in range(subscribers)])
+    return pck_id
+
+async def run(db, publishes, subscribers):
+    lags = []
+    state = {'run': True}
+    monitor = asyncio.ensure_future(ticker(lags, state))
+    start = time.perf_counter()
+    for _ in range(publishes):
+        await qos1_publish(db, subscribers)
+    ids = await db.get_pubmap('client-0')
+    await asyncio.gather(*[db.get_packet(pck_id) for pck_id in ids[:publishes]])
+    elapsed = time.perf_counter() - start
+    state['run'] = False
+    await monitor
+    return elapsed, lags
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--publishes', type=int, default=300)
+    parser.add_argument('--subscribers', type=int, default=20)
+    args = parser.parse_args()
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+
+    print('{0:>10} {1:>12} {2:>16} {3:>16} {4:>16}'.format('db threads', 'time (s)', 'lag p50 (ms)', 'lag p99 (ms)', 'lag max (ms)'))
+    for threads in [0, 1]:
+        with tempfile.TemporaryDirectory() as tmp:
+            settings = ServerSettings({'SQLITE_DB_PATH': os.path.join(tmp, 'bench.db'), 'DB_THREADS': threads})
+            db = SQLiteService(settings)
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            elapsed, lags = loop.run_until_complete(run(db, args.publishes, args.subscribers))
+            loop.close()
+            lags.sort()
+            def pct(p):
+                return lags[min(len(lags) - 1, int(len(lags) * p))] * 1e3
+            print('{0:>10} {1:>12.2f} {2:>16.3f} {3:>16.3f} {4:>16.3f}'.format(threads, elapsed, pct(0.5), pct(0.99), lags[-1] * 1e3))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+# Benchmark for the event loop of the server (EVENT_LOOP).
+#
+# Runs the socket server (ConnectionHandler and SocketServer, SQLite in a
+# temporary directory) in a child process on each event loop available
+# (asyncio, uvloop), connects --subscribers socket clients subscribed to one
+# channel and one publisher, then reports the pushes delivered per second
+# when --count QoS 0 packets are published at once, and the p50/p99 latency
+# from publish to push when --samples packets are published at --rate per
+# second. The clients run on an asyncio loop in this process.
+#
+#   python3 bench_event_loop.py [--subscribers 10] [--count 20000] [--samples 2000] [--rate 1000]
+
+import os
+import sys
+import time
+import signal
+import asyncio
+import argparse
+import tempfile
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+import pyjmqt.server.logger as logger
+import pyjmqt.server.core.serializer as serializer
+from pyjmqt.server.api import Server
+from pyjmqt.server.core.settings import ServerSettings
+from pyjmqt.server.core.framing import FrameBuffer
+from pyjmqt.server.core.connection_handler import ConnectionHandler
+from pyjmqt.server.core.socket_server import SocketServer
+from pyjmqt.server.core.event_loop import new_event_loop, uvloop
+
+PORT = 18090
+CHANNEL = 'bench'
+
+async def ok(*args):
+    return Server.StatusCodes.OK
+
+async def control(*args):
+    return Server.StatusCodes.OK, None
+
+async def notify(*args):
+    pass
+
+def run_server(kind, dbPath):
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+    settings = ServerSettings({'EVENT_LOOP': kind, 'SOCKET_PORT': PORT, 'TIMEOUT_SECONDS': 60, 'ENABLE_REDIS': 0,
+                               'ENABLE_MYSQL': 0, 'ENABLE_SSL': 0, 'SQLITE_DB_PATH': dbPath})
+    eventLoop = new_event_loop(settings)
+    asyncio.set_event_loop(eventLoop)
+    callbacks = Server.CallbackWrapper()
+    callbacks.validate_conn_callback = callbacks.validate_sub_callback = callbacks.validate_pub_callback = ok
+    callbacks.validate_unsub_callback = callbacks.validate_auth_callback = ok
+    callbacks.control_data_callback = control
+    callbacks.disconnection_callback = callbacks.conn_close_callback = notify
+    handler = ConnectionHandler(settings, eventLoop)
+    handler.start()
+    socketServer = SocketServer(eventLoop, callbacks, handler, settings)
+    eventLoop.run_until_complete(asyncio.start_server(socketServer.handle_client, '127.0.0.1', PORT))
+    eventLoop.run_forever()
+
+class Connection():
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.buffer = FrameBuffer(None)
+        self.frames = []
+
+    @staticmethod
+    async def open(client_id):
+        for _ in range(200):
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', PORT)
+                break
+            except OSError:
+                await asyncio.sleep(0.05)
+        connection = Connection(reader, writer)
+        connection.send({'conn': {'at': 'token', 'cl': client_id}})
+        await connection.receive()
+        return connection
+
+    def send(self, packet):
+        self.writer.write(serializer.dumps_bytes(packet) + b'\0')
+
+    async def receive(self):
+        while len(self.frames) == 0:
+            self.frames.extend(self.buffer.feed(await self.reader.read(65536)))
+        return serializer.loads(self.frames.pop(0))
+
+    def close(self):
+        self.writer.close()
+
+async def subscriber(connection, count, latencies):
+    for _ in range(count):
+        packet = await connection.receive()
+        if latencies is not None:
+            latencies.append(time.time() - packet['push']['dt'])
+
+async def measure(subscribers, count, samples, rate):
+    subs = []
+    for i in range(subscribers):
+        connection = await Connection.open('sub-' + str(i))
+        connection.send({'sub': {'cn': CHANNEL, 'pr': 0}})
+        await connection.receive()
+        subs.append(connection)
+    publisher = await Connection.open('publisher')
+    await asyncio.sleep(0.5)
+
+    tasks = [asyncio.ensure_future(subscriber(connection, count, None)) for connection in subs]
+    start = time.perf_counter()
+    for i in range(count):
+        publisher.send({'pub': {'cn': CHANNEL, 'dt': i, 'q': 0, 'id': str(i)}})
+        if i % 100 == 0:
+            await publisher.writer.drain()
+    await asyncio.gather(*tasks)
+    throughput = count * subscribers / (time.perf_counter() - start)
+
+    latencies = []
+    tasks = [asyncio.ensure_future(subscriber(connection, samples, latencies)) for connection in subs]
+    for i in range(samples):
+        publisher.send({'pub': {'cn': CHANNEL, 'dt': time.time(), 'q': 0, 'id': str(i)}})
+        await asyncio.sleep(1.0 / rate)
+    await asyncio.gather(*tasks)
+    latencies.sort()
+    for connection in subs + [publisher]:
+        connection.close()
+    return throughput, latencies[len(latencies) // 2] * 1e3, latencies[int(len(latencies) * 0.99)] * 1e3
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--subscribers', type=int, default=10)
+    parser.add_argument('--count', type=int, default=20000)
+    parser.add_argument('--samples', type=int, default=2000)
+    parser.add_argument('--rate', type=int, default=1000)
+    args = parser.parse_args()
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+    kinds = ['asyncio'] + (['uvloop'] if uvloop is not None else [])
+    if uvloop is None:
+        print('uvloop is not installed')
+
+    print('{0:>8} {1:>16} {2:>10} {3:>10}'.format('loop', 'pushes/s', 'p50 (ms)', 'p99 (ms)'))
+    for kind in kinds:
+        with tempfile.TemporaryDirectory() as tmp:
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    run_server(kind, os.path.join(tmp, 'bench.db'))
+                finally:
+                    os._exit(0)
+            try:
+                eventLoop = asyncio.new_event_loop()
+                asyncio.set_event_loop(eventLoop)
+                result = eventLoop.run_until_complete(measure(args.subscribers, args.count, args.samples, args.rate))
+                eventLoop.close()
+            finally:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+        print('{0:>8} {1:>16.0f} {2:>10.2f} {3:>10.2f}'.format(kind, *result))
+
+if __name__ == '__main__':
+    main()
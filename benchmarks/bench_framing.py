@@ -0,0 +1,60 @@
+# Microbenchmark for the socket framing.
+#
+# Splits a stream of NUL terminated packets arriving in reads of a fixed
+# size, once with the old loop (bytes concatenation and a split of the
+# whole buffer on every read, 1024 byte reads) and once with FrameBuffer
+# (64 KiB reads by default), for many small packets and for a few large ones.
+#
+#   python3 bench_framing.py [--small 20000] [--large 5] [--large-size 1048576]
+
+import os
+import sys
+import time
+import argparse
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+from pyjmqt.server.core.framing import FrameBuffer
+
+def old_loop(stream, readSize):
+    frames = 0
+    buffer = bytes()
+    for i in range(0, len(stream), readSize):
+        buffer += stream[i:i + readSize]
+        packets = buffer.split(b'\0')
+        buffer = packets[-1]
+        # the old loop also handed the trailing partial packet over, it is not counted here
+        frames += len(packets) - 1
+    return frames
+
+def frame_buffer(stream, readSize):
+    frames = 0
+    buffer = FrameBuffer(None)
+    for i in range(0, len(stream), readSize):
+        frames += len(buffer.feed(stream[i:i + readSize]))
+    return frames
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--small', type=int, default=20000, help='number of small packets')
+    parser.add_argument('--large', type=int, default=5, help='number of large packets')
+    parser.add_argument('--large-size', type=int, default=1024 * 1024)
+    parser.add_argument('--read-size', type=int, default=65536, help='read size of FrameBuffer')
+    args = parser.parse_args()
+    small = b''.join(b'{"pub": {"cn": "channel", "dt": "' + str(i).encode() * 10 + b'", "q": 0}}\0' for i in range(args.small))
+    large = b''.join(b'{"pub": {"cn": "channel", "dt": "' + b'x' * args.large_size + b'", "q": 0}}\0' for _ in range(args.large))
+
+    print('{0:>8} {1:>14} {2:>10} {3:>10} {4:>10}'.format('workload', 'framing', 'read size', 'time (ms)', 'MB/s'))
+    for workload, stream, count in [('small', small, args.small), ('large', large, args.large)]:
+        for name, func, readSize in [('old loop', old_loop, 1024), ('FrameBuffer', frame_buffer, 1024), ('FrameBuffer', frame_buffer, args.read_size)]:
+            start = time.perf_counter()
+            frames = func(stream, readSize)
+            elapsed = time.perf_counter() - start
+            assert frames == count
+            print('{0:>8} {1:>14} {2:>10} {3:>10.1f} {4:>10.1f}'.format(workload, name, readSize, elapsed * 1e3, len(stream) / elapsed / 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+# Benchmark for the idle detection of the connections (TIMEOUT_SECONDS).
+#
+# Opens --connections stream pairs (socketpairs) on one event loop and reads
+# them with the peer loop of the socket server, once with an asyncio.wait_for
+# timeout around every read and once with the IdleTracker timer wheel.
+# --active of the connections send a small frame every --interval seconds,
+# the others stay silent. Reports the CPU time of the loop per second, the
+# memory held by the pending reads and the timers scheduled in the loop, then
+# lets all the connections go silent and reports how long the expiry of all
+# of them takes after the timeout.
+#
+#   python3 bench_idle.py [--connections 4000] [--active 0.1] [--interval 0.05] [--duration 5] [--timeout 2]
+
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import tracemalloc
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.idle import IdleTracker
+
+FRAME = b'{"0":{}}\x00'
+
+class Peer():
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.closed = None
+
+    def idle_timeout(self):
+        self.writer.close()
+
+async def read_wait_for(peer, timeout, tracker):
+    try:
+        while True:
+            part = await asyncio.wait_for(peer.reader.read(65536), timeout=timeout)
+            if part == b'':
+                break
+    except asyncio.TimeoutError:
+        peer.writer.close()
+    peer.closed = time.perf_counter()
+
+async def read_tracker(peer, timeout, tracker):
+    tracker.add(peer)
+    try:
+        while True:
+            part = await peer.reader.read(65536)
+            tracker.touch(peer)
+            if part == b'':
+                break
+    finally:
+        tracker.remove(peer)
+    peer.closed = time.perf_counter()
+
+async def open_pairs(count):
+    pairs = []
+    for _ in range(count):
+        a, b = socket.socketpair()
+        reader, writer = await asyncio.open_connection(sock=a)
+        _, client = await asyncio.open_connection(sock=b)
+        pairs.append((Peer(reader, writer), client))
+    return pairs
+
+async def send(clients, interval, stop):
+    while not stop.is_set():
+        for client in clients:
+            client.write(FRAME)
+        await asyncio.sleep(interval)
+
+async def run(mode, args):
+    loop = asyncio.get_event_loop()
+    tracker = IdleTracker(loop, args.timeout, 0.1)
+    pairs = await open_pairs(args.connections)
+    reader = read_wait_for if mode == 'wait_for' else read_tracker
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tasks = [asyncio.ensure_future(reader(peer, args.timeout, tracker)) for peer, _ in pairs]
+    await asyncio.sleep(0.1)
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    timers = len(loop._scheduled) if hasattr(loop, '_scheduled') else -1
+
+    # the active clients keep their connections alive, the loop CPU is measured meanwhile
+    stop = asyncio.Event()
+    active = [client for _, client in pairs[:int(args.connections * args.active)]]
+    sender = asyncio.ensure_future(send(active, args.interval, stop))
+    cpu = time.process_time()
+    await asyncio.sleep(args.duration)
+    cpu = (time.process_time() - cpu) / args.duration
+    stop.set()
+    await sender
+
+    # every connection is silent from now on
+    silent = time.perf_counter()
+    await asyncio.gather(*tasks)
+    expiry = max(peer.closed for peer, _ in pairs) - silent - args.timeout
+    for peer, client in pairs:
+        client.close()
+    await asyncio.sleep(0)
+    return cpu, memory, timers, expiry
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--connections', type=int, default=4000)
+    parser.add_argument('--active', type=float, default=0.1)
+    parser.add_argument('--interval', type=float, default=0.05)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--timeout', type=float, default=2)
+    args = parser.parse_args()
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+
+    print('{0} connections, {1:.0f}% sending every {2}s, timeout {3}s'.format(args.connections, args.active * 100, args.interval, args.timeout))
+    print('{0:>10} {1:>14} {2:>14} {3:>14} {4:>22}'.format('idle', 'loop cpu (%)', 'memory (KiB)', 'loop timers', 'expiry after timeout (s)'))
+    for mode in ['wait_for', 'tracker']:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        cpu, memory, timers, expiry = loop.run_until_complete(run(mode, args))
+        loop.close()
+        print('{0:>10} {1:>14.1f} {2:>14.0f} {3:>14} {4:>22.2f}'.format(mode, cpu * 100, memory / 1024, timers, expiry))
+
+if __name__ == '__main__':
+    main()
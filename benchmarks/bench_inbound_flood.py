@@ -0,0 +1,123 @@
+# Benchmark for the processing of a flood of packets from one socket client.
+#
+# Feeds N pub packets to a socket Peer through an in-memory stream and a
+# connection handler that awaits a few times per packet (like the database
+# and redis calls do), once with a Task per read (how the packets were
+# dispatched before the inbound queue) and once through Peer._peer_loop and
+# its bounded InboundQueue. Reports the peak number of packets received and
+# not processed yet, the peak memory besides the flood itself and the packets
+# processed out of order. Time is measured with tracemalloc running.
+#
+#   python3 bench_inbound_flood.py [--packets 100000] [--awaits 3]
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import collections
+import tracemalloc
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.settings import ServerSettings
+from pyjmqt.server.core.socket_server import Peer
+from pyjmqt.server.core.framing import FrameBuffer
+
+class RecordingHandler():
+    def __init__(self, awaits):
+        self.awaits = awaits
+        self.processed = 0
+        self.outOfOrder = 0
+        self.last = -1
+        self.outboundStats = collections.Counter()
+
+    async def create_response(self, packet, peer):
+        for _ in range(self.awaits):
+            await asyncio.sleep(0)
+        seq = packet.packetData['dt']
+        if seq < self.last:
+            self.outOfOrder += 1
+        self.last = seq
+        self.processed += 1
+        return None, None
+
+    async def disconnect_client(self, client_id):
+        pass
+
+class CountingReader(asyncio.StreamReader):
+    received = 0
+
+    async def read(self, n = -1):
+        data = await super(CountingReader, self).read(n)
+        self.received += data.count(b'\0')
+        return data
+
+class NullWriter():
+    def close(self):
+        pass
+
+async def task_per_read(peer, reader, readSize):
+    buffer = FrameBuffer(None)
+    while True:
+        part = await reader.read(readSize)
+        if part == b'':
+            break
+        packets = buffer.feed(part)
+        if len(packets) > 0:
+            asyncio.Task(send_response(peer, packets))
+
+async def send_response(peer, packets):
+    for pck in packets:
+        await peer.parse_and_respond(pck)
+
+async def monitor(handler, reader, state):
+    while state['run']:
+        state['peak'] = max(state['peak'], reader.received - handler.processed)
+        await asyncio.sleep(0.001)
+
+async def run(mode, packets, awaits, settings):
+    handler = RecordingHandler(awaits)
+    reader = CountingReader()
+    reader.feed_data(b''.join(('{"pub": {"cn": "flood", "dt": ' + str(i) + ', "q": 0}}\0').encode('utf8') for i in range(packets)))
+    reader.feed_eof()
+    peer = Peer(reader, NullWriter(), 'bench', None, handler, settings, 'bench')
+    state = {'run': True, 'peak': 0}
+    watcher = asyncio.ensure_future(monitor(handler, reader, state))
+    # the flood itself is left out of the memory peak
+    tracemalloc.start()
+    start = time.perf_counter()
+    if mode == 'task per read':
+        await task_per_read(peer, reader, settings.SOCKET_READ_SIZE)
+    else:
+        await peer._peer_loop()
+    while handler.processed < packets:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    state['run'] = False
+    await watcher
+    return elapsed, state['peak'], memory, handler.outOfOrder
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--packets', type=int, default=100000)
+    parser.add_argument('--awaits', type=int, default=3)
+    args = parser.parse_args()
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+    print('{0:>14} {1:>12} {2:>10} {3:>14} {4:>16} {5:>14}'.format('mode', 'concurrency', 'time (s)', 'peak backlog', 'peak memory (MB)', 'out of order'))
+    for mode, concurrency in [('task per read', '-'), ('inbound queue', 1), ('inbound queue', 4)]:
+        settings = ServerSettings({'SOCKET_READ_SIZE': 65536, 'TIMEOUT_SECONDS': 15, 'INBOUND_CONCURRENCY': concurrency})
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        elapsed, peak, memory, outOfOrder = loop.run_until_complete(run(mode, args.packets, args.awaits, settings))
+        loop.close()
+        print('{0:>14} {1:>12} {2:>10.2f} {3:>14} {4:>16.1f} {5:>14}'.format(mode, concurrency, elapsed, peak, memory / 1e6, outOfOrder))
+
+if __name__ == '__main__':
+    main()
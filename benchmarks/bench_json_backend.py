@@ -0,0 +1,59 @@
+# Benchmark for the JSON backends of the serializer.
+#
+# For each backend installed (orjson, ujson, the standard library), parses
+# --count pub packets and generates as many push frames (utf8 bytes, as
+# written to a socket), for a small packet and a 1 KiB document. Reports the
+# packets per second of each direction and of a parse + generate round trip.
+#
+#   python3 bench_json_backend.py [--count 100000]
+
+import os
+import sys
+import time
+import random
+import argparse
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+import pyjmqt.server.logger as logger
+import pyjmqt.server.core.serializer as serializer
+from pyjmqt.server.core.packets import PacketGenerator
+
+def payloads():
+    random.seed(1)
+    document = {'id': 1234, 'user': 'sensor-17', 'tags': ['a', 'b', 'c'],
+                'readings': [{'t': 1544000000 + i, 'v': round(random.random() * 100, 3)} for i in range(30)]}
+    return [('small', {'t': 1544000000, 'v': 21.5}), ('1 KiB doc', document)]
+
+def measure(backend, payload, count):
+    pub = serializer.StdlibBackend.dumps_bytes({'pub': {'cn': 'sensors/17', 'dt': payload, 'q': 1, 'id': '42'}})
+    push = PacketGenerator.generate_push_req('sensors/17', payload, '42', 'client-1', False, 1)
+    start = time.perf_counter()
+    for _ in range(count):
+        backend.loads(pub)
+    parse = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(count):
+        backend.dumps_bytes(push)
+    generate = time.perf_counter() - start
+    return count / parse, count / generate, count / (parse + generate)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=100000)
+    args = parser.parse_args()
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+    print('{0:>12} {1:>10} {2:>16} {3:>16} {4:>18}'.format('payload', 'backend', 'parse (pck/s)', 'push (pck/s)', 'round trip (pck/s)'))
+    for name, payload in payloads():
+        for backend in [serializer.StdlibBackend, serializer.UjsonBackend, serializer.OrjsonBackend]:
+            if backend.name not in serializer.BACKENDS:
+                print('{0:>12} {1:>10} {2:>16}'.format(name, backend.name, 'not installed'))
+                continue
+            parse, generate, roundTrip = measure(backend, payload, args.count)
+            print('{0:>12} {1:>10} {2:>16.0f} {3:>16.0f} {4:>18.0f}'.format(name, backend.name, parse, generate, roundTrip))
+
+if __name__ == '__main__':
+    main()
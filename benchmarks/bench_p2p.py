@@ -0,0 +1,181 @@
+# Benchmark for the p2p (#) channels.
+#
+# Runs the socket server (ConnectionHandler and SocketServer, SQLite in a
+# temporary directory) in a child process. One receiver is subscribed to a
+# broadcast channel and owns the p2p channel #receiver. The same publisher
+# publishes to both channels, at QoS 0 and QoS 1. The broadcast channel goes
+# through the subscription fan-out and the p2p channel through the direct
+# path. Reports the server time per QoS 0 pub of each path (in process, the
+# push is handed to a peer which drops it), then over the sockets the pushes
+# delivered per second when --count packets (--qos1-count at QoS 1, each pub
+# waits for its commit) are published at once, and the p50/p99 latency from
+# publish to push when --samples packets are published at --rate per second
+# (--qos1-rate at QoS 1).
+#
+#   python3 bench_p2p.py [--count 20000] [--qos1-count 1000] [--samples 1000] [--rate 500] [--qos1-rate 50]
+
+import os
+import sys
+import time
+import signal
+import asyncio
+import argparse
+import tempfile
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.api import Server
+from pyjmqt.server.core.settings import ServerSettings
+from pyjmqt.server.core.connection_handler import ConnectionHandler
+from pyjmqt.server.core.socket_server import SocketServer
+from bench_event_loop import Connection, ok, control, notify, PORT
+
+RECEIVER = 'receiver'
+CHANNELS = [('broadcast', 'bench'), ('p2p', '#' + RECEIVER)]
+
+class NullPeer():
+    tag = 'bench'
+    client_id = id = RECEIVER
+
+    def __init__(self):
+        self.pushes = 0
+
+    async def send(self, data):
+        self.pushes += 1
+
+def create_handler(eventLoop, dbPath):
+    settings = ServerSettings({'SOCKET_PORT': PORT, 'TIMEOUT_SECONDS': 600, 'ENABLE_REDIS': 0,
+                               'ENABLE_MYSQL': 0, 'ENABLE_SSL': 0, 'SQLITE_DB_PATH': dbPath})
+    handler = ConnectionHandler(settings, eventLoop)
+    handler.start()
+    for _, channel in CHANNELS:
+        eventLoop.run_until_complete(handler.force_sub(RECEIVER, channel, 1))
+    return settings, handler
+
+# server time per pub, the broadcast pushes are delivered by tasks, the measure waits for all of them
+def measure_routing(dbPath, count):
+    eventLoop = asyncio.new_event_loop()
+    asyncio.set_event_loop(eventLoop)
+    _, handler = create_handler(eventLoop, dbPath)
+    peer = NullPeer()
+    handler.peers[RECEIVER] = {'peer': peer, 'protocol': 'bench'}
+
+    async def publish(channel):
+        peer.pushes = 0
+        start = time.perf_counter()
+        for i in range(count):
+            await handler.pub('publisher', channel, i, False, 0)
+        while peer.pushes < count:
+            await asyncio.sleep(0)
+        return (time.perf_counter() - start) / count * 1e6
+
+    results = [(name, eventLoop.run_until_complete(publish(channel))) for name, channel in CHANNELS]
+    eventLoop.close()
+    return results
+
+def run_server(dbPath):
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+    eventLoop = asyncio.new_event_loop()
+    asyncio.set_event_loop(eventLoop)
+    callbacks = Server.CallbackWrapper()
+    callbacks.validate_conn_callback = callbacks.validate_sub_callback = callbacks.validate_pub_callback = ok
+    callbacks.validate_unsub_callback = callbacks.validate_auth_callback = ok
+    callbacks.control_data_callback = control
+    callbacks.disconnection_callback = callbacks.conn_close_callback = notify
+    settings, handler = create_handler(eventLoop, dbPath)
+    socketServer = SocketServer(eventLoop, callbacks, handler, settings)
+    eventLoop.run_until_complete(asyncio.start_server(socketServer.handle_client, '127.0.0.1', PORT))
+    eventLoop.run_forever()
+
+async def drain(connection):
+    # the pub acks of the QoS 1 pubs
+    try:
+        while True:
+            await connection.receive()
+    except asyncio.CancelledError:
+        pass
+
+async def receive(connection, count, latencies):
+    for _ in range(count):
+        packet = await connection.receive()
+        if latencies is not None:
+            latencies.append(time.time() - packet['push']['dt'])
+
+async def measure(receiver, publisher, channel, qos, count, samples, rate):
+    task = asyncio.ensure_future(receive(receiver, count, None))
+    start = time.perf_counter()
+    for i in range(count):
+        publisher.send({'pub': {'cn': channel, 'dt': i, 'q': qos, 'id': str(i)}})
+        if i % 100 == 0:
+            await publisher.writer.drain()
+    await task
+    throughput = count / (time.perf_counter() - start)
+
+    latencies = []
+    task = asyncio.ensure_future(receive(receiver, samples, latencies))
+    for i in range(samples):
+        publisher.send({'pub': {'cn': channel, 'dt': time.time(), 'q': qos, 'id': str(i)}})
+        await asyncio.sleep(1.0 / rate)
+    await task
+    latencies.sort()
+    return throughput, latencies[len(latencies) // 2] * 1e3, latencies[int(len(latencies) * 0.99)] * 1e3
+
+async def run(args):
+    receiver = await Connection.open(RECEIVER)
+    publisher = await Connection.open('publisher')
+    drainer = asyncio.ensure_future(drain(publisher))
+    await asyncio.sleep(0.5)
+    results = []
+    for qos in [0, 1]:
+        for name, channel in CHANNELS:
+            count, rate = (args.count, args.rate) if qos == 0 else (args.qos1_count, args.qos1_rate)
+            results.append((name, qos) + await measure(receiver, publisher, channel, qos, count, args.samples, rate))
+    drainer.cancel()
+    await drainer
+    receiver.close()
+    publisher.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=20000)
+    parser.add_argument('--qos1-count', type=int, default=1000)
+    parser.add_argument('--samples', type=int, default=1000)
+    parser.add_argument('--rate', type=int, default=500)
+    parser.add_argument('--qos1-rate', type=int, default=50)
+    args = parser.parse_args()
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        routing = measure_routing(os.path.join(tmp, 'routing.db'), args.count)
+    print('{0:>10} {1:>16}'.format('channel', 'us per pub'))
+    for name, elapsed in routing:
+        print('{0:>10} {1:>16.1f}'.format(name, elapsed))
+    print('')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_server(os.path.join(tmp, 'bench.db'))
+            finally:
+                os._exit(0)
+        try:
+            eventLoop = asyncio.new_event_loop()
+            asyncio.set_event_loop(eventLoop)
+            results = eventLoop.run_until_complete(run(args))
+            eventLoop.close()
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+
+    print('{0:>10} {1:>4} {2:>12} {3:>10} {4:>10}'.format('channel', 'qos', 'pushes/s', 'p50 (ms)', 'p99 (ms)'))
+    for result in results:
+        print('{0:>10} {1:>4} {2:>12.0f} {3:>10.2f} {4:>10.2f}'.format(*result))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# Benchmark for the payload passthrough of the pub packets.
+#
+# For a 1 KiB, an 8 KiB and a 64 KiB document, runs what the server
+# does with a QoS 1 pub: parses the frame (PacketParser.parse_packet),
+# encodes the push frame (EncodedPacket.socket_frame) and the stored packet
+# (serializer.dumps_stored), once with the payload decoded and once with
+# PAYLOAD_PASSTHROUGH. Reports the time per pub and the memory taken by the
+# payloads of --keep parsed packets (e.g. held by the retained store).
+#
+#   python3 bench_passthrough.py [--count 500] [--keep 500] [--backend auto]
+
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+import pyjmqt.server.logger as logger
+import pyjmqt.server.core.serializer as serializer
+from pyjmqt.server.core.constants import Protocol, JSONKeys
+from pyjmqt.server.core.packets import PacketParser, PacketGenerator, EncodedPacket
+
+def document(readings):
+    random.seed(1)
+    return {'id': 1234, 'user': 'sensor-17', 'tags': ['a', 'b', 'c'],
+            'readings': [{'t': 1544000000 + i, 'v': round(random.random() * 100, 3)} for i in range(readings)]}
+
+def frames():
+    result = []
+    for name, payload in [('1 KiB doc', document(30)), ('8 KiB doc', document(250)), ('64 KiB doc', document(2000))]:
+        frame = serializer.StdlibBackend.dumps_bytes({'pub': {'cn': 'sensors/17', 'dt': payload, 'q': 1, 'id': '42'}})
+        result.append((name, frame))
+    return result
+
+def pub(frame):
+    packet, msg = PacketParser.parse_packet(frame, Protocol.SOCKET)
+    data = packet.packetData[JSONKeys.data]
+    EncodedPacket(PacketGenerator.generate_push_req('sensors/17', data, '42', 'client-1', False, 1)).socket_frame()
+    serializer.dumps_stored(data)
+    return data
+
+def measure(frame, count, keep):
+    start = time.perf_counter()
+    for _ in range(count):
+        pub(frame)
+    elapsed = (time.perf_counter() - start) / count
+    tracemalloc.start()
+    kept = [pub(frame) for _ in range(keep)]
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return elapsed, memory / len(kept)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=500)
+    parser.add_argument('--keep', type=int, default=500)
+    parser.add_argument('--backend', default='auto')
+    args = parser.parse_args()
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+    print('JSON backend ' + serializer.set_backend(args.backend))
+    print('{0:>12} {1:>12} {2:>14} {3:>16} {4:>20}'.format('payload', 'frame (B)', 'passthrough', 'per pub (us)', 'kept payload (B)'))
+    for name, frame in frames():
+        for enabled in [False, True]:
+            serializer.set_passthrough(enabled, 0)
+            elapsed, memory = measure(frame, args.count, args.keep)
+            print('{0:>12} {1:>12} {2:>14} {3:>16.1f} {4:>20.0f}'.format(name, len(frame), 'on' if enabled else 'off', elapsed * 1e6, memory))
+
+if __name__ == '__main__':
+    main()
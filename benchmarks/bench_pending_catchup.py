@@ -0,0 +1,86 @@
+# Benchmark for the delivery of pending QoS1 packets to a reconnecting client.
+#
+# Queues N QoS1 packets for an offline client in a temporary SQLite
+# database, then reconnects it through a fake peer that acknowledges every
+# push after --rtt milliseconds, and measures the time until the last
+# pending packet is acknowledged. A window of 1 with a prefetch of 1 is how
+# the pending packets were sent before the in-flight window.
+#
+#   python3 bench_pending_catchup.py [--pending 1000] [--rtt 20]
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.settings import ServerSettings
+from pyjmqt.server.core.connection_handler import ConnectionHandler
+from pyjmqt.server.core.constants import PacketTypes, JSONKeys
+
+CLIENT_ID = 'mobile'
+
+class AckingPeer():
+    def __init__(self, handler, loop, rtt):
+        self.handler = handler
+        self.loop = loop
+        self.rtt = rtt
+        self.client_id = CLIENT_ID
+        self.id = 0
+        self.tag = 'bench'
+        self.address = '127.0.0.1'
+        self.acked = 0
+
+    async def send(self, frame):
+        pck_id = frame.packet[PacketTypes.push][JSONKeys.packetId]
+        self.loop.call_later(self.rtt, lambda: asyncio.ensure_future(self.ack(pck_id)))
+
+    async def ack(self, pck_id):
+        await self.handler.process_push_ack(pck_id, CLIENT_ID)
+        self.acked += 1
+
+async def catch_up(handler, peer, pending):
+    handler.peers[CLIENT_ID] = {'peer': peer, 'protocol': 'socket'}
+    start = time.perf_counter()
+    await handler.send_pending_pub(CLIENT_ID)
+    while peer.acked < pending:
+        await asyncio.sleep(0.001)
+    return time.perf_counter() - start
+
+async def fill(handler, pending):
+    await handler.dbService.insert_subscription(CLIENT_ID, 'bench', True)
+    await asyncio.gather(*[handler.dbService.insert_packet('p' + str(i), 'sender', 'bench', {'value': i}, [CLIENT_ID]) for i in range(pending)])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pending', type=int, default=1000)
+    parser.add_argument('--rtt', type=float, default=20, help='milliseconds')
+    args = parser.parse_args()
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+
+    print('{0:>8} {1:>10} {2:>10} {3:>14}'.format('window', 'prefetch', 'time (s)', 'packets/s'))
+    for window, prefetch in [(1, 1), (16, 256), (64, 256), (256, 256)]:
+        with tempfile.TemporaryDirectory() as tmp:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            settings = ServerSettings({'SQLITE_DB_PATH': os.path.join(tmp, 'bench.db'), 'PENDING_WINDOW': window, 'PENDING_PREFETCH': prefetch})
+            handler = ConnectionHandler(settings, loop)
+            loop.run_until_complete(fill(handler, args.pending))
+            peer = AckingPeer(handler, loop, args.rtt / 1000.0)
+            elapsed = loop.run_until_complete(catch_up(handler, peer, args.pending))
+            for task in (handler.dbService.journal.task, handler.dbService.collector.task):
+                if task is not None:
+                    task.cancel()
+                    loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+            loop.close()
+            print('{0:>8} {1:>10} {2:>10.2f} {3:>14.0f}'.format(window, prefetch, elapsed, args.pending / elapsed))
+
+if __name__ == '__main__':
+    main()
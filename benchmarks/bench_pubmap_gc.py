@@ -0,0 +1,81 @@
+# Benchmark for the cleanup of acknowledged QoS1 pubmaps.
+#
+# Stores P publishes fanned out to N subscribers in a temporary SQLite
+# database, acknowledges every pubmap and measures how long the cleanup
+# takes until no pubmap and no packet is left, once with one delete per
+# pubmap and one count per packet (how the pubmaps were removed before the
+# collector) and once through the set-based PubmapCollector.
+#
+#   python3 bench_pubmap_gc.py [--publishes 1000] [--subscribers 50]
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import datetime
+import tempfile
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.settings import ServerSettings
+from pyjmqt.server.core.services.dbservice import SQLiteService
+from pyjmqt.server.core.services.peewee_base import Packets, Pubmaps
+
+def fill(publishes, receivers):
+    now = datetime.datetime.utcnow()
+    packets = [{'packet_id': 'p' + str(i), 'sender_id': 'sender', 'channel': 'bench', 'data': '{"d": 1}', 'timestamp': now} for i in range(publishes)]
+    pubmaps = [{'packet_id': 'p' + str(i), 'client_id': client_id, 'channel': 'bench'} for i in range(publishes) for client_id in receivers]
+    for i in range(0, len(packets), 150):
+        Packets.insert_many(packets[i:i + 150]).execute()
+    for i in range(0, len(pubmaps), 150):
+        Pubmaps.insert_many(pubmaps[i:i + 150]).execute()
+    return [(p['packet_id'], p['client_id']) for p in pubmaps]
+
+def per_row(acks):
+    for packet_id, client_id in acks:
+        Pubmaps.delete().where(Pubmaps.packet_id == packet_id, Pubmaps.client_id == client_id).execute()
+    for packet_id, _ in acks:
+        if Pubmaps.select().where(Pubmaps.packet_id == packet_id).count() == 0:
+            Packets.delete().where(Packets.packet_id == packet_id).execute()
+
+async def run_per_row(db, acks):
+    await db.dbExecutor.run(per_row, acks)
+
+async def run_collector(db, acks):
+    for packet_id, client_id in acks:
+        await db.remove_pubmap(packet_id, client_id)
+    while db.collector.removedPubmaps < len(acks):
+        await asyncio.sleep(0.001)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--publishes', type=int, default=1000)
+    parser.add_argument('--subscribers', type=int, default=50)
+    args = parser.parse_args()
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+    receivers = ['client-' + str(i) for i in range(args.subscribers)]
+
+    print('{0:>10} {1:>10} {2:>10} {3:>14}'.format('mode', 'pubmaps', 'time (s)', 'pubmaps/s'))
+    for name, func in [('per-row', run_per_row), ('collector', run_collector)]:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = SQLiteService(ServerSettings({'SQLITE_DB_PATH': os.path.join(tmp, 'bench.db')}))
+            acks = fill(args.publishes, receivers)
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            start = time.perf_counter()
+            loop.run_until_complete(func(db, acks))
+            elapsed = time.perf_counter() - start
+            if db.collector.task is not None:
+                db.collector.task.cancel()
+                loop.run_until_complete(asyncio.gather(db.collector.task, return_exceptions=True))
+            loop.close()
+            assert Pubmaps.select().count() == 0 and Packets.select().count() == 0
+            print('{0:>10} {1:>10} {2:>10.2f} {3:>14.0f}'.format(name, len(acks), elapsed, len(acks) / elapsed))
+
+if __name__ == '__main__':
+    main()
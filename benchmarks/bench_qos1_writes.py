@@ -0,0 +1,74 @@
+# Benchmark for the storage of QoS1 publishes.
+#
+# Stores P publishes fanned out to N subscribers in a temporary SQLite
+# database, once with one autocommit statement per row (how Packets and
+# Pubmaps were written before the write journal) and once through
+# PeeweeBase.insert_packet, which goes through the write journal.
+#
+#   python3 bench_qos1_writes.py [--publishes 200] [--subscribers 100]
+
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import datetime
+import tempfile
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.settings import ServerSettings
+from pyjmqt.server.core.services.dbservice import SQLiteService
+from pyjmqt.server.core.services.peewee_base import Packets, Pubmaps
+
+def per_row(pck_id, receivers):
+    Packets.create(packet_id = pck_id, sender_id = 'sender', channel = 'bench',
+                   data = json.dumps({'d': {'value': pck_id}}), timestamp = datetime.datetime.utcnow())
+    for client_id in receivers:
+        Pubmaps.create(packet_id = pck_id, client_id = client_id, channel = 'bench')
+    return 1 + len(receivers)
+
+async def run_per_row(db, publishes, receivers):
+    statements = 0
+    for _ in range(publishes):
+        statements += await db.dbExecutor.run(per_row, str(uuid.uuid1()), receivers)
+    return statements
+
+async def run_journal(db, publishes, receivers):
+    # publishes from different peers run concurrently on the server
+    await asyncio.gather(*[db.insert_packet(str(uuid.uuid1()), 'sender', 'bench', {'value': i}, receivers) for i in range(publishes)])
+    return db.journal.get_metrics()['statements']
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--publishes', type=int, default=200)
+    parser.add_argument('--subscribers', type=int, default=100)
+    args = parser.parse_args()
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+    receivers = ['client-' + str(i) for i in range(args.subscribers)]
+    rows = args.publishes * (1 + args.subscribers)
+
+    print('{0:>10} {1:>10} {2:>12} {3:>10} {4:>12}'.format('mode', 'rows', 'statements', 'time (s)', 'rows/s'))
+    for name, func in [('per-row', run_per_row), ('journal', run_journal)]:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = SQLiteService(ServerSettings({'SQLITE_DB_PATH': os.path.join(tmp, 'bench.db')}))
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            start = time.perf_counter()
+            statements = loop.run_until_complete(func(db, args.publishes, receivers))
+            elapsed = time.perf_counter() - start
+            if db.journal.task is not None:
+                db.journal.task.cancel()
+                loop.run_until_complete(asyncio.gather(db.journal.task, return_exceptions=True))
+            loop.close()
+            assert Pubmaps.select().count() == args.publishes * args.subscribers
+            print('{0:>10} {1:>10} {2:>12} {3:>10.2f} {4:>12.0f}'.format(name, rows, statements, elapsed, rows / elapsed))
+
+if __name__ == '__main__':
+    main()
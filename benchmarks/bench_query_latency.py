@@ -0,0 +1,103 @@
+# Benchmark for the lookups of the database layer on large tables.
+#
+# Fills a temporary SQLite database with the schema of the old models (no
+# indexes) and --rows pubmaps (one packet per --fanout pubmaps), times the
+# hot lookups, then runs the startup migration, which adds the indexes and
+# unique keys of the current models, and times the same lookups again.
+#
+#   python3 bench_query_latency.py [--rows 1000000] [--fanout 10] [--samples 50]
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.services import migrations
+from pyjmqt.server.core.services.peewee_base import DB_PROXY, MODELS, Packets, Pubmaps, Connections
+
+from peewee import SqliteDatabase
+
+OLD_SCHEMA = '''
+CREATE TABLE "connections" ("id" INTEGER NOT NULL PRIMARY KEY, "client_id" TEXT NOT NULL, "protocol" TEXT NOT NULL, "address" TEXT NOT NULL, "timestamp" DATETIME NOT NULL);
+CREATE TABLE "subscriptions" ("id" INTEGER NOT NULL PRIMARY KEY, "client_id" TEXT NOT NULL, "channel" TEXT NOT NULL, "is_tmp" INTEGER NOT NULL);
+CREATE TABLE "retainedpackets" ("id" INTEGER NOT NULL PRIMARY KEY, "sender_id" TEXT NOT NULL, "channel" TEXT NOT NULL, "data" TEXT NOT NULL, "timestamp" DATETIME NOT NULL);
+CREATE TABLE "packets" ("id" INTEGER NOT NULL PRIMARY KEY, "packet_id" TEXT NOT NULL, "sender_id" TEXT NOT NULL, "channel" TEXT NOT NULL, "data" TEXT NOT NULL, "timestamp" DATETIME NOT NULL);
+CREATE TABLE "pubmaps" ("id" INTEGER NOT NULL PRIMARY KEY, "packet_id" TEXT NOT NULL, "client_id" TEXT NOT NULL, "channel" TEXT NOT NULL);
+'''
+
+CLIENTS = 10000
+CHANNELS = 100
+
+def fill(path, rows, fanout):
+    con = sqlite3.connect(path)
+    con.executescript(OLD_SCHEMA)
+    packets = rows // fanout
+    con.executemany('INSERT INTO packets (packet_id, sender_id, channel, data, timestamp) VALUES (?, ?, ?, ?, ?)',
+                    (('p' + str(i), 'sender', 'ch' + str(i % CHANNELS), '{"d": "data"}', '2018-01-01 00:00:00') for i in range(packets)))
+    con.executemany('INSERT INTO pubmaps (packet_id, client_id, channel) VALUES (?, ?, ?)',
+                    (('p' + str(i // fanout), 'c' + str(i % CLIENTS), 'ch' + str((i // fanout) % CHANNELS)) for i in range(rows)))
+    con.executemany('INSERT INTO connections (client_id, protocol, address, timestamp) VALUES (?, ?, ?, ?)',
+                    (('c' + str(i), 'socket', '127.0.0.1', '2018-01-01 00:00:00') for i in range(CLIENTS)))
+    con.commit()
+    con.close()
+    return packets
+
+def lookups(packets):
+    # the queries of get_pubmap, get_packet, the orphan check of remove_packets_by_pubmap,
+    # remove_pubmap_by_channel and check_connection
+    return [
+        ('pubmaps by client', lambda: list(Pubmaps.select().where(Pubmaps.client_id == 'c' + str(random.randrange(CLIENTS))))),
+        ('packet by id', lambda: Packets.get_or_none(Packets.packet_id == 'p' + str(random.randrange(packets)))),
+        ('pubmaps count by packet', lambda: Pubmaps.select().where(Pubmaps.packet_id == 'p' + str(random.randrange(packets))).count()),
+        ('pubmaps by client+channel', lambda: list(Pubmaps.select().where(Pubmaps.channel == 'ch' + str(random.randrange(CHANNELS)),
+                                                                           Pubmaps.client_id == 'c' + str(random.randrange(CLIENTS))))),
+        ('connection by client', lambda: Connections.get_or_none(Connections.client_id == 'c' + str(random.randrange(CLIENTS))))
+    ]
+
+def measure(packets, samples):
+    result = []
+    for name, query in lookups(packets):
+        start = time.perf_counter()
+        for _ in range(samples):
+            query()
+        result.append((name, (time.perf_counter() - start) / samples * 1e3))
+    return result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--fanout', type=int, default=10)
+    parser.add_argument('--samples', type=int, default=50)
+    args = parser.parse_args()
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        start = time.perf_counter()
+        packets = fill(path, args.rows, args.fanout)
+        print('filled {0} pubmaps and {1} packets in {2:.1f}s'.format(args.rows, packets, time.perf_counter() - start))
+        db = SqliteDatabase(path)
+        DB_PROXY.initialize(db)
+        db.connect()
+        before = measure(packets, args.samples)
+        start = time.perf_counter()
+        migrations.migrate(db, MODELS)
+        print('migration (indexes) took {0:.1f}s'.format(time.perf_counter() - start))
+        after = measure(packets, args.samples)
+        db.close()
+
+    print('{0:>28} {1:>16} {2:>16}'.format('lookup', 'no index (ms)', 'indexed (ms)'))
+    for (name, slow), (_, fast) in zip(before, after):
+        print('{0:>28} {1:>16.3f} {2:>16.3f}'.format(name, slow, fast))
+
+if __name__ == '__main__':
+    main()
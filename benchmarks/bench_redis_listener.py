@@ -0,0 +1,127 @@
+# Benchmark for the redis subscription reader of CacheService.
+#
+# Reports the CPU used by the reader while the server is idle and the
+# latency between a redis PUBLISH and the delivery of the message to the
+# pub callback on the server's event loop. The busy-polling reader that was
+# used before is measured as a baseline for the idle CPU.
+#
+# Uses a local redis-server by default, pass --fake to use fakeredis instead.
+#
+#   python3 bench_redis_listener.py [--fake] [--idle 5] [--messages 2000]
+
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import threading
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+# storage is not needed by the redis reader, the cleanup thread only needs these calls
+class NullDbService():
+    def load_subscriptions(self):
+        pass
+    async def insert_subscription(self, *args, **kwargs):
+        pass
+    async def remove_subscription(self, *args, **kwargs):
+        pass
+
+# points redis.Redis (used by CacheService) to a shared in-process fakeredis server
+def use_fakeredis():
+    import redis
+    import fakeredis
+    server = fakeredis.FakeServer()
+    redis.Redis = lambda **kwargs: fakeredis.FakeRedis(server=server)
+    return redis
+
+def cpu_during(seconds):
+    start_cpu, start = time.process_time(), time.perf_counter()
+    time.sleep(seconds)
+    return (time.process_time() - start_cpu) / (time.perf_counter() - start) * 100
+
+def busy_poll_baseline(redis_module, settings, seconds):
+    conn = redis_module.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB_INDEX, password=settings.REDIS_PASSWORD)
+    pubsub = conn.pubsub()
+    pubsub.subscribe('test')
+    state = {'run': True}
+    def poll():
+        while state['run']:
+            pubsub.get_message()
+    t = threading.Thread(target=poll)
+    t.start()
+    usage = cpu_during(seconds)
+    state['run'] = False
+    t.join()
+    return usage
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fake', action='store_true', help='use fakeredis instead of a local redis-server')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--idle', type=float, default=5.0, help='seconds to measure idle cpu')
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.fake:
+        redis_module = use_fakeredis()
+    else:
+        import redis as redis_module
+
+    import pyjmqt.server.logger as logger
+    from pyjmqt.server.core.settings import ServerSettings
+    from pyjmqt.server.core.services.cache import CacheService
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+    settings = ServerSettings({'ENABLE_REDIS': 1, 'REDIS_HOST': args.host, 'REDIS_PORT': args.port,
+                               'REDIS_DB_INDEX': 0, 'REDIS_PASSWORD': None})
+
+    print('busy-poll reader idle cpu : {0:6.1f} %'.format(busy_poll_baseline(redis_module, settings, args.idle)))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    latencies = []
+    done = asyncio.Event()
+
+    async def on_pub(channel, data, sender, qos, pck_id, client_id):
+        latencies.append(time.perf_counter() - data['t'])
+        if len(latencies) == args.messages:
+            done.set()
+
+    async def on_disconnect(client_id):
+        pass
+
+    cache = CacheService(settings, loop, 'bench-server', NullDbService(), on_pub, on_disconnect)
+    loop.run_until_complete(cache.process_connection('bench-client'))
+    usage = cpu_during(args.idle)
+    print('blocking reader idle cpu  : {0:6.1f} %'.format(usage))
+
+    publisher = redis_module.Redis(host=args.host, port=args.port, db=0, password=None)
+    channel = CacheService.REDIS_PUB_CHANNEL.format(client_id='bench-client')
+
+    async def publish_all():
+        for i in range(args.messages):
+            packet = {'c': 'bench', 'd': {'t': time.perf_counter()}, 'f': 'sender', 'q': 0, 'id': str(i)}
+            publisher.publish(channel, json.dumps({'p': packet, 'c': 'bench-client'}))
+            # give the loop a chance to run the deliveries, like a server handling other peers would
+            if i % 50 == 0:
+                await asyncio.sleep(0)
+        await asyncio.wait_for(done.wait(), 30)
+
+    start = time.perf_counter()
+    loop.run_until_complete(publish_all())
+    elapsed = time.perf_counter() - start
+    cache.run = False
+
+    latencies.sort()
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1e3
+    print('delivered {0} messages in {1:.2f}s ({2:.0f} msg/s)'.format(len(latencies), elapsed, len(latencies) / elapsed))
+    print('latency ms : p50 {0:.3f}  p99 {1:.3f}  max {2:.3f}'.format(pct(0.5), pct(0.99), latencies[-1] * 1e3))
+
+if __name__ == '__main__':
+    main()
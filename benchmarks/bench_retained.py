@@ -0,0 +1,80 @@
+# Benchmark for the delivery of retained packets in a reconnect storm.
+#
+# Stores one retained packet per channel in a temporary SQLite database,
+# then reconnects C clients subscribed to K channels each and sends them
+# their retained packets, once with a database query and a push packet per
+# client (how send_retained worked before the retained store) and once
+# through the in-memory RetainedStore, with a cap large enough for all the
+# channels and with a cap holding a tenth of them.
+#
+#   python3 bench_retained.py [--channels 1000] [--clients 2000] [--per-client 20]
+
+import os
+import sys
+import time
+import random
+import json
+import asyncio
+import argparse
+import tempfile
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.settings import ServerSettings
+from pyjmqt.server.core.services.dbservice import SQLiteService
+from pyjmqt.server.core.services.retained import RetainedStore
+from pyjmqt.server.core.packets import PacketGenerator, EncodedPacket
+
+def sink(frame):
+    # what the socket peer writes
+    if isinstance(frame, EncodedPacket):
+        return frame.socket_frame()
+    return (json.dumps(frame) + '\0').encode('utf8')
+
+async def storm_db(db, store, subscriptions):
+    for channels in subscriptions:
+        for packet in await db.get_retained_packets(channels):
+            sink(PacketGenerator.generate_push_req(packet['channel'], packet['data'], 0, packet['sender_id'], True, 0))
+
+async def storm_store(db, store, subscriptions):
+    for channels in subscriptions:
+        for frame in await store.get(channels):
+            sink(frame)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--channels', type=int, default=1000)
+    parser.add_argument('--clients', type=int, default=2000)
+    parser.add_argument('--per-client', type=int, default=20)
+    args = parser.parse_args()
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+    random.seed(1)
+    # a few busy channels and a long tail
+    names = ['channel-' + str(i) for i in range(args.channels)]
+    subscriptions = [random.sample(names[:args.channels // 10], args.per_client // 2) + random.sample(names, args.per_client // 2) for _ in range(args.clients)]
+    data = {'text': 'x' * 200, 'values': list(range(20))}
+
+    print('{0:>14} {1:>10} {2:>12} {3:>10} {4:>10}'.format('mode', 'time (s)', 'clients/s', 'db loads', 'evictions'))
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SQLiteService(ServerSettings({'SQLITE_DB_PATH': os.path.join(tmp, 'bench.db')}))
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(db.insert_retained_packets([{'sender_id': 'sender', 'channel': name, 'data': data} for name in names]))
+        entry = len(PacketGenerator.generate_push_frame(names[0], data, 0, 'sender', True, 0).text()) * 2 + RetainedStore.ENTRY_OVERHEAD
+        for name, func, maxBytes in [('database', storm_db, 0), ('store', storm_store, entry * args.channels * 2), ('store 10% cap', storm_store, entry * args.channels // 10)]:
+            store = RetainedStore(db, maxBytes)
+            store.load()
+            start = time.perf_counter()
+            loop.run_until_complete(func(db, store, subscriptions))
+            elapsed = time.perf_counter() - start
+            metrics = store.get_metrics()
+            loads = args.clients if func is storm_db else metrics['db_loads']
+            print('{0:>14} {1:>10.2f} {2:>12.0f} {3:>10} {4:>10}'.format(name, elapsed, args.clients / elapsed, loads, metrics['evictions']))
+        loop.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+# Benchmark for the shared subscriptions ($share/<group>/<filter>).
+#
+# Runs the socket server (ConnectionHandler and SocketServer, SQLite in a
+# temporary directory) in a child process. The consumers subscribe to the
+# same shared subscription and spend --work-ms per job (a sleep, the
+# consumers run concurrently). First --count QoS 0 jobs are published to
+# groups of each --sizes consumers, the jobs processed per second should grow
+# with the size of the group. Then --qos1-count QoS 1 jobs are published to
+# a group of --slow-group consumers where one is --slow-factor times slower,
+# with each SHARED_SUB_STRATEGY, and the time to process all the jobs and the
+# share of the slow consumer are reported.
+#
+#   python3 bench_shared.py [--count 2000] [--work-ms 2] [--sizes 1,2,4,8] [--qos1-count 500] [--slow-group 4] [--slow-factor 50]
+
+import os
+import sys
+import time
+import signal
+import asyncio
+import argparse
+import tempfile
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.api import Server
+from pyjmqt.server.core.settings import ServerSettings
+from pyjmqt.server.core.connection_handler import ConnectionHandler
+from pyjmqt.server.core.socket_server import SocketServer
+from pyjmqt.server.core.shared import ROUND_ROBIN, LEAST_OUTSTANDING
+from bench_event_loop import Connection, ok, control, notify, PORT
+
+GROUP = '$share/workers/'
+
+def run_server(dbPath, strategy):
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+    eventLoop = asyncio.new_event_loop()
+    asyncio.set_event_loop(eventLoop)
+    callbacks = Server.CallbackWrapper()
+    callbacks.validate_conn_callback = callbacks.validate_sub_callback = callbacks.validate_pub_callback = ok
+    callbacks.validate_unsub_callback = callbacks.validate_auth_callback = ok
+    callbacks.control_data_callback = control
+    callbacks.disconnection_callback = callbacks.conn_close_callback = notify
+    settings = ServerSettings({'SOCKET_PORT': PORT, 'TIMEOUT_SECONDS': 600, 'ENABLE_REDIS': 0, 'ENABLE_MYSQL': 0,
+                               'ENABLE_SSL': 0, 'SQLITE_DB_PATH': dbPath, 'SHARED_SUB_STRATEGY': strategy})
+    handler = ConnectionHandler(settings, eventLoop)
+    handler.start()
+    socketServer = SocketServer(eventLoop, callbacks, handler, settings)
+    eventLoop.run_until_complete(asyncio.start_server(socketServer.handle_client, '127.0.0.1', PORT))
+    eventLoop.run_forever()
+
+# runs a server with a strategy in a child process while the coroutine runs
+def with_server(strategy, coroutine):
+    with tempfile.TemporaryDirectory() as tmp:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_server(os.path.join(tmp, 'bench.db'), strategy)
+            finally:
+                os._exit(0)
+        try:
+            eventLoop = asyncio.new_event_loop()
+            asyncio.set_event_loop(eventLoop)
+            result = eventLoop.run_until_complete(coroutine)
+            eventLoop.close()
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+    return result
+
+class Consumer():
+    def __init__(self, connection, work):
+        self.connection = connection
+        self.work = work
+        self.jobs = 0
+        self.task = asyncio.ensure_future(self.__run())
+
+    @staticmethod
+    async def open(client_id, channel, work):
+        connection = await Connection.open(client_id)
+        connection.send({'sub': {'cn': GROUP + channel, 'pr': 0}})
+        await connection.receive()
+        return Consumer(connection, work)
+
+    async def __run(self):
+        try:
+            while True:
+                packet = await self.connection.receive()
+                push = packet.get('push')
+                if push is None:
+                    continue
+                await asyncio.sleep(self.work)
+                self.jobs += 1
+                if 'id' in push:
+                    self.connection.send({'pushAck': {'id': push['id']}})
+        except asyncio.CancelledError:
+            pass
+
+    async def close(self):
+        self.task.cancel()
+        await self.task
+        self.connection.close()
+
+async def drain(connection):
+    # the pub acks of the QoS 1 pubs
+    try:
+        while True:
+            await connection.receive()
+    except asyncio.CancelledError:
+        pass
+
+# publishes count jobs and returns the seconds until the consumers processed all of them
+async def publish(publisher, consumers, channel, qos, count):
+    start = time.perf_counter()
+    for i in range(count):
+        publisher.send({'pub': {'cn': channel, 'dt': i, 'q': qos, 'id': str(i)}})
+        if i % 100 == 0:
+            await publisher.writer.drain()
+    while sum(consumer.jobs for consumer in consumers) < count:
+        await asyncio.sleep(0.01)
+    return time.perf_counter() - start
+
+async def scaling(args):
+    publisher = await Connection.open('publisher')
+    results = []
+    for size in args.sizes:
+        channel = 'jobs/' + str(size)
+        consumers = [await Consumer.open('worker-{0}-{1}'.format(size, i), channel, args.work_ms / 1000.0) for i in range(size)]
+        await asyncio.sleep(0.5)
+        elapsed = await publish(publisher, consumers, channel, 0, args.count)
+        jobs = [consumer.jobs for consumer in consumers]
+        results.append((size, args.count / elapsed, min(jobs), max(jobs)))
+        for consumer in consumers:
+            await consumer.close()
+    publisher.close()
+    return results
+
+async def slow_consumer(args):
+    publisher = await Connection.open('publisher')
+    drainer = asyncio.ensure_future(drain(publisher))
+    work = args.work_ms / 1000.0
+    consumers = [await Consumer.open('worker-' + str(i), 'jobs', work * (args.slow_factor if i == 0 else 1)) for i in range(args.slow_group)]
+    await asyncio.sleep(0.5)
+    elapsed = await publish(publisher, consumers, 'jobs', 1, args.qos1_count)
+    slow = consumers[0].jobs
+    for consumer in consumers:
+        await consumer.close()
+    drainer.cancel()
+    await drainer
+    publisher.close()
+    return elapsed, slow
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--work-ms', type=float, default=2)
+    parser.add_argument('--sizes', default='1,2,4,8')
+    parser.add_argument('--qos1-count', type=int, default=500)
+    parser.add_argument('--slow-group', type=int, default=4)
+    parser.add_argument('--slow-factor', type=int, default=50)
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(',')]
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+
+    results = with_server(ROUND_ROBIN, scaling(args))
+    print('{0:>6} {1:>10} {2:>10} {3:>16}'.format('group', 'jobs/s', 'speedup', 'jobs per member'))
+    for size, throughput, low, high in results:
+        print('{0:>6} {1:>10.0f} {2:>9.1f}x {3:>16}'.format(size, throughput, throughput / results[0][1], '{0}-{1}'.format(low, high)))
+    print('')
+
+    print('{0:>18} {1:>10} {2:>16}'.format('strategy (qos 1)', 'seconds', 'slow member jobs'))
+    for strategy in [ROUND_ROBIN, LEAST_OUTSTANDING]:
+        elapsed, slow = with_server(strategy, slow_consumer(args))
+        print('{0:>18} {1:>10.2f} {2:>16}'.format(strategy, elapsed, '{0}/{1}'.format(slow, args.qos1_count)))
+
+if __name__ == '__main__':
+    main()
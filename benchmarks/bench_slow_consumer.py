@@ -0,0 +1,141 @@
+# Benchmark for the delivery of QoS 0 packets when one subscriber is slow.
+#
+# Publishes --publishes packets (on --channels channels) to --fast socket
+# Peers reading as fast as they can and to one Peer reading --rate bytes per
+# second, once with the write and drain inline in Peer.send (how the packets
+# were sent before the outbound queue) and once through the outbound queue of
+# each slow consumer policy. The transports are in memory, a write buffer is
+# drained when it holds more than 64 KiB. Reports the time the publisher
+# waits per publish, the peak bytes held for the slow peer (transport buffer
+# and outbound queue) and what happened to its packets.
+#
+#   python3 bench_slow_consumer.py [--publishes 5000] [--fast 50] [--rate 200000] [--size 1024] [--channels 10]
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import collections
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.settings import ServerSettings
+from pyjmqt.server.core.socket_server import Peer
+
+DRAIN_LIMIT = 64 * 1024
+
+class Handler():
+    def __init__(self):
+        self.outboundStats = collections.Counter()
+        self.peers = {}
+
+    async def disconnect_client(self, client_id):
+        await self.peers[client_id].disconnect()
+
+# in-memory transport, a reader takes rate bytes per second out of the buffer (all of them if rate is None)
+class MemoryWriter():
+    def __init__(self, rate):
+        self.rate = rate
+        self.buffered = 0
+        self.received = 0
+        self.closed = False
+
+    def write(self, data):
+        self.received += len(data)
+        if self.rate is not None:
+            self.buffered += len(data)
+
+    def writelines(self, frames):
+        for frame in frames:
+            self.write(frame)
+
+    async def drain(self):
+        while self.buffered > DRAIN_LIMIT:
+            await asyncio.sleep(0.001)
+
+    def close(self):
+        self.closed = True
+
+async def inline_send(peer, data):
+    # Peer.send before the outbound queue
+    message = json.dumps(data) + '\0'
+    peer.writer.write(message.encode('utf8'))
+    await peer.writer.drain()
+
+async def queued_send(peer, data):
+    await peer.send(data)
+
+async def read_slowly(writer, slowPeer, state):
+    last = time.perf_counter()
+    while state['run']:
+        await asyncio.sleep(0.001)
+        now = time.perf_counter()
+        writer.buffered = max(0, writer.buffered - int(writer.rate * (now - last)))
+        last = now
+        state['peak'] = max(state['peak'], writer.buffered + slowPeer.outbound.bytes)
+
+async def run(mode, args, settings):
+    handler = Handler()
+    send = inline_send if mode == 'inline drain' else queued_send
+    peers = []
+    for i in range(args.fast):
+        peers.append(Peer(None, MemoryWriter(None), 'fast' + str(i), None, handler, settings, 'bench'))
+    slowWriter = MemoryWriter(args.rate)
+    slowPeer = Peer(None, slowWriter, 'slow', None, handler, settings, 'bench')
+    slowPeer.client_id = 'slow'
+    handler.peers['slow'] = slowPeer
+    peers.append(slowPeer)
+    state = {'run': True, 'peak': 0}
+    reader = asyncio.ensure_future(read_slowly(slowWriter, slowPeer, state))
+    payload = 'x' * args.size
+    waits = []
+    start = time.perf_counter()
+    for i in range(args.publishes):
+        packet = {'push': {'cn': 'ch' + str(i % args.channels), 'dt': payload, 'q': 0}}
+        begin = time.perf_counter()
+        for peer in peers:
+            if not peer.writer.closed:
+                await send(peer, packet)
+        waits.append(time.perf_counter() - begin)
+        # ~2000 publishes per second
+        await asyncio.sleep(0.0005)
+    elapsed = time.perf_counter() - start
+    # let the fast peers' writers finish
+    await asyncio.sleep(0.05)
+    state['run'] = False
+    await reader
+    fastBytes = sum(p.writer.received for p in peers[:-1])
+    disconnected = slowWriter.closed
+    for peer in peers:
+        if not peer.writer.closed:
+            await peer.disconnect()
+    return elapsed, sum(waits) / len(waits), max(waits), state['peak'], fastBytes, slowWriter.received, disconnected, handler.outboundStats
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--publishes', type=int, default=5000)
+    parser.add_argument('--fast', type=int, default=50)
+    parser.add_argument('--rate', type=int, default=200000)
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--channels', type=int, default=10)
+    args = parser.parse_args()
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+    print('{0:>14} {1:>10} {2:>14} {3:>14} {4:>14} {5:>16} {6:>16} {7:>12} {8:>12}'.format('mode', 'time (s)', 'avg wait (ms)', 'max wait (ms)', 'slow peak (KB)',
+            'fast recv (MB)', 'slow recv (MB)', 'dropped', 'conflated'))
+    for mode in ['inline drain', 'disconnect', 'drop_qos0', 'conflate']:
+        settings = ServerSettings({'SLOW_CONSUMER_POLICY': mode})
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        elapsed, avgWait, maxWait, peak, fastBytes, slowBytes, closed, stats = loop.run_until_complete(run(mode, args, settings))
+        loop.close()
+        print('{0:>14} {1:>10.2f} {2:>14.3f} {3:>14.1f} {4:>14.1f} {5:>16.1f} {6:>16.1f} {7:>12} {8:>12}{9}'.format(mode, elapsed, avgWait * 1e3, maxWait * 1e3, peak / 1024,
+                fastBytes / 1e6, slowBytes / 1e6, stats['dropped_frames'], stats['conflated_frames'], ' (disconnected)' if closed else ''))
+
+if __name__ == '__main__':
+    main()
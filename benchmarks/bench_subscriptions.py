@@ -0,0 +1,79 @@
+# Benchmark for the subscription registry used on every publish.
+#
+# Measures the cost of resolving the subscribers of one channel (what
+# ConnectionHandler.pub does) and of the per-push membership check (what
+# ConnectionHandler.__process_pub does) while the total number of
+# subscriptions grows. The old list-of-namedtuples scan is included as a
+# baseline.
+#
+#   python3 bench_subscriptions.py [--subscribers 100] [--repeat 200]
+
+import os
+import sys
+import time
+import argparse
+from collections import namedtuple
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+from pyjmqt.server.core.services.subscriptions import SubscriptionIndex
+
+subscription_entry = namedtuple('subscription_entry', ['client_id', 'channel', 'is_tmp'])
+
+def build(total, subscribers):
+    linear = []
+    index = SubscriptionIndex()
+    # one hot channel with a fixed number of subscribers
+    for i in range(subscribers):
+        client_id = 'hot-client-' + str(i)
+        linear.append(subscription_entry(client_id, 'hot', False))
+        index.add(client_id, 'hot', False)
+    # background subscriptions, 10 channels per client
+    for i in range(total - subscribers):
+        client_id = 'client-' + str(i // 10)
+        channel = 'channel-' + str(i)
+        linear.append(subscription_entry(client_id, channel, False))
+        index.add(client_id, channel, False)
+    return linear, index
+
+def time_it(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--subscribers', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--sizes', default='1000,10000,100000,500000')
+    args = parser.parse_args()
+
+    print('{0:>10} {1:>16} {2:>16} {3:>16} {4:>16}'.format(
+        'total', 'scan pub (us)', 'index pub (us)', 'scan push (us)', 'index push (us)'))
+    for total in [int(s) for s in args.sizes.split(',')]:
+        linear, index = build(total, args.subscribers)
+
+        def scan_pub():
+            return [s.client_id for s in linear if s.channel == 'hot']
+
+        def index_pub():
+            return list(index.clients('hot'))
+
+        def scan_push():
+            clients = [s.client_id for s in linear if s.channel == 'hot']
+            return 'hot-client-0' in clients
+
+        def index_push():
+            return index.contains('hot-client-0', 'hot')
+
+        repeat = max(1, args.repeat * 1000 // total)
+        print('{0:>10} {1:>16.2f} {2:>16.2f} {3:>16.2f} {4:>16.3f}'.format(
+            total,
+            time_it(scan_pub, repeat), time_it(index_pub, args.repeat),
+            time_it(scan_push, repeat), time_it(index_push, args.repeat * 100)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# Benchmark for the wildcard subscriptions.
+#
+# Subscribes --clients clients to wildcard filters over a tree of channels
+# building/floor/room/sensor (--buildings buildings, 10 floors, 10 rooms,
+# 4 sensors), e.g. b7/+/+/temp, b7/f3/*, +/+/r5/hum, then reports the time
+# to find the subscribers of a published channel with the topic tree of the
+# SubscriptionIndex and with a scan of all the filters, for growing numbers
+# of filters, and the time to add and remove a filter. Checks first that the
+# wildcard filters do not match the p2p (#) and control ($) channels.
+#
+#   python3 bench_topics.py [--clients 1000] [--buildings 100] [--samples 2000]
+
+import os
+import sys
+import time
+import random
+import argparse
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+from pyjmqt.server.core.topics import matches, set_wildcards
+from pyjmqt.server.core.services.subscriptions import SubscriptionIndex
+
+SENSORS = ['temp', 'hum', 'co2', 'light']
+
+def random_channel(buildings):
+    return 'b{0}/f{1}/r{2}/{3}'.format(random.randrange(buildings), random.randrange(10), random.randrange(10), random.choice(SENSORS))
+
+def random_filter(buildings):
+    levels = random_channel(buildings).split('/')
+    kind = random.randrange(4)
+    if kind == 0:
+        return '/'.join(levels[:1] + ['+', '+'] + levels[3:])
+    elif kind == 1:
+        return '/'.join(levels[:2] + ['*'])
+    elif kind == 2:
+        return '/'.join(['+', '+'] + levels[2:])
+    return '/'.join(levels[:1] + ['+'] + levels[2:3] + ['*'])
+
+# the subscribers of '*' and '+' must not receive the pushes of a p2p channel
+def check_reserved():
+    index = SubscriptionIndex()
+    index.add('bob', '#bob', False)
+    index.add('eve', '*', False)
+    index.add('mallory', '+', False)
+    index.add('trent', '$share/g/*', False)
+    assert index.clients('#bob') == {'bob'}, index.clients('#bob')
+    assert index.exact_clients('#bob') == {'bob'}
+    assert index.clients('$control') == set()
+    assert index.shared_groups('#bob') == []
+    assert not index.contains('eve', '#bob') and not index.contains('mallory', '#bob')
+    assert not index.contains('trent', '#bob') and index.contains('bob', '#bob')
+    assert index.clients('news') == {'eve', 'mallory'}
+    index.add('carol', 'b1/f2/r3/temp', False)
+    assert index.matching_channels('b1/+/+/temp') == ['b1/f2/r3/temp'] and index.matching_channels('b2/*') == []
+
+# with the wildcards disabled, '+' and '*' are plain characters
+def check_disabled():
+    set_wildcards(0)
+    index = SubscriptionIndex()
+    index.add('eve', 'b1/+', False)
+    assert index.clients('b1/f2') == set() and index.clients('b1/+') == {'eve'}
+    assert not matches('b1/*', 'b1/f2') and len(index.tree) == 0
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--buildings', type=int, default=100)
+    parser.add_argument('--samples', type=int, default=2000)
+    args = parser.parse_args()
+    random.seed(7)
+    check_disabled()
+    set_wildcards(1)
+    check_reserved()
+
+    print('{0:>10} {1:>14} {2:>14} {3:>14} {4:>14}'.format('filters', 'tree (us)', 'scan (us)', 'add (us)', 'remove (us)'))
+    for perClient in [1, 10, 100]:
+        index = SubscriptionIndex()
+        filters = [('c' + str(i % args.clients), random_filter(args.buildings)) for i in range(args.clients * perClient)]
+        start = time.perf_counter()
+        for client_id, topicFilter in filters:
+            index.add(client_id, topicFilter, False)
+        add = (time.perf_counter() - start) / len(filters) * 1e6
+        channels = [random_channel(args.buildings) for _ in range(args.samples)]
+
+        start = time.perf_counter()
+        for channel in channels:
+            index.clients(channel)
+        tree = (time.perf_counter() - start) / args.samples * 1e6
+
+        start = time.perf_counter()
+        for channel in channels[:max(1, args.samples // perClient)]:
+            set(client_id for client_id, topicFilter in filters if matches(topicFilter, channel))
+        scan = (time.perf_counter() - start) / max(1, args.samples // perClient) * 1e6
+
+        start = time.perf_counter()
+        for client_id, topicFilter in filters:
+            index.remove(client_id, topicFilter)
+        remove = (time.perf_counter() - start) / len(filters) * 1e6
+        print('{0:>10} {1:>14.1f} {2:>14.1f} {3:>14.2f} {4:>14.2f}'.format(len(filters), tree, scan, add, remove))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# Benchmark for the multi-process server mode (WORKERS).
+#
+# Forks 1, 2, 4.. --workers processes which share --count pub packets, each
+# parsing the pub frame and encoding the push frames of --fanout socket
+# subscribers (the CPU work of a publish), and reports the packets per second
+# of the pool. Then forks one worker connected to the bus hub of this process
+# (WorkerPool, LocalBus) and reports the throughput of the pub messages the
+# workers exchange when a subscriber is connected to another worker, and the
+# round trip latency of the bus.
+#
+#   python3 bench_workers.py [--workers <cores>] [--count 200000] [--fanout 10] [--messages 50000] [--pings 2000]
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+modules_root_path = os.path.dirname(root_path)
+if modules_root_path not in sys.path:
+    sys.path.insert(0, modules_root_path)
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.settings import ServerSettings
+from pyjmqt.server.core.constants import Protocol
+from pyjmqt.server.core.packets import JSONCodec, PacketParser, PacketGenerator
+from pyjmqt.server.core.workers import WorkerPool
+
+PAYLOAD = {'sensor': 'sensor-17', 't': 1544000000, 'readings': [21.5, 21.7, 21.6, 21.9]}
+
+def publish(count, fanout):
+    body = JSONCodec.dumps({'pub': {'cn': 'sensors/17', 'dt': PAYLOAD, 'q': 0, 'id': '42'}})
+    for i in range(count):
+        packet, msg = PacketParser.parse_packet(body, Protocol.SOCKET)
+        push = PacketGenerator.generate_push_frame('sensors/17', packet.packetData['dt'], str(i), 'client-1', False, 0)
+        for _ in range(fanout):
+            push.socket_frame()
+
+def measure_pool(workers, count, fanout):
+    start = time.perf_counter()
+    pids = []
+    for index in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                publish(count // workers, fanout)
+            except Exception as ex:
+                print(ex)
+                status = 1
+            os._exit(status)
+        pids.append(pid)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    return count / (time.perf_counter() - start)
+
+# the second worker counts the pub messages and answers the pings
+def run_echo_worker(pool):
+    eventLoop = asyncio.new_event_loop()
+    asyncio.set_event_loop(eventLoop)
+    bus = pool.bus(eventLoop)
+    received = [0]
+    async def handler(message):
+        if message['t'] == 'ping':
+            await bus.send(0, {'t': 'pong'})
+        elif message['t'] == 'p':
+            received[0] += 1
+            if received[0] == message['n']:
+                received[0] = 0
+                await bus.send(0, {'t': 'done'})
+    bus.connect(handler, eventLoop.stop)
+    eventLoop.run_forever()
+    os._exit(0)
+
+def measure_bus(messages, pings):
+    path = os.path.join(tempfile.gettempdir(), 'jmqt-bench-{0}.sock'.format(os.getpid()))
+    pool = WorkerPool(ServerSettings({'WORKER_BUS_PATH': path}), 2)
+    if pool.fork() > 0:
+        run_echo_worker(pool)
+    eventLoop = asyncio.new_event_loop()
+    asyncio.set_event_loop(eventLoop)
+    pool.start_hub(eventLoop)
+    bus = pool.bus(eventLoop)
+    waiting = []
+    async def handler(message):
+        waiting.pop(0).set_result(message)
+    bus.connect(handler)
+
+    async def run():
+        while len(pool.hub.workers) < 2:
+            await asyncio.sleep(0.01)
+        pub = {'c': 'sensors/17', 'd': PAYLOAD, 'f': 'client-1', 'q': 0, 'id': '42'}
+        done = eventLoop.create_future()
+        waiting.append(done)
+        start = time.perf_counter()
+        for i in range(messages):
+            await bus.send(1, {'t': 'p', 'p': pub, 'c': ['client-' + str(i % 100)], 'n': messages})
+        await done
+        throughput = messages / (time.perf_counter() - start)
+        latencies = []
+        for _ in range(pings):
+            pong = eventLoop.create_future()
+            waiting.append(pong)
+            start = time.perf_counter()
+            await bus.send(1, {'t': 'ping'})
+            await pong
+            latencies.append((time.perf_counter() - start) * 1e6)
+        latencies.sort()
+        return throughput, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+    try:
+        return eventLoop.run_until_complete(run())
+    finally:
+        bus.close()
+        eventLoop.run_until_complete(asyncio.sleep(0))
+        pool.stop()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--count', type=int, default=200000)
+    parser.add_argument('--fanout', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--pings', type=int, default=2000)
+    args = parser.parse_args()
+    logger.set_logger(os.path.join(root_path, 'bench.log'), mode='ERR')
+
+    print('cores: {0}'.format(os.cpu_count()))
+    print('{0:>8} {1:>14} {2:>10}'.format('workers', 'pubs/s', 'speedup'))
+    counts = sorted(set([1] + [2 ** i for i in range(1, 8) if 2 ** i < args.workers] + [args.workers]))
+    base = None
+    for workers in counts:
+        rate = measure_pool(workers, args.count, args.fanout)
+        base = base or rate
+        print('{0:>8} {1:>14.0f} {2:>10.2f}'.format(workers, rate, rate / base))
+
+    throughput, p50, p99 = measure_bus(args.messages, args.pings)
+    print()
+    print('bus: {0:.0f} pub messages/s between two workers, round trip p50 {1:.0f} us, p99 {2:.0f} us'.format(throughput, p50, p99))
+
+if __name__ == '__main__':
+    main()
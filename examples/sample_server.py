@@ -125,15 +125,15 @@ class MyJMQTApp():
         Called when a client sends sub request. This function must allow or deny the subscription
 
         :param client_id: Client id of the client (string)
-        :param channel: channel name which the client wants to subscribe to (string)
+        :param channel: channel name, wildcard filter (e.g. sensors/+/temp) or shared subscription ($share/<group>/<filter>) which the client wants to subscribe to (string)
         :param persistent_flag: indicates the subscription if persistent or not (boolean)
         :param remote_host: <IP>:<Port> the client is connecting from (string)
         :param protocol: Protocol which the client is connecting from (string)
         :return: returns status code (boolean)
         """
-        # here we will reject any subscription to update channel
+        # here we will reject any subscription to update channel, a wildcard filter included
         # this channel is reserved for the server
-        if channel == self.UpdateChannel:
+        if Server.channel_matches(channel, self.UpdateChannel):
             return self.server.StatusCodes.NOT_ALLOWED
         return self.server.StatusCodes.OK
     
@@ -237,8 +237,8 @@ class MyJMQTApp():
         self.server.stop()
 
 if __name__ == '__main__':
-    # get the asyncio event loop
-    loop = asyncio.get_event_loop()
+    # create the event loop chosen by the EVENT_LOOP setting (uvloop if installed)
+    loop = Server.create_event_loop(os.path.join(root_path, 'server.conf'))
     # pass the loop to the app
     myApp = MyJMQTApp(loop)
     # start the server
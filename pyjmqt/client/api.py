@@ -21,16 +21,20 @@
 
 # JMQT protocol version 1.0
 
-import json
 import threading
 import time
 import datetime
 import socket
 import ssl
 import os
+import zlib
 
 from pyjmqt.client.client_settings import ClientSettings
 import pyjmqt.client.logger as logger
+import pyjmqt.client.serializer as serializer
+from pyjmqt.common.framing import FrameBuffer, LengthPrefixedBuffer
+from pyjmqt.common.codecs import MessagePackCodec, CBORCodec
+import pyjmqt.common.codecs as wire_codecs
 
 root_path = os.path.dirname(os.path.realpath(__file__))
 
@@ -54,6 +58,13 @@ class Client() :
         self.__parse_settings()        
 
         self.__socket = None
+        self.__buffer = None
+        # JSON until the server accepts the codec of the conn packet
+        self.__codec = JSONCodec
+        self.__pendingCodec = None
+        # NUL terminated frames until the server accepts the compression of the conn packet
+        self.__compressed = False
+        self.__negotiating = False
 
         self.__timeoutSeconds = 0
         self.__hbGap = 0
@@ -105,6 +116,7 @@ class Client() :
             logger.log_info('No config file passed, falling back to default config "' + self.__configFile + '"')
         else:
             logger.log_info('Loading config "' + self.__configFile + '"')
+        logger.log_info('JSON backend ' + serializer.set_backend(self.__settings.get('JSON_BACKEND', 'auto')))
     
     def get_client_config(self):
         return dict(self.__settings)
@@ -125,6 +137,11 @@ class Client() :
                 if self.__settings.ENABLE_SSL:
                     self.__socket = ssl.wrap_socket(self.__socket, keyfile=self.__settings.SSL_KEY_PATH, certfile=self.__settings.SSL_CERT_PATH)
                 self.__socket.connect((self.__settings.REMOTE_HOST, self.__settings.REMOTE_PORT))
+                self.__codec = JSONCodec
+                self.__pendingCodec = None
+                self.__compressed = False
+                self.__negotiating = False
+                self.__buffer = FrameBuffer(self.__max_frame_size())
                 self.__opened = True
                 t = threading.Thread(target=self.__read)
                 t.daemon = True
@@ -137,16 +154,14 @@ class Client() :
     
     def __read(self):
         logger.log_info ('Read started')
-        buffer = bytes()
+        readSize = self.__settings.get('READ_SIZE', 65536)
         try:
             while self.__opened:
-                part = self.__socket.recv(1024)
+                part = self.__socket.recv(readSize)
                 if part == b'':
                     break
-                buffer += part
-                packets = PacketParser.get_packets_from_buffer(buffer)
+                packets = self.__feed(part)
                 if len(packets) > 0:
-                    buffer = bytes()
                     t = threading.Thread(target=self.__handle_packets, args=[packets])
                     t.daemon = True
                     t.start()
@@ -155,14 +170,65 @@ class Client() :
         self.__disconnectHandler()
         logger.log_info ('Read stopped')
 
+    # splits the bytes read into packets and decodes them
+    def __feed(self, data):
+        packets = []
+        while self.__negotiating and len(data) > 0:
+            # one frame at a time until the connAck, the frames after it may use the negotiated codec
+            end = data.find(b'\0')
+            if end == -1:
+                break
+            for frame in self.__buffer.feed(data[:end + 1]):
+                packet = self.__codec.loads(frame)
+                packets.append(packet)
+                if 'connAck' in packet:
+                    self.__negotiated(packet['connAck'])
+            data = data[end + 1:]
+        if len(data) > 0:
+            packets.extend([self.__codec.loads(frame) for frame in self.__buffer.feed(data)])
+        return packets
+
+    # switches to the codec and the compression of the conn packet if the server accepted them
+    def __negotiated(self, connAck):
+        codec = self.__pendingCodec
+        self.__pendingCodec = None
+        self.__negotiating = False
+        if connAck['st'] != self.statusCodes.OK:
+            return
+        if codec is not None:
+            if connAck.get('cd') == codec.name:
+                logger.log_info(('Using codec {0}').format(codec.name))
+                self.__codec = codec
+            else:
+                logger.log_warning(('Codec {0} not accepted by the server, using json').format(codec.name))
+        if self.__settings.get('COMPRESSION', 0) == 1:
+            if connAck.get('cp') == 'zlib':
+                logger.log_info('Using zlib compression')
+                self.__compressed = True
+            else:
+                logger.log_warning('Compression not accepted by the server')
+        if self.__codec is not JSONCodec or self.__compressed:
+            self.__buffer = LengthPrefixedBuffer(self.__max_frame_size())
+
+    # NUL terminated json, length-prefixed with a binary codec or the compression,
+    # compressed if it is at least COMPRESSION_THRESHOLD bytes
+    def __frame(self, packet):
+        payload = self.__codec.dumps_bytes(packet)
+        if self.__codec is JSONCodec and not self.__compressed:
+            return payload + b'\0'
+        if self.__compressed and len(payload) >= self.__settings.get('COMPRESSION_THRESHOLD', 1024):
+            compressed = zlib.compress(payload, self.__settings.get('COMPRESSION_LEVEL', 6))
+            if len(compressed) < len(payload):
+                return LengthPrefixedBuffer.frame(compressed, True)
+        return LengthPrefixedBuffer.frame(payload)
+
     def __handle_packets(self, packets):
         for packet in packets:
             self.__incomingHandler(packet)
 
-    def __send(self, msg):
+    def __send(self, packet):
         try:
-            msg = msg + '\0'
-            self.__socket.send(msg.encode())
+            self.__socket.sendall(self.__frame(packet))
         except Exception as ex:
             logger.log_error('Socket Send Error ' + str(ex))
             self.__disconnectHandler()
@@ -196,9 +262,8 @@ class Client() :
         self.__disconnectHandler(send_disconn)
         
 
-    # handles all incoming socket data
-    def __incomingHandler(self, data):
-        packet = json.loads(data)
+    # handles all incoming packets
+    def __incomingHandler(self, packet):
         if 'authAck' in packet:
             data = packet['authAck']
             logger.log_info(('authAck, status {0}').format(data['st']))
@@ -280,20 +345,25 @@ class Client() :
             self.__dataCallback(channel, client, pushData, qos, retainFlag)
 
     def __createAuthRequest(self, authJson):
-        return json.dumps({ 'auth': { 'dt': authJson } })
+        return { 'auth': { 'dt': authJson } }
 
-    def __createConnRequest(self, authToken, clientId):
-        return json.dumps({ 'conn': { 'at': authToken, 'cl': clientId } })
+    def __createConnRequest(self, authToken, clientId, codec):
+        data = { 'at': authToken, 'cl': clientId }
+        if codec is not None:
+            data['cd'] = codec.name
+        if self.__settings.get('COMPRESSION', 0) == 1:
+            data['cp'] = 'zlib'
+        return { 'conn': data }
 
     def __createDisconnRequest(self):
-        return json.dumps({ 'disconn': {} })
+        return { 'disconn': {} }
 
     def __createSubRequest(self, channelName, persistentFlag):
         persistentFlag = 1 if persistentFlag else 0
-        return json.dumps({ 'sub': { 'cn': channelName, 'pr': persistentFlag } })
+        return { 'sub': { 'cn': channelName, 'pr': persistentFlag } }
 
     def __createUnsubRequest(self, channelName):
-        return json.dumps({ 'unsub': { 'cn': channelName } })
+        return { 'unsub': { 'cn': channelName } }
 
     def __createPubRequest(self, channelName, payload, retainFlag, qos, packetId):
         data = {
@@ -309,13 +379,13 @@ class Client() :
         if retainFlag:
             data['rt'] = 1
 
-        return json.dumps({ 'pub': data })
+        return { 'pub': data }
 
     def __createPushResponse(self, packetId):
-        return json.dumps({ 'pushAck': { 'id': packetId } })
+        return { 'pushAck': { 'id': packetId } }
 
     def __createHeartbeatRequest(self):
-        return json.dumps({ 'hb': {} })
+        return { 'hb': {} }
 
     #jmqt heartbeat
     def __heartbeat(self):
@@ -350,6 +420,21 @@ class Client() :
             c += 1
         logger.log_info ('HB stopped')
 
+    # returns the maximum frame size from the settings, None = no limit
+    def __max_frame_size(self):
+        size = self.__settings.get('MAX_FRAME_SIZE', 8 * 1024 * 1024)
+        return size if size > 0 else None
+
+    # returns the codec to negotiate from the settings, None for json
+    def __get_codec(self):
+        name = str(self.__settings.get('CODEC', JSONCodec.name)).strip().lower()
+        if name == JSONCodec.name:
+            return None
+        if name not in CODECS:
+            logger.log_warning(('Codec {0} is not available, using json').format(name))
+            return None
+        return CODECS[name]
+
     # registers the data callback function
     def registerPushcallback(self, callback):
         self.__dataCallback = callback
@@ -386,7 +471,10 @@ class Client() :
             self.__authToken = authToken
             if self.__opened:
                 logger.log_info('conn..')
-                self.__send(self.__createConnRequest(authToken, clientId))
+                # the reader switches to this codec (and the compression) right after the connAck
+                self.__pendingCodec = self.__get_codec()
+                self.__negotiating = self.__pendingCodec is not None or self.__settings.get('COMPRESSION', 0) == 1
+                self.__send(self.__createConnRequest(authToken, clientId, self.__pendingCodec))
             else:
                 self.__isConnectPending = True
                 self.__open()
@@ -456,18 +544,17 @@ class Client() :
                 pass
             self.__socket = None
 
-class PacketParser:
+# the wire codecs, JSON packets are NUL terminated (length-prefixed with the compression), binary packets are length-prefixed
+class JSONCodec:
+    name = 'json'
+
+    @staticmethod
+    def loads(data):
+        return serializer.loads(data)
 
     @staticmethod
-    def get_packets_from_buffer(buffer):
-        packets = buffer.split(b'\0')
-        last_index = len(packets) - 1
-        buffer = packets[last_index]
-        parsed_packets = []
-        if len(packets) > 1:
-            if len(buffer) == 0:
-                del packets[last_index]
-            parsed_packets = []
-            for pck in packets:
-                parsed_packets.append(pck)
-            return parsed_packets
\ No newline at end of file
+    def dumps_bytes(packet):
+        return serializer.dumps_bytes(packet)
+
+# name -> codec, the codecs whose module is installed
+CODECS = dict((codec.name, codec) for codec, module in [(JSONCodec, serializer), (MessagePackCodec, wire_codecs.msgpack), (CBORCodec, wire_codecs.cbor2)] if module is not None)
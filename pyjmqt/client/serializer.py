@@ -0,0 +1,47 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+import pyjmqt.client.logger as logger
+from pyjmqt.common.json_backends import BINARY_KEY, StdlibBackend, decode_binary, find_backend
+
+# JSON serialization of the packets, the backend is chosen from the settings (JSON_BACKEND)
+
+backend = StdlibBackend
+
+# chooses the backend (auto = the fastest installed), returns its name
+def set_backend(name = 'auto'):
+    global backend
+    backend = find_backend(name)
+    if backend is None:
+        logger.log_warning(('JSON backend {0} is not available, using {1}').format(name, StdlibBackend.name))
+        backend = StdlibBackend
+    return backend.name
+
+# JSON utf8 bytes of an object
+def dumps_bytes(obj):
+    return backend.dumps_bytes(obj)
+
+# loads a JSON document (bytes) and decodes its binary values
+def loads(data):
+    obj = backend.loads(data)
+    if BINARY_KEY.encode('ascii') in data:
+        obj = decode_binary(obj)
+    return obj
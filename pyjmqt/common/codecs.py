@@ -0,0 +1,66 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+# the binary codecs are optional
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+# the binary wire codecs of the server and the client (python 2.7 compatible), default is the hook of the
+# values the codec can not encode, it returns a value it can
+class MessagePackCodec:
+    name = 'msgpack'
+    binary = True
+
+    @staticmethod
+    def dumps(packet, default = None):
+        return msgpack.packb(packet, use_bin_type = True, default = default)
+
+    @staticmethod
+    def loads(data):
+        return msgpack.unpackb(data, raw = False)
+
+    @classmethod
+    def dumps_bytes(cls, packet):
+        return cls.dumps(packet)
+
+class CBORCodec:
+    name = 'cbor'
+    binary = True
+
+    @staticmethod
+    def dumps(packet, default = None):
+        if default is None:
+            return cbor2.dumps(packet)
+        return cbor2.dumps(packet, default = lambda encoder, value: encoder.encode(default(value)))
+
+    @staticmethod
+    def loads(data):
+        return cbor2.loads(data)
+
+    @classmethod
+    def dumps_bytes(cls, packet):
+        return cls.dumps(packet)
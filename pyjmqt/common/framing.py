@@ -0,0 +1,144 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+import struct
+import zlib
+
+# the socket framing of the server and the client (python 2.7 compatible), a maximum frame size of None is no limit
+
+# raised when the received bytes can not be split into frames, the connection is closed
+class FramingError(Exception):
+    pass
+
+# raised when a frame grows beyond the maximum frame size
+class FrameTooLargeError(FramingError):
+    pass
+
+# raised when a compressed frame is corrupt or truncated
+class CorruptFrameError(FramingError):
+    pass
+
+# accumulates the bytes read from a socket and splits them into the NUL terminated frames
+# only the bytes received since the last call are scanned for the delimiter, and the complete
+# frames are removed from the front of the buffer, so a frame costs linear time whatever the read size
+class FrameBuffer():
+    DELIMITER = b'\0'
+
+    def __init__(self, maxFrameSize):
+        self.buffer = bytearray()
+        # None = no limit
+        self.maxFrameSize = maxFrameSize
+
+    def __len__(self):
+        return len(self.buffer)
+
+    # appends the received bytes and returns the complete frames (bytes), empty frames are skipped
+    def feed(self, data):
+        if len(self.buffer) == 0:
+            # nothing pending, which is the usual case for small packets, the read is split as it is
+            frames = data.split(self.DELIMITER)
+            self.buffer += frames.pop()
+            last = len(data) - len(self.buffer) - 1
+        else:
+            scanned = len(self.buffer)
+            self.buffer += data
+            last = self.buffer.rfind(self.DELIMITER, scanned)
+            if last == -1:
+                self.__check(len(self.buffer))
+                return []
+            # the complete frames are copied and split at once, the partial frame stays in the buffer
+            frames = bytes(self.buffer[:last]).split(self.DELIMITER)
+            del self.buffer[:last + 1]
+        if self.maxFrameSize is not None and last > self.maxFrameSize:
+            for frame in frames:
+                self.__check(len(frame))
+        self.__check(len(self.buffer))
+        if b'' in frames:
+            return [frame for frame in frames if len(frame) > 0]
+        return frames
+
+    def __check(self, size):
+        if self.maxFrameSize is not None and size > self.maxFrameSize:
+            self.buffer = bytearray()
+            raise FrameTooLargeError(('Frame of {0} bytes exceeds the maximum frame size of {1} bytes').format(size, self.maxFrameSize))
+
+# splits the bytes read from a socket into the frames prefixed with their length (4 bytes, big-endian),
+# used once a binary codec or the compression is negotiated since such a frame may contain NUL bytes
+# the high bit of the length is set when the payload is zlib compressed, the frames are returned decompressed
+class LengthPrefixedBuffer():
+    HEADER = struct.Struct('>I')
+    COMPRESSED_FLAG = 0x80000000
+
+    def __init__(self, maxFrameSize):
+        self.buffer = bytearray()
+        # None = no limit
+        self.maxFrameSize = maxFrameSize
+
+    def __len__(self):
+        return len(self.buffer)
+
+    # returns the length-prefixed frame of a payload (already compressed if compressed is True)
+    @classmethod
+    def frame(cls, payload, compressed = False):
+        header = len(payload) | cls.COMPRESSED_FLAG if compressed else len(payload)
+        return cls.HEADER.pack(header) + payload
+
+    # appends the received bytes and returns the complete frames (bytes), empty frames are skipped
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        start = 0
+        end = len(self.buffer)
+        headerSize = self.HEADER.size
+        while end - start >= headerSize:
+            size = self.HEADER.unpack_from(self.buffer, start)[0]
+            compressed = size & self.COMPRESSED_FLAG
+            size &= ~self.COMPRESSED_FLAG
+            if self.maxFrameSize is not None and size > self.maxFrameSize:
+                self.buffer = bytearray()
+                raise FrameTooLargeError(('Frame of {0} bytes exceeds the maximum frame size of {1} bytes').format(size, self.maxFrameSize))
+            if end - start - headerSize < size:
+                break
+            if size > 0:
+                frame = bytes(self.buffer[start + headerSize:start + headerSize + size])
+                frames.append(self.__decompress(frame) if compressed else frame)
+            start += headerSize + size
+        if start > 0:
+            del self.buffer[:start]
+        return frames
+
+    # the decompressed frame can not be larger than the maximum frame size either
+    # the payload must be one complete zlib stream
+    def __decompress(self, frame):
+        decompressor = zlib.decompressobj()
+        try:
+            frame = decompressor.decompress(frame, self.maxFrameSize or 0)
+        except zlib.error as ex:
+            self.buffer = bytearray()
+            raise CorruptFrameError(('Corrupt compressed frame: {0}').format(str(ex)))
+        if decompressor.unconsumed_tail:
+            self.buffer = bytearray()
+            raise FrameTooLargeError(('Decompressed frame exceeds the maximum frame size of {0} bytes').format(self.maxFrameSize))
+        # eof is not known on python 2
+        if not getattr(decompressor, 'eof', True) or decompressor.unused_data:
+            self.buffer = bytearray()
+            raise CorruptFrameError('Truncated compressed frame' if not decompressor.eof else 'Compressed frame with trailing data')
+        return frame
@@ -0,0 +1,151 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import base64
+
+# the fast JSON libraries are optional
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# the JSON backends of the server and the client (python 2.7 compatible), every backend reads and writes what
+# the stdlib does, so the wire format does not depend on the backend, what a fast library can not handle
+# exactly is left to the stdlib
+
+# key of the JSON object carrying a binary value (bytes) as base64, JSON has no binary type
+BINARY_KEY = '$b64'
+
+# default hook of the backends, encodes the binary values
+def json_default(obj):
+    if isinstance(obj, (bytes, bytearray)):
+        return {BINARY_KEY: base64.b64encode(obj).decode('ascii')}
+    raise TypeError('Object of type {0} is not JSON serializable'.format(type(obj).__name__))
+
+# decodes the binary values encoded by json_default in a loaded document
+def decode_binary(obj):
+    if isinstance(obj, dict):
+        if len(obj) == 1 and BINARY_KEY in obj:
+            return base64.b64decode(obj[BINARY_KEY])
+        for key, value in obj.items():
+            if isinstance(value, (dict, list)):
+                obj[key] = decode_binary(value)
+    elif isinstance(obj, list):
+        for i, value in enumerate(obj):
+            if isinstance(value, (dict, list)):
+                obj[i] = decode_binary(value)
+    return obj
+
+class StdlibBackend:
+    name = 'json'
+
+    @staticmethod
+    def dumps(obj, default = json_default):
+        return json.dumps(obj, default = default)
+
+    @staticmethod
+    def dumps_bytes(obj, default = json_default):
+        return json.dumps(obj, default = default).encode('utf8')
+
+    @staticmethod
+    def loads(data):
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode('utf8')
+        return json.loads(data)
+
+# orjson rejects what it can not encode exactly (non str keys, integers over 64 bits, lone surrogates) and writes
+# NaN and Infinity as null, the documents with a null are written again by the stdlib which keeps them
+# it reads the integers over 64 bits as floats, the documents with a run of 19 digits or more (which may be
+# such an integer, or a long fraction) are read by the stdlib, and so are the documents it rejects (NaN,
+# Infinity, 1e400, lone surrogates)
+# (the digits are mapped to '0' by translate and the run is searched, much faster than a regex)
+class OrjsonBackend:
+    name = 'orjson'
+    if orjson is not None:
+        DIGITS = bytes.maketrans(b'123456789', b'000000000')
+        DIGITS_STR = str.maketrans('123456789', '000000000')
+    LONG_NUMBER = b'0' * 19
+    LONG_NUMBER_STR = '0' * 19
+    NULL = b'null'
+
+    @staticmethod
+    def dumps(obj, default = json_default):
+        return OrjsonBackend.dumps_bytes(obj, default).decode('utf8')
+
+    @staticmethod
+    def dumps_bytes(obj, default = json_default):
+        try:
+            data = orjson.dumps(obj, default = default)
+        except TypeError:
+            return StdlibBackend.dumps_bytes(obj, default)
+        if OrjsonBackend.NULL in data:
+            return StdlibBackend.dumps_bytes(obj, default)
+        return data
+
+    @staticmethod
+    def loads(data):
+        if isinstance(data, str):
+            longNumber = OrjsonBackend.LONG_NUMBER_STR in data.translate(OrjsonBackend.DIGITS_STR)
+        else:
+            longNumber = OrjsonBackend.LONG_NUMBER in data.translate(OrjsonBackend.DIGITS)
+        if not longNumber:
+            try:
+                return orjson.loads(data)
+            except ValueError:
+                pass
+        return StdlibBackend.loads(data)
+
+class UjsonBackend:
+    name = 'ujson'
+
+    @staticmethod
+    def dumps(obj, default = json_default):
+        try:
+            return ujson.dumps(obj, default = default, escape_forward_slashes = False)
+        except (TypeError, OverflowError):
+            return StdlibBackend.dumps(obj, default)
+
+    @staticmethod
+    def dumps_bytes(obj, default = json_default):
+        return UjsonBackend.dumps(obj, default).encode('utf8')
+
+    @staticmethod
+    def loads(data):
+        try:
+            return ujson.loads(data)
+        except ValueError:
+            return StdlibBackend.loads(data)
+
+# name -> backend, the backends whose module is installed
+BACKENDS = dict((backend.name, backend) for backend, module in
+            [(OrjsonBackend, orjson), (UjsonBackend, ujson), (StdlibBackend, json)] if module is not None)
+
+# returns the backend of a name (auto = the fastest installed), None if it is not available
+def find_backend(name = 'auto'):
+    name = str(name).strip().lower()
+    if name == 'auto':
+        return [b for b in [OrjsonBackend, UjsonBackend, StdlibBackend] if b.name in BACKENDS][0]
+    return BACKENDS.get(name)
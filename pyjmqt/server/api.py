@@ -24,9 +24,14 @@
 from pyjmqt.server.core.socket_server import SocketServer, SSLSocketServer
 from pyjmqt.server.core.websocket_server import WebSocketServer, SSLWebSocketServer
 from pyjmqt.server.core.connection_handler import ConnectionHandler
+from pyjmqt.server.core.workers import WorkerPool, worker_count
+from pyjmqt.server.core.services.dbservice import prepare_database
+from pyjmqt.server.core.event_loop import new_event_loop, loop_name, check_event_loop
 from pyjmqt.server.core.constants import StatusCode, Protocol
 from pyjmqt.server.core.settings import ServerSettings
 import pyjmqt.server.logger as logger
+import pyjmqt.server.core.serializer as serializer
+import pyjmqt.server.core.topics as topics
 
 import asyncio
 import os
@@ -60,6 +65,8 @@ class Server():
         validate_unsub_callback = None
         disconnection_callback = None
         conn_close_callback = None
+        # optional, called when a peer becomes a slow consumer, recovers or is disconnected for it
+        slow_consumer_callback = None
 
         def validate_callbacks(self):
             msg = ''
@@ -92,11 +99,22 @@ class Server():
         self.__parse_settings()        
         # create an object of the CallbackWrapper class
         self.__callbackWrapper = Server.CallbackWrapper()
-        
+        self.__loop = eventLoop
+        logger.log_info('Event loop ' + loop_name(eventLoop))
+        for warning in check_event_loop(self.__settings, eventLoop):
+            logger.log_warning(warning)
+        self.__workers = worker_count(self.__settings)
+        self.__workerPool = None
+        self.__connectionHandler = None
+        self.__servers = []
+        # with several workers, the servers are created by start in each worker process
+        if self.__workers == 1:
+            self.__create_servers(eventLoop)
+
+    def __create_servers(self, eventLoop, bus = None):
         # create an object of the ConnectionHandler class
-        self.__connectionHandler = ConnectionHandler(self.__settings, eventLoop)
-        
-        
+        self.__connectionHandler = ConnectionHandler(self.__settings, eventLoop, bus)
+
         self.__servers = []
 
         # creating the socket server (without SSL)
@@ -118,14 +136,40 @@ class Server():
             self.__servers.append(self.__sslWebsocketServer)
 
 
-    def __parse_settings(self):
-        # self.__settings = ServerSettings()
+    @staticmethod
+    def create_event_loop(configFile = None):
+        """
+        creates the event loop chosen by the EVENT_LOOP setting (uvloop if it is installed by default)
+        and sets it as the current event loop, the loop is then passed to the constructor
+        :param configFile: path to the config file
+        :return: returns the event loop
+        """
+        eventLoop = new_event_loop(Server.__read_config(configFile))
+        asyncio.set_event_loop(eventLoop)
+        return eventLoop
+
+    @staticmethod
+    def channel_matches(channel_filter, channel):
+        """
+        checks if a channel matches a subscription filter, the levels are separated by '/', '+' matches one level
+        and '*' as the last level matches the remaining levels when WILDCARD_SUBSCRIPTIONS is enabled (for example
+        in the subscription validator), the filter of a shared subscription ($share/<group>/<filter>) is matched
+        without its prefix and group
+        :param channel_filter: subscription filter, with or without wildcards (string)
+        :param channel: channel name (string)
+        :return: returns True if the filter matches the channel (boolean)
+        """
+        shared = topics.parse_shared(channel_filter)
+        if shared is not None:
+            channel_filter = shared[1]
+        return topics.matches(channel_filter, channel)
+
+    @staticmethod
+    def __read_config(configFile):
         settings = {}
-        default = False
-        if self.__configFile is None or len(self.__configFile) == 0:
-            self.__configFile = os.path.join(root_path, 'core', 'default.conf')
-            default = True
-        with open(self.__configFile) as fin:
+        if configFile is None or len(configFile) == 0:
+            configFile = os.path.join(root_path, 'core', 'default.conf')
+        with open(configFile) as fin:
             for line in fin:
                 if not str(line).startswith('#'):
                     configStrs = line.split('=', 1)
@@ -137,17 +181,34 @@ class Server():
                         except:
                             value = str(value).replace('"','').replace("'","")
                         settings[key] = value
-        
-        self.__settings = ServerSettings(settings)
+        return ServerSettings(settings)
+
+    def __parse_settings(self):
+        default = False
+        if self.__configFile is None or len(self.__configFile) == 0:
+            self.__configFile = os.path.join(root_path, 'core', 'default.conf')
+            default = True
+        self.__settings = Server.__read_config(self.__configFile)
         # create the JMQT logger (get_logger function returns this logger)
         logger.set_logger(self.__settings.LOG_PATH, mode = self.__settings.LOG_MODE)
         if default:
             logger.log_info('No config file passed, falling back to default config "' + self.__configFile + '"')
         else:
             logger.log_info('Loading config "' + self.__configFile + '"')
+        logger.log_info('JSON backend ' + serializer.set_backend(self.__settings.get('JSON_BACKEND', 'auto')))
+        if serializer.set_passthrough(self.__settings.get('PAYLOAD_PASSTHROUGH', 0), self.__settings.get('PAYLOAD_PASSTHROUGH_MIN_SIZE', 4096)):
+            logger.log_info('Payload passthrough enabled')
+        if topics.set_wildcards(self.__settings.get('WILDCARD_SUBSCRIPTIONS', 0)):
+            logger.log_info('Wildcard subscriptions enabled')
     
     def get_server_config(self):
         return dict(self.__settings)
+
+    # returns the connection handler, with several workers it is created by start
+    def __connection_handler(self):
+        if self.__connectionHandler is None:
+            raise Exception('The server is not started, with WORKERS > 1 call start before using the server API')
+        return self.__connectionHandler
     '''
     SECTION #1 : API to retreive information from lower jmqt layers
     '''
@@ -159,7 +220,7 @@ class Server():
         :param client_id: client id (string)
         :return: returns a list of channels (list of dict, e.g. [{"ch1": "persistent"}, {"ch2": "temp"}])
         """
-        return await self.__connectionHandler.get_subscribed_channels(client_id)
+        return await self.__connection_handler().get_subscribed_channels(client_id)
 
     async def force_sub(self, client_id, channel, persistent_flag):
         """
@@ -170,7 +231,7 @@ class Server():
         :param persistent_flag: indicates if the subscription is persistent (boolean)
         :return: returns nothing
         """
-        await self.__connectionHandler.force_sub(client_id, channel, persistent_flag)
+        await self.__connection_handler().force_sub(client_id, channel, persistent_flag)
     
     async def force_unsub(self, client_id, channel):
         """
@@ -180,7 +241,7 @@ class Server():
         :param channel: channel name (string)
         :return: returns nothing
         """
-        return await self.__connectionHandler.force_unsub(client_id, channel)
+        return await self.__connection_handler().force_unsub(client_id, channel)
 
     async def force_pub(self, channel, data, qos, retain):
         """
@@ -192,7 +253,15 @@ class Server():
         :param channel: retain flag (boolean)
         :return: returns nothing
         """
-        return await self.__connectionHandler.force_pub(channel, data, qos, retain)
+        return await self.__connection_handler().force_pub(channel, data, qos, retain)
+
+    def get_metrics(self):
+        """
+        returns the runtime metrics of the server (e.g. redis writer batch sizes and flush latency)
+
+        :return: returns a dictionary of metrics
+        """
+        return self.__connection_handler().get_metrics()
 
 
     '''
@@ -210,7 +279,9 @@ class Server():
 
     def set_subscription_validator(self, _callback):
         """
-        sets the subscription validator callback
+        sets the subscription validator callback, the channel may be a wildcard filter or a shared
+        subscription $share/<group>/<filter> (see channel_matches), a wildcard filter is accepted only if the
+        callback accepts the filter and each known channel it matches as well
         """
         self.__callbackWrapper.validate_sub_callback = _callback
     
@@ -249,6 +320,13 @@ class Server():
         sets the connection close callback
         """        
         self.__callbackWrapper.conn_close_callback = _callback
+
+    def set_slow_consumer_notifier(self, _callback):
+        """
+        sets the slow consumer callback (optional), called as _callback(client_id, address, protocol, event, queued_bytes)
+        where event is 'slow', 'recovered' or 'disconnected'
+        """
+        self.__callbackWrapper.slow_consumer_callback = _callback
     
     '''
     END SECTION #2
@@ -275,15 +353,52 @@ class Server():
         msg = self.__callbackWrapper.validate_callbacks()
         if msg != '':
             raise Exception(msg)
-        self.__connectionHandler.start()
+        if self.__workers > 1 and self.__workerPool is None:
+            # forks the workers, this process is the worker 0 and runs the bus hub
+            self.__workerPool = WorkerPool(self.__settings, self.__workers)
+            prepare_database(self.__settings)
+            index = self.__workerPool.fork()
+            if index > 0:
+                self.__run_worker(index)
+            self.__workerPool.start_hub(self.__loop)
+            self.__create_servers(self.__loop, self.__workerPool.bus(self.__loop))
+        # in the workers mode the temporary subscriptions are removed by prepare_database
+        self.__connectionHandler.start(remove_temp = self.__workerPool is None)
         for _server in self.__servers:
             _server.start()
+
+    # runs a forked worker on a new event loop until the master stops it, never returns
+    # the loop of the master is inherited but not used, the callbacks run on the loop of the worker
+    def __run_worker(self, index):
+        status = 0
+        try:
+            eventLoop = new_event_loop(self.__settings)
+            asyncio.set_event_loop(eventLoop)
+            self.__loop = eventLoop
+            self.__create_servers(eventLoop, self.__workerPool.bus(eventLoop))
+            self.__connectionHandler.start(remove_temp = False)
+            for _server in self.__servers:
+                _server.start()
+            logger.log_info(('Worker {0} started, pid {1}').format(index, os.getpid()), 'Server')
+            eventLoop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        except Exception as ex:
+            logger.log_error(ex, 'Server(worker)')
+            status = 1
+        finally:
+            if self.__connectionHandler is not None:
+                self.__connectionHandler.stop()
+            os._exit(status)
     
     def stop(self):
         """
-        stops the server
+        stops the server (and the workers)
         """
-        self.__connectionHandler.stop()
+        if self.__connectionHandler is not None:
+            self.__connectionHandler.stop()
+        if self.__workerPool is not None:
+            self.__workerPool.stop()
     
     '''
     END SECTION #3
@@ -0,0 +1,85 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.constants import *
+
+DEFAULT_THRESHOLD = 1024
+DEFAULT_LEVEL = 6
+
+# returns the compression policy of the socket peers from the settings
+# SOCKET_COMPRESSION (0/1), COMPRESSION_THRESHOLD (bytes), COMPRESSION_LEVEL (1-9) and
+# COMPRESSION_EXCLUDE_CHANNELS (comma separated channels, a trailing * matches a prefix)
+def create_compression_policy(settings):
+    level = settings.get('COMPRESSION_LEVEL', DEFAULT_LEVEL)
+    if not isinstance(level, int) or level < 1 or level > 9:
+        logger.log_warning(('Invalid COMPRESSION_LEVEL {0}, using {1}').format(level, DEFAULT_LEVEL), 'create_compression_policy')
+        level = DEFAULT_LEVEL
+    threshold = settings.get('COMPRESSION_THRESHOLD', DEFAULT_THRESHOLD)
+    if not isinstance(threshold, int) or threshold < 0:
+        logger.log_warning(('Invalid COMPRESSION_THRESHOLD {0}, using {1}').format(threshold, DEFAULT_THRESHOLD), 'create_compression_policy')
+        threshold = DEFAULT_THRESHOLD
+    excluded = [channel.strip() for channel in str(settings.get('COMPRESSION_EXCLUDE_CHANNELS', '')).split(',') if len(channel.strip()) > 0]
+    return CompressionPolicy(settings.get('SOCKET_COMPRESSION', 0) == 1, threshold, level, excluded)
+
+# decides which socket frames are compressed, a client asks for the compression with the 'cp' key of its conn packet
+# only the frames of at least threshold bytes are compressed, the pushes of the excluded channels
+# (e.g. already compressed payloads) never are
+class CompressionPolicy():
+    ALGORITHM = 'zlib'
+
+    def __init__(self, enabled, threshold, level, excluded):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.level = level
+        self.excludedChannels = set(channel for channel in excluded if not channel.endswith('*'))
+        self.excludedPrefixes = tuple(channel[:-1] for channel in excluded if channel.endswith('*'))
+
+    # checks if the compression asked by a client can be used
+    def accepts(self, algorithm):
+        return self.enabled and algorithm == self.ALGORITHM
+
+    def is_excluded(self, channel):
+        return channel in self.excludedChannels or (len(self.excludedPrefixes) > 0 and channel.startswith(self.excludedPrefixes))
+
+    # checks if a frame of size bytes is compressed
+    def should_compress(self, packet, size):
+        if size < self.threshold:
+            return False
+        push = packet.get(PacketTypes.push) if isinstance(packet, dict) else None
+        return push is None or not self.is_excluded(push.get(JSONKeys.channelName, ''))
+
+# returns the compression keyword arguments of websockets.serve from the settings
+# WEBSOCKET_COMPRESSION (0/1) negotiates permessage-deflate with the clients which support it,
+# the window is kept small to bound the memory used by each connection
+def websocket_compression(settings):
+    if settings.get('WEBSOCKET_COMPRESSION', 1) != 1:
+        return {'compression': None}
+    from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+    level = settings.get('COMPRESSION_LEVEL', DEFAULT_LEVEL)
+    if not isinstance(level, int) or level < 1 or level > 9:
+        level = DEFAULT_LEVEL
+    return {
+        'compression': None,
+        'extensions': [ServerPerMessageDeflateFactory(server_max_window_bits = 12, client_max_window_bits = 12,
+                                                      compress_settings = {'memLevel': 5, 'level': level})]
+    }
@@ -30,17 +30,44 @@ import threading
 
 import pyjmqt.server.logger as logger
 from pyjmqt.server.core.services.cache import CacheService
+from pyjmqt.server.core.services.peewee_base import KEY_LENGTH
+from pyjmqt.server.core.services.retained import RetainedStore
+from pyjmqt.server.core.pending import PendingDelivery
+from pyjmqt.server.core.compression import create_compression_policy
+from pyjmqt.server.core.idle import create_idle_tracker
+from pyjmqt.server.core.presence import create_presence_registry
+from pyjmqt.server.core.topics import is_wildcard, is_valid_filter, parse_shared, SHARED_PREFIX
+from pyjmqt.server.core.shared import create_shared_selector, LEAST_OUTSTANDING
+import pyjmqt.server.core.serializer as serializer
 from pyjmqt.server.core.packets import *
 from pyjmqt.server.core.constants import *
 
 class ConnectionHandler:
+    # number of encoded push frames kept for the fan-out of recent publishes
+    PUSH_FRAME_CACHE_SIZE = 1024
+
     # constructor
-    def __init__(self, settings, eventLoop):
+    def __init__(self, settings, eventLoop, bus = None):
         self.server_id = str(uuid.uuid4())
         self.settings = settings
         self.loop = eventLoop
         self.peers = {}
         self.pubmap = {}
+        # pending qos 1 packets sent to a reconnected client before their push acks arrive
+        self.pendingWindow = max(1, self.settings.get('PENDING_WINDOW', 64))
+        # pending qos 1 packets loaded per query
+        self.pendingPrefetch = max(1, self.settings.get('PENDING_PREFETCH', 256))
+        self.pushFrames = collections.OrderedDict()
+        # counters shared by the outbound queues of the peers
+        self.outboundStats = collections.Counter()
+        # p2p pubs delivered to this server, sent to another one or to an offline client
+        self.p2pStats = collections.Counter()
+        # the wire codecs a client may negotiate
+        self.codecs = accepted_codecs(self.settings)
+        # the compression of the socket frames a client may negotiate
+        self.compression = create_compression_policy(self.settings)
+        # one timer wheel expires the silent peers of all the listeners
+        self.idleTracker = create_idle_tracker(self.loop, self.settings)
         if not self.settings.ENABLE_MYSQL and self.settings.ENABLE_REDIS:
             logger.log_warning("MySQL/MariaDb is disbled, but Redis is enabled. Distributed system won't work without MySQL/MariaDb", 'ConnectionHandler')
         if self.settings.ENABLE_MYSQL:
@@ -51,11 +78,23 @@ class ConnectionHandler:
             logger.log_info('MySQL/MariaDb is disabled. Switching to SQLite..', 'ConnectionHandler')
             from pyjmqt.server.core.services.dbservice import SQLiteService
             self.dbService = SQLiteService(self.settings)
-        self.cacheService = CacheService(self.settings, self.loop, self.server_id, self.dbService, self.__process_pub, self.disconnect_client)
+        # picks the member of a shared subscription group receiving a packet
+        self.shared = create_shared_selector(self.settings)
+        # client id -> {packet id: origin} of the shared subscription qos 1 packets pushed and not acknowledged yet
+        self.sharedAcks = {}
+        self.retained = RetainedStore(self.dbService, self.settings.get('RETAINED_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+        self.cacheService = CacheService(self.settings, self.loop, self.server_id, self.dbService, self.__process_pub, self.disconnect_client, self.__process_retain, bus, self.__process_shared_ack)
+        # the connected clients, the connections table is only a copy written in the background
+        self.presence = create_presence_registry(self.settings, self.dbService, self.cacheService)
 
     # called when server is started (called by the Server class in server module)
-    def start(self):
-        self.remove_all_non_persistent_channels()
+    # remove_temp is False for the workers, the master has removed the temporary subscriptions before forking them
+    def start(self, remove_temp = True):
+        self.cacheService.start()
+        self.dbService.load_subscriptions()
+        self.retained.load()
+        if remove_temp:
+            self.remove_all_non_persistent_channels()
 
     # called when server is stopped (called by the Server class in server module)
     def stop(self):
@@ -75,7 +114,7 @@ class ConnectionHandler:
             await old_peer.disconnect()
         
         await self.remove_non_persistent_channels(client_id)
-        await self.dbService.insert_or_update_connection(client_id, protocol, peer.address)
+        self.presence.connect(client_id, protocol, peer.address)
 
         self.peers[client_id] = {
             'peer': peer,
@@ -93,9 +132,15 @@ class ConnectionHandler:
                 del self.peers[client_id]
             if client_id in self.pubmap:
                 del self.pubmap[client_id]
+            # the shared subscription packets not acknowledged yet are released at the servers which picked the
+            # client, its outstanding count goes down as if they were acknowledged
+            acks = self.sharedAcks.pop(client_id, None)
+            if acks is not None:
+                for origin in acks.values():
+                    await self.cacheService.send_shared_ack(origin, client_id)
             await self.cacheService.process_disconnection(client_id)
             await self.remove_non_persistent_channels(client_id)
-            await self.dbService.remove_connection(client_id)
+            self.presence.disconnect(client_id)
             asyncio.Task(peer.callbackWrapper.conn_close_callback(client_id, peer.address, peer.protocol))
             if has_client_disconnected:
                 asyncio.Task(peer.callbackWrapper.disconnection_callback(client_id, peer.address, peer.protocol))
@@ -106,7 +151,7 @@ class ConnectionHandler:
         
     # checks if a client is connected, if connected, return the protocol (called by the Server class in server module)
     async def is_connected(self, client_id):
-        return self.dbService.check_connection(client_id)
+        return await self.presence.lookup(client_id)
 
     '''
     END SECTION #1
@@ -130,9 +175,15 @@ class ConnectionHandler:
             return True
         return False
     
-    # checks if a channel is a valid string
+    # checks if a channel is a shared subscription ($share/<group>/<filter>)
+    def is_channel_shared(self, channel):
+        return parse_shared(str(channel)) is not None
+
+    # checks if a channel is a valid string, not longer than the channel column of the database
     def is_channel_valid(self, channel):
         channel = str(channel).strip()
+        if len(channel) > KEY_LENGTH:
+            return (False, channel)
         if channel.startswith('$') or channel.startswith('#'):
             if len(channel) > 1:
                 return (True, channel)
@@ -140,6 +191,41 @@ class ConnectionHandler:
             return (True, channel)
         return (False, channel)
 
+    # checks if a client id is given and not empty, one character shorter than the client id column of the database
+    # since the p2p channel of the client ('#' + client id) must fit the channel column too
+    def is_client_id_valid(self, client_id):
+        return client_id is not None and 0 < len(str(client_id)) < KEY_LENGTH
+
+    # checks if a channel is a valid subscription filter, the wildcards are allowed on the broadcast channels only
+    def is_filter_valid(self, channel):
+        if channel.startswith(SHARED_PREFIX):
+            shared = parse_shared(channel)
+            if shared is None:
+                return False
+            channel = shared[1]
+            if self.is_channel_p2p(channel) or self.is_channel_control(channel):
+                return False
+        if is_wildcard(channel):
+            return not self.is_channel_p2p(channel) and not self.is_channel_control(channel) and is_valid_filter(channel)
+        return True
+
+    # runs the subscription validator on each known channel a wildcard filter matches (the channels subscribed to
+    # by name and the retained channels), returns the first status which is not OK
+    # the channels created after the subscription are not validated
+    async def __validate_matched_channels(self, peer, channel_name, persistent_flag, protocol):
+        shared = parse_shared(channel_name)
+        topicFilter = shared[1] if shared is not None else channel_name
+        if not is_wildcard(topicFilter):
+            return StatusCode.OK
+        channels = set(self.dbService.subscriptions.matching_channels(topicFilter))
+        channels.update(self.retained.matching_channels(topicFilter))
+        for channel in sorted(channels):
+            status_code = await peer.callbackWrapper.validate_sub_callback(peer.client_id, channel, persistent_flag, peer.address, protocol)
+            if status_code != StatusCode.OK:
+                logger.log_warning(('Sub denied channel {0} matched by {1} from client {2} {3}').format(channel, channel_name, peer.client_id, peer.id), peer.tag)
+                return status_code
+        return StatusCode.OK
+
     # fetches all subscriptions for a channel from redis
     async def __fetch_subscribed_clients(self, channel_name):
         return await self.dbService.get_subscription_by_channel(channel_name)
@@ -174,7 +260,7 @@ class ConnectionHandler:
 
     # called when a client subscribes to a channel
     async def sub(self, sender_client_id, channel_name, persistent_flag):
-        if not self.is_channel_p2p(channel_name) and not self.is_channel_control(channel_name):
+        if self.is_channel_shared(channel_name) or (not self.is_channel_p2p(channel_name) and not self.is_channel_control(channel_name)):
             asyncio.Task(self.__put_subscription(sender_client_id, channel_name, persistent_flag))
             return StatusCode.OK
         logger.log_warning(('Security warning : subscribe to secure channel {0} from client {1}').format(channel_name, sender_client_id), 'ConnectionHandler(sub)')
@@ -182,7 +268,7 @@ class ConnectionHandler:
     
     # called when a client unsubscribes to a channel
     async def unsub(self, sender_client_id, channel_name):
-        if not self.is_channel_p2p(channel_name) and not self.is_channel_control(channel_name):
+        if self.is_channel_shared(channel_name) or (not self.is_channel_p2p(channel_name) and not self.is_channel_control(channel_name)):
             asyncio.Task(self.__remove_subscription(sender_client_id, channel_name))
             return StatusCode.OK
         logger.log_warning(('Security warning : unsubscribe to secure channel {0} from client {1}').format(channel_name, sender_client_id), 'ConnectionHandler(unsub)')
@@ -198,6 +284,11 @@ class ConnectionHandler:
     
     # called when a client publishes a data to a channel (called by the packet_handler)
     async def pub(self, sender_client_id, channel_name, data, retain_flag, qos):
+        if is_wildcard(channel_name):
+            # the wildcards are only used to subscribe
+            return StatusCode.INVALID_CHANNEL
+        if self.is_channel_p2p(channel_name):
+            return await self.__pub_p2p(sender_client_id, channel_name, data, qos)
         clients = await self.__fetch_subscribed_clients(channel_name)
         pck_id = await self.cacheService.get_next_packet_pck_id()
         pub_data = {
@@ -205,45 +296,119 @@ class ConnectionHandler:
         }
         # pub_str = json.dumps(pub_data)
         save = False
-        # loop over the clients
-        if len(clients) > 0:
-            for client_id in clients:
-                # only proceed if the client is not the sender
-                if client_id != sender_client_id:
-                    # check qos, only put the pck_id in client map if qos is 1
-                    if qos == QOS.ONE:
-                        save = True
-                        await self.__put_pub_map(client_id, pck_id, channel_name)
-                        
-                    await self.cacheService.handle_pub(client_id, pub_data)
+        # only send to the clients other than the sender
+        receivers = [client_id for client_id in clients if client_id != sender_client_id]
+        groups = self.dbService.subscriptions.shared_groups(channel_name)
+        if len(groups) > 0:
+            # one member of each shared subscription group, a member also subscribed directly receives the packet once
+            members = await self.__select_shared(groups, sender_client_id, qos)
+            direct = set(receivers)
+            receivers.extend(member for member in members if member not in direct)
+            if qos == QOS.ONE and self.shared.strategy == LEAST_OUTSTANDING and len(members) > 0:
+                pub_data[CacheService.PUB_SHARED_MEMBERS] = members
+                pub_data[CacheService.PUB_SHARED_ORIGIN] = self.cacheService.nodeId
+        if len(receivers) > 0:
+            # check qos, only save the packet and put the pck_id in client map if qos is 1
+            if qos == QOS.ONE:
+                save = True
+                # the packet must be committed before it is pushed and the pub is acknowledged
+                if not await self.dbService.insert_packet(pck_id, sender_client_id, channel_name, data, receivers):
+                    return StatusCode.SERVER_ERROR
+            await self.cacheService.handle_pub(receivers, pub_data)
 
         # check retain, put the packet into retain cache if true
-        if retain_flag and not self.is_channel_p2p(channel_name):
-            asyncio.Task(self.dbService.insert_retained_packet(sender_client_id, channel_name, data))
-        if save:
-            asyncio.Task(self.dbService.insert_packet(pck_id, sender_client_id, channel_name, data))
-            if self.is_channel_p2p(channel_name):
-                p2p_client = clients[0]
-                if await self.dbService.check_connection(p2p_client) is None:
-                    return StatusCode.CLIENT_OFFLINE
-        elif self.is_channel_p2p(channel_name):
-            return StatusCode.CLIENT_OFFLINE
+        if retain_flag:
+            self.retained.put(sender_client_id, channel_name, data)
+            await self.cacheService.handle_retain(sender_client_id, channel_name, data)
         return StatusCode.OK
 
+    # publishes to a p2p channel, the packet goes straight to the client owning the channel (its only subscriber)
+    # or to the server it is connected to, without the fan-out of the broadcast channels
+    # p2p packets are never retained, and never delivered to wildcard subscribers
+    async def __pub_p2p(self, sender_client_id, channel_name, data, qos):
+        receiver = None
+        for client_id in self.dbService.subscriptions.exact_clients(channel_name):
+            receiver = client_id
+            break
+        if receiver is None or receiver == sender_client_id:
+            self.p2pStats['offline'] += 1
+            return StatusCode.CLIENT_OFFLINE
+        pck_id = await self.cacheService.get_next_packet_pck_id()
+        if qos == QOS.ONE:
+            # kept as a pending packet if the client is offline
+            if not await self.dbService.insert_packet(pck_id, sender_client_id, channel_name, data, [receiver]):
+                return StatusCode.SERVER_ERROR
+        client = self.peers.get(receiver)
+        if client is not None:
+            peer = client['peer']
+            await peer.send(PacketGenerator.generate_push_frame(channel_name, data, pck_id, sender_client_id, False, qos))
+            logger.log_debug(('Push [id {3}] p2p channel {0} to client {1} , qos {2}').format(channel_name, receiver, qos, pck_id), peer.tag)
+            self.p2pStats['local'] += 1
+            return StatusCode.OK
+        pub_data = {
+            'c': channel_name, 'd' : data, 'f' : sender_client_id, 'q' : qos, 'id': pck_id
+        }
+        online = await self.cacheService.handle_p2p(receiver, pub_data)
+        if online is None:
+            online = await self.presence.lookup(receiver) is not None
+        self.p2pStats['remote' if online else 'offline'] += 1
+        return StatusCode.OK if online else StatusCode.CLIENT_OFFLINE
+
+    # picks one member of each shared subscription group, the members connected to a server are preferred
+    async def __select_shared(self, groups, sender_client_id, qos):
+        groups = [(shared, [member for member in members if member != sender_client_id]) for shared, members in groups]
+        candidates = set()
+        for _, members in groups:
+            candidates.update(members)
+        online = set(member for member in candidates if member in self.peers)
+        remote = [member for member in candidates if member not in online]
+        if len(remote) > 0:
+            online.update(await self.cacheService.online(remote))
+        selected = []
+        for shared, members in groups:
+            member = self.shared.select(shared, members, online, qos)
+            if member is not None and member not in selected:
+                selected.append(member)
+        return selected
+
+    # called when the push ack of a shared subscription packet picked by this server arrives (called by the cache service)
+    def __process_shared_ack(self, client_id):
+        self.shared.acked(client_id)
+
     # proceeses a pub data (called by __redis_sub_thread)
-    async def __process_pub(self, channel_name, data, sender_client_id, qos, pub_pck_id, client_id):
-        proceed = True
-        clients = await self.__fetch_subscribed_clients(channel_name)
-        if not client_id in clients:
-            proceed = False
+    # returns True if the packet was sent, origin is the server which picked the client for a shared subscription
+    async def __process_pub(self, channel_name, data, sender_client_id, qos, pub_pck_id, client_id, shared = True, origin = None):
+        proceed = await self.dbService.check_subscription(client_id, channel_name) > 0
         if proceed:
             if client_id in self.peers:
                 client = self.peers[client_id]
                 peer = client['peer']
-                pushPck = PacketGenerator.generate_push_req(channel_name, data, pub_pck_id, sender_client_id, False, qos)
+                if shared:
+                    pushPck = self.__get_push_frame(channel_name, data, sender_client_id, qos, pub_pck_id)
+                else:
+                    # the pending packets of one client would only evict the shared frames
+                    pushPck = PacketGenerator.generate_push_frame(channel_name, data, pub_pck_id, sender_client_id, False, qos)
                 await peer.send(pushPck)
+                if origin is not None and qos == QOS.ONE:
+                    acks = self.sharedAcks.get(client_id)
+                    if acks is None:
+                        acks = self.sharedAcks[client_id] = {}
+                    acks[pub_pck_id] = origin
                 log_msg = ('Push [id {4}] channel {0} to client {1} , qos {3} {2}').format(channel_name, peer.client_id, peer.id, qos, pub_pck_id)
                 logger.log_debug(log_msg, peer.tag)
+                return True
+        return False
+    
+    # returns the encoded push frame of a publish, the frame is created once and shared by all the subscribers
+    def __get_push_frame(self, channel_name, data, sender_client_id, qos, pub_pck_id):
+        key = (pub_pck_id, qos)
+        frame = self.pushFrames.get(key)
+        if frame is None:
+            frame = PacketGenerator.generate_push_frame(channel_name, data, pub_pck_id, sender_client_id, False, qos)
+            self.pushFrames[key] = frame
+            if len(self.pushFrames) > self.PUSH_FRAME_CACHE_SIZE:
+                self.pushFrames.popitem(last = False)
+        return frame
     
     '''
     END SECTION #3
@@ -257,18 +422,37 @@ class ConnectionHandler:
 
     # called when a client connects, it sends the pending packets with qos 1 to the client (called by the socket layer)
     async def send_pending_pub(self, client_id):
-        self.pubmap[client_id] = await self.__get_pub_maps(client_id)
-        await self.__send_next_pending(client_id)
+        packet_ids = await self.__get_pub_maps(client_id)
+        if len(packet_ids) > 0:
+            self.pubmap[client_id] = PendingDelivery(packet_ids)
+            await self.__send_next_pending(client_id)
     
+    # sends pending packets until the window is full, the packets are loaded in bulk as the window moves
     async def __send_next_pending(self, client_id):
-        if client_id in self.pubmap:
-            if len(self.pubmap[client_id]) > 0:
-                next_pck_id = self.pubmap[client_id][0]
-                packet = await self.dbService.get_packet(next_pck_id)
-                if packet is not None:
-                    asyncio.Task(self.__process_pub(packet['channel'], packet['data'], packet['sender_id'], 1, packet['packet_id'], client_id))
-            else:
-                del self.pubmap[client_id]
+        pending = self.pubmap.get(client_id)
+        if pending is None or pending.sending:
+            return
+        pending.sending = True
+        try:
+            while self.pubmap.get(client_id) is pending and len(pending.inflight) < self.pendingWindow:
+                if len(pending.packets) == 0:
+                    ids = pending.next_ids(self.pendingPrefetch)
+                    if len(ids) == 0:
+                        break
+                    packets = await self.dbService.get_packets(ids)
+                    # the packets removed in the meantime are skipped
+                    pending.packets.extend(packets[pck_id] for pck_id in ids if pck_id in packets)
+                    continue
+                packet = pending.packets.popleft()
+                pending.inflight.add(packet['packet_id'])
+                sent = await self.__process_pub(packet['channel'], packet['data'], packet['sender_id'], 1, packet['packet_id'], client_id, False)
+                if not sent:
+                    # unsubscribed channel or client gone, no push ack will come for it
+                    pending.ack(packet['packet_id'])
+        finally:
+            pending.sending = False
+        if pending.done() and self.pubmap.get(client_id) is pending:
+            del self.pubmap[client_id]
 
     # called when a client connects or subscribes to a channel, it sends the retained packets to the client
     async def send_retained(self, client_id, channel = None):
@@ -278,25 +462,24 @@ class ConnectionHandler:
             channels = list(channels.keys())
         else:
             channels.append(channel)
-        retained_packets = await self.dbService.get_retained_packets(channels)
-        if retained_packets is not None:
-            for packet in retained_packets:
-                channel_name, data, sender_client_id= packet['channel'], packet['data'], packet['sender_id']
-                if client_id in self.peers:
-                    pck_id = 0
-                    client = self.peers[client_id]
-                    peer = client['peer']
-                    pushPck = PacketGenerator.generate_push_req(channel_name, data, pck_id, sender_client_id, True, 0)
-                    await peer.send(pushPck)
+        # the retained packets are not sent to the members of shared subscription groups
+        channels = [channel for channel in channels if not channel.startswith(SHARED_PREFIX)]
+        if len(channels) == 0:
+            return
+        frames = await self.retained.get(channels)
+        for frame in frames:
+            if client_id in self.peers:
+                peer = self.peers[client_id]['peer']
+                await peer.send(frame)
+
+    # called when another server has stored a retained packet (called by the cache service)
+    def __process_retain(self, sender_client_id, channel_name, data):
+        self.retained.put(sender_client_id, channel_name, data, persist = False)
 
     # fetches a list of pending qos 1 packets
     async def __get_pub_maps(self, client_id):
         return await self.dbService.get_pubmap(client_id)
 
-    # maps a packet with qos 1 to a client 
-    async def __put_pub_map(self, client_id, pub_pck_id, channel):
-        asyncio.Task(self.dbService.insert_pubmap(pub_pck_id, client_id, channel))
-
     # removes a client and packet mapping
     async def __remove_pub_map(self, client_id, pub_pck_id):
         await self.dbService.remove_pubmap(pub_pck_id, client_id)
@@ -305,11 +488,18 @@ class ConnectionHandler:
     async def process_push_ack(self, pck_id, client_id):
         # remove the pub pck_id from client map
         await self.__remove_pub_map(client_id, pck_id)
-        # check if the packet is in pending packets, then send the next one
-        if client_id in self.pubmap:
-            if pck_id in self.pubmap[client_id]:
-                self.pubmap[client_id].remove(pck_id)
-                await self.__send_next_pending(client_id)
+        # report the ack of a shared subscription packet to the server which picked the client
+        acks = self.sharedAcks.get(client_id)
+        if acks is not None:
+            origin = acks.pop(pck_id, None)
+            if len(acks) == 0:
+                del self.sharedAcks[client_id]
+            if origin is not None:
+                await self.cacheService.send_shared_ack(origin, client_id)
+        # check if the packet is in pending packets, then send the next ones
+        pending = self.pubmap.get(client_id)
+        if pending is not None and pending.ack(pck_id):
+            await self.__send_next_pending(client_id)
 
     '''
     END SECTION #4
@@ -336,6 +526,22 @@ class ConnectionHandler:
     async def force_pub(self, channel, data, qos, retain):
         await self.pub("", channel, data, retain, qos)
 
+    # returns the runtime metrics of the server
+    def get_metrics(self):
+        metrics = {
+            'peers': len(self.peers)
+        }
+        metrics.update(self.cacheService.get_metrics())
+        metrics.update(self.dbService.get_metrics())
+        metrics['retained'] = self.retained.get_metrics()
+        metrics['outbound'] = dict(self.outboundStats)
+        metrics['outbound']['slow_consumers'] = len([c for c in self.peers.values() if c['peer'].outbound.slow])
+        metrics['idle'] = self.idleTracker.get_metrics()
+        metrics['presence'] = self.presence.get_metrics()
+        metrics['p2p'] = dict(self.p2pStats)
+        metrics['shared'] = self.shared.get_metrics()
+        return metrics
+
     '''
     END SECTION #5
     '''
@@ -360,7 +566,19 @@ class ConnectionHandler:
             elif packet.packetType == PacketTypes.conn:
                 auth_token = PacketParser.get_arg(JSONKeys.authToken, packet.packetData)
                 client_id = PacketParser.get_arg(JSONKeys.clientId, packet.packetData)
-                status_code = await peer.callbackWrapper.validate_conn_callback(client_id, auth_token, peer.address, packet.protocol)
+                codec = PacketParser.get_arg(JSONKeys.codec, packet.packetData)
+                if codec is not None and codec not in self.codecs:
+                    logger.log_warning(('Codec {0} not accepted, using json: client {1} {2}').format(codec, client_id, peer.id), peer.tag)
+                    codec = None
+                compression = PacketParser.get_arg(JSONKeys.compression, packet.packetData)
+                if compression is not None and (packet.protocol not in [Protocol.SOCKET, Protocol.SSL_SOCKET] or not self.compression.accepts(compression)):
+                    logger.log_warning(('Compression {0} not accepted: client {1} {2}').format(compression, client_id, peer.id), peer.tag)
+                    compression = None
+                if self.is_client_id_valid(client_id):
+                    status_code = await peer.callbackWrapper.validate_conn_callback(client_id, auth_token, peer.address, packet.protocol)
+                else:
+                    logger.log_warning(('Conn INVALID client id {0} {1}').format(client_id, peer.id), peer.tag)
+                    status_code = StatusCode.INVALID_PACKET
                 if status_code == StatusCode.OK:
                     connected = await self.connect_client(auth_token, client_id, packet.protocol, peer)
                     if connected:
@@ -373,7 +591,8 @@ class ConnectionHandler:
                 if status_code != StatusCode.OK:
                     log_msg = ('Conn FAILED: token {1}, status {0} {2}').format(status_code, auth_token, peer.id)
                     logger.log_warning(log_msg, peer.tag)
-                response = PacketGenerator.generate_conn_res(status_code, self.settings.TIMEOUT_SECONDS)
+                response = PacketGenerator.generate_conn_res(status_code, self.settings.TIMEOUT_SECONDS,
+                                                              codec if status_code == StatusCode.OK else None, compression if status_code == StatusCode.OK else None)
             elif peer.client_id != None:
                 #disconn handler
                 if packet.packetType == PacketTypes.disconn:
@@ -386,7 +605,7 @@ class ConnectionHandler:
                     channel_name = PacketParser.get_arg(JSONKeys.channelName, packet.packetData)
                     channel_valid, channel_name = self.is_channel_valid(channel_name)
                     pck_id = PacketParser.get_arg(JSONKeys.packetId, packet.packetData)
-                    if channel_valid:
+                    if channel_valid and not is_wildcard(channel_name):
                         data = PacketParser.get_arg(JSONKeys.data, packet.packetData)
                         retain_flag = PacketParser.get_arg(JSONKeys.retainFlag, packet.packetData, False)
                         qos = PacketParser.get_arg(JSONKeys.qos, packet.packetData, QOS.ZERO)
@@ -404,6 +623,8 @@ class ConnectionHandler:
                             if qos == QOS.ONE:
                                 response = PacketGenerator.generate_pub_res(status_code, pck_id)
                         else:
+                            if isinstance(data, serializer.RawJSON):
+                                data = data.value()
                             status_code, response_data = await peer.callbackWrapper.control_data_callback(peer.client_id, channel_name, data, peer.address, packet.protocol)
                             response = PacketGenerator.generate_pub_res(status_code, pck_id, response_data)
                             log_msg = ('Control Pub channel {0} from client {1} {2} : status {3}').format(channel_name, peer.client_id, peer.id, status_code)
@@ -425,8 +646,10 @@ class ConnectionHandler:
                     channel_name = PacketParser.get_arg(JSONKeys.channelName, packet.packetData)
                     persistent_flag = PacketParser.get_arg(JSONKeys.persistent, packet.packetData, False)
                     channel_valid, channel_name = self.is_channel_valid(channel_name)
-                    if channel_valid:
+                    if channel_valid and self.is_filter_valid(channel_name):
                         status_code = await peer.callbackWrapper.validate_sub_callback(peer.client_id, channel_name, persistent_flag, peer.address, packet.protocol)
+                        if status_code == StatusCode.OK:
+                            status_code = await self.__validate_matched_channels(peer, channel_name, persistent_flag, packet.protocol)
                     else:
                         status_code = StatusCode.INVALID_CHANNEL
                     if status_code == StatusCode.OK:
@@ -442,7 +665,7 @@ class ConnectionHandler:
                 elif packet.packetType == PacketTypes.unsub:
                     channel_name = PacketParser.get_arg(JSONKeys.channelName, packet.packetData)
                     channel_valid, channel_name = self.is_channel_valid(channel_name)
-                    if channel_valid:
+                    if channel_valid and self.is_filter_valid(channel_name):
                         status_code = await peer.callbackWrapper.validate_unsub_callback(peer.client_id, channel_name, peer.address, packet.protocol)
                     else:
                         status_code = StatusCode.INVALID_CHANNEL
@@ -76,6 +76,8 @@ class JSONKeys:
     clientId = 'cl'
     retainFlag = 'rt'
     qos = 'q'
+    codec = 'cd'
+    compression = 'cp'
 
 class QOS:
     ZERO = 0
@@ -0,0 +1,65 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import asyncio
+
+# uvloop is optional
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# the event loops which may be chosen with the EVENT_LOOP setting, auto = uvloop if it is installed
+EVENT_LOOPS = ['auto', 'uvloop', 'asyncio']
+
+# returns the name of the event loop chosen by the settings (uvloop or asyncio)
+def event_loop_name(settings):
+    name = str(settings.get('EVENT_LOOP', 'auto')).strip().lower()
+    if name in ['auto', 'uvloop'] and uvloop is not None:
+        return 'uvloop'
+    return 'asyncio'
+
+# returns a new event loop of the kind chosen by the settings
+def new_event_loop(settings):
+    if event_loop_name(settings) == 'uvloop':
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+# returns the name of the kind of an event loop
+def loop_name(eventLoop):
+    if uvloop is not None and isinstance(eventLoop, uvloop.Loop):
+        return 'uvloop'
+    return 'asyncio'
+
+# checks the EVENT_LOOP setting against the loop the server runs on, returns the warnings to log
+# (auto accepts the loop it is given)
+def check_event_loop(settings, eventLoop):
+    warnings = []
+    name = str(settings.get('EVENT_LOOP', 'auto')).strip().lower()
+    if name not in EVENT_LOOPS:
+        warnings.append(('Unknown EVENT_LOOP {0}, expected one of {1}').format(name, ', '.join(EVENT_LOOPS)))
+    elif name == 'uvloop' and uvloop is None:
+        warnings.append('EVENT_LOOP is uvloop but uvloop is not installed, using asyncio')
+    elif name != 'auto' and loop_name(eventLoop) != name:
+        warnings.append(('EVENT_LOOP is {0} but the server runs on a {1} loop, create it with Server.create_event_loop')
+                        .format(name, loop_name(eventLoop)))
+    return warnings
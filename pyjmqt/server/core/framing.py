@@ -0,0 +1,34 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+from pyjmqt.common.framing import FramingError, FrameTooLargeError, CorruptFrameError, FrameBuffer, LengthPrefixedBuffer
+
+DEFAULT_MAX_FRAME_SIZE = 8 * 1024 * 1024
+
+# socket framings, NUL terminated (JSON), length-prefixed (binary codecs, compression) and length-prefixed compressed
+NUL_FRAMING = 'nul'
+LENGTH_FRAMING = 'length'
+COMPRESSED_FRAMING = 'compressed'
+
+# returns the maximum frame size in bytes from the settings, None = no limit
+def max_frame_size(settings):
+    size = settings.get('MAX_FRAME_SIZE', DEFAULT_MAX_FRAME_SIZE)
+    return size if size > 0 else None
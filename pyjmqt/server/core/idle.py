@@ -0,0 +1,111 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import math
+
+import pyjmqt.server.logger as logger
+
+# creates the idle tracker of the peers from the settings, TIMEOUT_SECONDS (0 = no timeout) and
+# IDLE_RESOLUTION_MS (how late a silent peer may be expired)
+def create_idle_tracker(eventLoop, settings):
+    return IdleTracker(eventLoop, settings.TIMEOUT_SECONDS, settings.get('IDLE_RESOLUTION_MS', 1000) / 1000.0)
+
+# expires the peers which have not sent anything for timeout seconds, for all the connections at once
+# a hashed timer wheel : one slot per resolution seconds, a peer sits in the slot of its deadline and
+# receiving a frame only stores the time, the peer is moved when its slot comes up and it was seen since
+# so one timer runs for the whole server instead of one timeout per read
+# a peer has to implement idle_timeout(), called when it expires (it is not tracked anymore)
+class IdleTracker():
+    def __init__(self, eventLoop, timeout, resolution):
+        self.loop = eventLoop
+        self.timeout = timeout
+        self.enabled = timeout is not None and timeout > 0
+        self.resolution = max(0.01, resolution)
+        size = (int(math.ceil(timeout / self.resolution)) if self.enabled else 0) + 2
+        self.slots = [set() for _ in range(size)]
+        self.cursor = 0
+        self.nextTick = None
+        self.timer = None
+        self.count = 0
+        # metrics
+        self.expired = 0
+
+    def __len__(self):
+        return self.count
+
+    # starts tracking a peer, as if it had just sent a frame
+    def add(self, peer):
+        if not self.enabled:
+            return
+        peer.lastSeen = self.loop.time()
+        peer.idleSlot = None
+        self.__place(peer, self.timeout)
+        self.count += 1
+        if self.timer is None:
+            self.nextTick = self.loop.time() + self.resolution
+            self.timer = self.loop.call_at(self.nextTick, self.__tick)
+
+    # called for each frame received from a peer
+    def touch(self, peer):
+        peer.lastSeen = self.loop.time()
+
+    def remove(self, peer):
+        slot = getattr(peer, 'idleSlot', None)
+        if slot is not None:
+            self.slots[slot].discard(peer)
+            peer.idleSlot = None
+            self.count -= 1
+
+    def __place(self, peer, delay):
+        ticks = min(len(self.slots) - 1, max(1, int(math.ceil(delay / self.resolution))))
+        peer.idleSlot = (self.cursor + ticks) % len(self.slots)
+        self.slots[peer.idleSlot].add(peer)
+
+    def __tick(self):
+        self.timer = None
+        self.cursor = (self.cursor + 1) % len(self.slots)
+        due = self.slots[self.cursor]
+        self.slots[self.cursor] = set()
+        now = self.loop.time()
+        for peer in due:
+            remaining = peer.lastSeen + self.timeout - now
+            if remaining > 0:
+                # seen since it was placed, moved to the slot of its new deadline
+                self.__place(peer, remaining)
+                continue
+            peer.idleSlot = None
+            self.count -= 1
+            self.expired += 1
+            try:
+                peer.idle_timeout()
+            except Exception as ex:
+                logger.log_error(ex, 'IdleTracker')
+        if self.count > 0:
+            # the ticks keep their pace even if one of them runs late
+            self.nextTick = max(self.nextTick + self.resolution, now)
+            self.timer = self.loop.call_at(self.nextTick, self.__tick)
+
+    def get_metrics(self):
+        return {
+            'tracked': self.count,
+            'expired': self.expired
+        }
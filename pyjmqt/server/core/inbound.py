@@ -0,0 +1,73 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+import asyncio
+
+import pyjmqt.server.logger as logger
+
+# creates the inbound queue of a peer from the settings
+def create_inbound_queue(handler, settings, tag):
+    return InboundQueue(handler, settings.get('INBOUND_QUEUE_SIZE', 256), settings.get('INBOUND_CONCURRENCY', 1), tag)
+
+# bounded queue of the packets received from one peer, processed by a fixed number of workers
+# with one worker the packets are processed one at a time, in the order they were received
+# put waits while the queue is full, so the peer is not read anymore and tcp pushes back on the client
+class InboundQueue():
+    def __init__(self, handler, maxSize, concurrency, tag):
+        # coroutine function called with each packet
+        self.handler = handler
+        self.tag = tag
+        self.concurrency = max(1, concurrency)
+        # room for the stop markers of the workers
+        self.queue = asyncio.Queue(maxsize = max(maxSize, self.concurrency))
+        self.workers = [asyncio.ensure_future(self.__worker()) for _ in range(self.concurrency)]
+        self.closed = False
+
+    # queues a packet, waits while the queue is full
+    async def put(self, packet):
+        await self.queue.put(packet)
+
+    # waits until the queued packets are processed
+    async def join(self):
+        await self.queue.join()
+
+    # drops the packets not processed yet and stops the workers once they finish their current packet
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.queue.task_done()
+        for _ in range(self.concurrency):
+            self.queue.put_nowait(None)
+
+    async def __worker(self):
+        while True:
+            packet = await self.queue.get()
+            try:
+                if packet is None:
+                    break
+                await self.handler(packet)
+            except Exception as ex:
+                logger.log_error(ex, '[inbound] ' + self.tag)
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,175 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+import asyncio
+import collections
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.constants import PacketTypes, JSONKeys
+
+# creates the outbound queue of a peer from the settings
+def create_outbound_queue(peer, write, settings, stats):
+    return OutboundQueue(peer, write,
+                settings.get('OUTBOUND_HIGH_WATERMARK', 1024 * 1024),
+                settings.get('OUTBOUND_LOW_WATERMARK', 256 * 1024),
+                settings.get('OUTBOUND_MAX_BYTES', 16 * 1024 * 1024),
+                settings.get('SLOW_CONSUMER_POLICY', OutboundQueue.DROP_QOS0),
+                stats)
+
+# frames waiting to be written to one peer
+# the publishers only queue the frames, one writer task hands all the queued frames to the transport at once
+# a peer with more than highWatermark queued bytes is a slow consumer until it is back under lowWatermark,
+# meanwhile the new frames follow the overflow policy :
+#   disconnect : the peer is disconnected
+#   drop_qos0 : the qos 0 push frames are dropped
+#   conflate : a qos 0 push frame replaces the queued qos 0 push frame of the same channel
+# a peer with more than maxBytes queued bytes is disconnected whatever the policy
+class OutboundQueue():
+    DISCONNECT = 'disconnect'
+    DROP_QOS0 = 'drop_qos0'
+    CONFLATE = 'conflate'
+
+    def __init__(self, peer, write, highWatermark, lowWatermark, maxBytes, policy, stats):
+        self.peer = peer
+        # coroutine function writing a list of encoded frames
+        self.write = write
+        self.highWatermark = highWatermark
+        self.lowWatermark = min(lowWatermark, highWatermark)
+        self.maxBytes = max(maxBytes, highWatermark)
+        if policy not in (self.DISCONNECT, self.DROP_QOS0, self.CONFLATE):
+            logger.log_warning(('Unknown SLOW_CONSUMER_POLICY {0}, using {1}').format(policy, self.DROP_QOS0), 'OutboundQueue')
+            policy = self.DROP_QOS0
+        self.policy = policy
+        # shared counters of all the peers (collections.Counter)
+        self.stats = stats
+        # [frame, size], in write order
+        self.frames = collections.deque()
+        # channel -> queued entry of a qos 0 push frame, used to conflate
+        self.latest = {}
+        self.bytes = 0
+        self.slow = False
+        self.overflowed = False
+        self.closed = False
+        # True while the writer awaits a write
+        self.writing = False
+        self.wakeup = None
+        self.task = None
+
+    # queues an encoded frame, packet is the packet dict it was encoded from
+    def put(self, packet, frame):
+        if self.closed:
+            return
+        size = len(frame)
+        channel = self.__qos0_channel(packet)
+        if self.slow and channel is not None:
+            if self.policy == self.DROP_QOS0:
+                self.stats['dropped_frames'] += 1
+                return
+            if self.policy == self.CONFLATE and channel in self.latest:
+                entry = self.latest[channel]
+                self.bytes += size - entry[1]
+                entry[0], entry[1] = frame, size
+                self.stats['conflated_frames'] += 1
+                return
+        entry = [frame, size]
+        self.frames.append(entry)
+        if channel is not None:
+            self.latest[channel] = entry
+        self.bytes += size
+        if self.bytes > self.highWatermark:
+            self.__overflow()
+        if self.task is None:
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.ensure_future(self.__writer())
+        self.wakeup.set()
+
+    # stops the writer and returns the frames not written yet (none if the peer overflowed)
+    def close(self):
+        self.closed = True
+        if self.task is not None:
+            self.task.cancel()
+        frames = [] if self.overflowed else [entry[0] for entry in self.frames]
+        self.frames.clear()
+        self.latest.clear()
+        self.bytes = 0
+        return frames
+
+    # stops queueing and lets the writer finish the batch it is writing (for timeout seconds at most),
+    # returns the frames not written yet (none if the peer overflowed)
+    async def drain(self, timeout = 10):
+        if self.task is not None and self.writing:
+            # the writer stops after the current batch
+            self.closed = True
+            await asyncio.wait([self.task], timeout = timeout)
+        return self.close()
+
+    # returns the channel of a qos 0 push packet, None for the other packets
+    @staticmethod
+    def __qos0_channel(packet):
+        push = packet.get(PacketTypes.push) if isinstance(packet, dict) else None
+        if push is not None and push.get(JSONKeys.qos, 0) == 0:
+            return push.get(JSONKeys.channelName)
+        return None
+
+    def __overflow(self):
+        if not self.slow:
+            self.slow = True
+            self.stats['slow_consumer_events'] += 1
+            self.__notify('slow')
+        if self.policy == self.DISCONNECT or self.bytes > self.maxBytes:
+            self.overflowed = True
+            self.closed = True
+            self.stats['slow_consumer_disconnects'] += 1
+            logger.log_warning(('Slow consumer disconnected: client {0}, peer {1}, {2} bytes queued').format(self.peer.client_id, self.peer.id, self.bytes), self.peer.tag)
+            self.__notify('disconnected')
+            if self.peer.client_id is not None:
+                asyncio.ensure_future(self.peer.connectionHandler.disconnect_client(self.peer.client_id))
+            else:
+                asyncio.ensure_future(self.peer.disconnect())
+
+    def __notify(self, event):
+        callback = self.peer.callbackWrapper.slow_consumer_callback if self.peer.callbackWrapper is not None else None
+        if callback is not None:
+            asyncio.ensure_future(callback(self.peer.client_id, self.peer.address, self.peer.protocol, event, self.bytes))
+
+    async def __writer(self):
+        while not self.closed:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while len(self.frames) > 0 and not self.closed:
+                batch = [entry[0] for entry in self.frames]
+                self.frames.clear()
+                self.latest.clear()
+                self.bytes = 0
+                self.stats['writes'] += 1
+                self.stats['frames'] += len(batch)
+                self.writing = True
+                try:
+                    await self.write(batch)
+                except Exception as ex:
+                    logger.log_error(ex, '[outbound] ' + self.peer.tag)
+                    self.closed = True
+                    break
+                finally:
+                    self.writing = False
+                if self.slow and self.bytes <= self.lowWatermark:
+                    self.slow = False
+                    self.__notify('recovered')
@@ -19,9 +19,85 @@
 # OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
 # OR OTHER DEALINGS IN THE SOFTWARE.
 
-import json
+import collections
+import zlib
 import pyjmqt.server.logger as logger
+import pyjmqt.server.core.serializer as serializer
 from pyjmqt.server.core.constants import *
+from pyjmqt.server.core.framing import LengthPrefixedBuffer, NUL_FRAMING, LENGTH_FRAMING, COMPRESSED_FRAMING
+import pyjmqt.common.codecs as wire_codecs
+
+# JSON text of a pub or push packet whose payload is a RawJSON (PAYLOAD_PASSTHROUGH), the payload is spliced
+# as it was received, returns None for the other packets
+def spliced_json(packet):
+    if serializer.passthrough and len(packet) == 1:
+        for packetType, body in packet.items():
+            if isinstance(body, dict) and isinstance(body.get(JSONKeys.data), serializer.RawJSON):
+                return '{' + serializer.dumps(packetType) + ': ' + serializer.dumps_spliced(body, JSONKeys.data) + '}'
+    return None
+
+# default hook of the binary codecs, a RawJSON payload is decoded to be encoded again
+def raw_json_default(obj):
+    if isinstance(obj, serializer.RawJSON):
+        return obj.value()
+    raise TypeError('Object of type {0} can not be encoded'.format(type(obj).__name__))
+
+# the wire codecs, a client chooses one with the 'cd' key of its conn packet
+# the packets before the connAck (and the connAck itself) are always JSON
+# JSON packets are NUL terminated on a socket and text messages on a websocket,
+# binary packets are length-prefixed on a socket and binary messages on a websocket,
+# the JSON packets are length-prefixed too when the compression is negotiated on a socket
+# the binary values sent by JSON clients ({"$b64": ...}) are forwarded as they are
+class JSONCodec:
+    name = 'json'
+    binary = False
+
+    @staticmethod
+    def dumps(packet):
+        text = spliced_json(packet)
+        return text if text is not None else serializer.dumps(packet)
+
+    @staticmethod
+    def loads(data):
+        if serializer.passthrough and len(data) >= serializer.passthroughMinSize:
+            # only the envelope of a pub packet is decoded
+            return serializer.loads_raw(data, (PacketTypes.pub, JSONKeys.data))
+        return serializer.loads(data)
+
+    # utf8 bytes of a packet
+    @staticmethod
+    def dumps_bytes(packet):
+        text = spliced_json(packet)
+        if text is not None:
+            return text.encode('utf8')
+        return serializer.dumps_bytes(packet)
+
+# a RawJSON payload is decoded to be encoded again by the binary codecs
+class MessagePackCodec(wire_codecs.MessagePackCodec):
+    @staticmethod
+    def dumps(packet):
+        return wire_codecs.MessagePackCodec.dumps(packet, raw_json_default)
+
+class CBORCodec(wire_codecs.CBORCodec):
+    @staticmethod
+    def dumps(packet):
+        return wire_codecs.CBORCodec.dumps(packet, raw_json_default)
+
+# name -> codec, the codecs whose module is installed
+CODECS = collections.OrderedDict((codec.name, codec) for codec, module in
+            [(JSONCodec, serializer), (MessagePackCodec, wire_codecs.msgpack), (CBORCodec, wire_codecs.cbor2)] if module is not None)
+
+# returns the codecs the clients may choose from the settings (CODECS, comma separated names)
+def accepted_codecs(settings):
+    codecs = {JSONCodec.name: JSONCodec}
+    names = settings.get('CODECS', ','.join(CODECS.keys()))
+    for name in str(names).split(','):
+        name = name.strip().lower()
+        if name in CODECS:
+            codecs[name] = CODECS[name]
+        elif len(name) > 0:
+            logger.log_warning(('Codec {0} is not available').format(name), 'accepted_codecs')
+    return codecs
 
 
 # request packet class, return from PacketParser.parse_packet
@@ -30,6 +106,47 @@ class Packet:
     packetData = None
     protocol = ''
 
+# a generated packet which is serialized only once per codec, no matter how many peers it is written to
+class EncodedPacket:
+    def __init__(self, packet):
+        self.packet = packet
+        # codec name -> encoded packet
+        self.__encoded = {}
+        # (codec name, framing) -> socket frame
+        self.__socket_frames = {}
+
+    # the packet encoded with a codec (websocket message), json text by default
+    def encoded(self, codec = JSONCodec):
+        encoded = self.__encoded.get(codec.name)
+        if encoded is None:
+            encoded = self.__encoded[codec.name] = codec.dumps(self.packet)
+        return encoded
+
+    # json text of the packet (websocket framing)
+    def text(self):
+        return self.encoded(JSONCodec)
+
+    # the packet framed for a socket, utf8 bytes terminated with NUL by default
+    # a compressed frame is compressed once and shared by all the subscribers of a push
+    def socket_frame(self, codec = JSONCodec, framing = NUL_FRAMING, level = 6):
+        key = (codec.name, framing)
+        frame = self.__socket_frames.get(key)
+        if frame is None:
+            if framing == COMPRESSED_FRAMING:
+                payload = memoryview(self.socket_frame(codec, LENGTH_FRAMING))[LengthPrefixedBuffer.HEADER.size:]
+                frame = LengthPrefixedBuffer.frame(zlib.compress(payload, level), True)
+            else:
+                encoded = self.__encoded.get(codec.name)
+                if encoded is None:
+                    payload = codec.dumps_bytes(self.packet)
+                elif codec.binary:
+                    payload = encoded
+                else:
+                    payload = encoded.encode('utf8')
+                frame = LengthPrefixedBuffer.frame(payload) if framing == LENGTH_FRAMING else payload + b'\0'
+            self.__socket_frames[key] = frame
+        return frame
+
 # parses an incoming request packet
 class PacketParser:
 
@@ -59,12 +176,12 @@ class PacketParser:
             return default
 
     @staticmethod
-    def parse_packet(str_data, protocol):
+    def parse_packet(str_data, protocol, codec = JSONCodec):
         packet = None
         msg = ''
         try:
             # load the json data
-            json_data = json.loads(str_data)
+            json_data = codec.loads(str_data)
             packet = Packet()
             packet.protocol = protocol
             keys = json_data.keys()
@@ -142,10 +259,14 @@ class PacketGenerator:
 
     # connection response
     @staticmethod
-    def generate_conn_res(status_code, timeout_seconds):
+    def generate_conn_res(status_code, timeout_seconds, codec = None, compression = None):
         resp_data = {}
         resp_data[JSONKeys.statusCode] = PacketGenerator.__validate_status(status_code)
         resp_data[JSONKeys.timeoutSeconds] = PacketGenerator.__validate_int(timeout_seconds, 'timeout seconds')
+        if codec is not None:
+            resp_data[JSONKeys.codec] = PacketGenerator.__validate_string(codec, 'codec')
+        if compression is not None:
+            resp_data[JSONKeys.compression] = PacketGenerator.__validate_string(compression, 'compression')
         pck = {}
         pck[PacketTypes.connAck] = resp_data
         return pck
@@ -178,6 +299,11 @@ class PacketGenerator:
             pck[PacketTypes.push][JSONKeys.qos] = PacketGenerator.__validate_qos(qos)
         return pck
 
+    # push request, serialized once and shared by all the receivers
+    @staticmethod
+    def generate_push_frame(channel_name, data, pck_id, client_id, retain_flag, qos):
+        return EncodedPacket(PacketGenerator.generate_push_req(channel_name, data, pck_id, client_id, retain_flag, qos))
+
     # sub response
     @staticmethod
     def generate_sub_res(status_code, channel_name):
@@ -0,0 +1,52 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+import collections
+
+# pending qos 1 packets of a reconnected client
+# the packet ids are prefetched in bulk and up to a window of packets is sent before their push acks arrive
+class PendingDelivery():
+    def __init__(self, packet_ids):
+        # ids of the packets not loaded yet, in publish order
+        self.queue = collections.deque(packet_ids)
+        # loaded packets not sent yet
+        self.packets = collections.deque()
+        # ids of the packets sent and waiting for a push ack
+        self.inflight = set()
+        # set while a task is sending, the acks only free the window
+        self.sending = False
+
+    # removes the next count packet ids to be loaded
+    def next_ids(self, count):
+        ids = []
+        while len(self.queue) > 0 and len(ids) < count:
+            ids.append(self.queue.popleft())
+        return ids
+
+    # returns True if the packet was in flight
+    def ack(self, packet_id):
+        if packet_id in self.inflight:
+            self.inflight.remove(packet_id)
+            return True
+        return False
+
+    def done(self):
+        return len(self.queue) == 0 and len(self.packets) == 0 and len(self.inflight) == 0
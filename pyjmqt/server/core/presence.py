@@ -0,0 +1,202 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import asyncio
+import datetime
+import time
+
+import pyjmqt.server.logger as logger
+import pyjmqt.server.core.serializer as serializer
+
+PRESENCE_MIRRORS = ['db', 'redis', 'none']
+
+# creates the presence registry from the settings, PRESENCE_MIRROR (where the connections are copied to) and
+# PRESENCE_FLUSH_MS (how late the copy may be)
+def create_presence_registry(settings, dbService, cacheService):
+    mirror = str(settings.get('PRESENCE_MIRROR', 'db')).lower()
+    if mirror not in PRESENCE_MIRRORS:
+        logger.log_warning('Unknown PRESENCE_MIRROR {0}, using db'.format(mirror), 'PresenceRegistry')
+        mirror = 'db'
+    if mirror == 'redis' and not cacheService.REDIS_ENABLED:
+        logger.log_warning('PRESENCE_MIRROR is redis but Redis is disabled, using db', 'PresenceRegistry')
+        mirror = 'db'
+    # the clients of the other servers (shared MySQL/MariaDb) or workers are only known through the mirror
+    shared = bool(settings.ENABLE_MYSQL) or cacheService.bus is not None
+    if mirror == 'none' and shared:
+        logger.log_warning('PRESENCE_MIRROR none needs a single server, using db', 'PresenceRegistry')
+        mirror = 'db'
+    return PresenceRegistry(mirror, settings.get('PRESENCE_FLUSH_MS', 100) / 1000.0, dbService, cacheService, shared)
+
+# the connected clients of this server, kept in memory so that connecting, disconnecting and the offline check
+# of a p2p pub are dict operations
+# the changes are copied to the connections table (db) or to a redis hash (redis) in batches off the event loop,
+# the copy is eventually consistent and is read for the clients connected to the other servers
+class PresenceRegistry():
+    REDIS_CONNECTIONS_MAP = 'jmqt_connections'
+    # removes the clients (ARGV: client id, address, ...) whose entry still has the address this server wrote
+    REDIS_REMOVE_OWNED = '''
+        for i = 1, #ARGV, 2 do
+            local value = redis.call('HGET', KEYS[1], ARGV[i])
+            if value and cjson.decode(value)['address'] == ARGV[i + 1] then
+                redis.call('HDEL', KEYS[1], ARGV[i])
+            end
+        end
+    '''
+
+    def __init__(self, mirror, flushInterval, dbService, cacheService, shared):
+        self.mirror = mirror
+        # seconds
+        self.flushInterval = flushInterval
+        self.dbService = dbService
+        self.cacheService = cacheService
+        self.shared = shared
+        # client id -> {'protocol': .., 'address': ..}
+        self.clients = {}
+        # client id -> row to write, or None to remove it, only the last change of a client is kept
+        self.changes = {}
+        # client id -> address of the row this server has written, a client which has connected to another
+        # server meanwhile keeps the row of that server
+        self.mirrored = {}
+        self.flushTimer = None
+        self.wakeup = None
+        self.task = None
+        # metrics
+        self.flushes = 0
+        self.rows = 0
+        self.errors = 0
+        self.remoteLookups = 0
+        self.maxFlushTime = 0.0
+
+    def __len__(self):
+        return len(self.clients)
+
+    def __contains__(self, client_id):
+        return client_id in self.clients
+
+    def connect(self, client_id, protocol, address):
+        self.clients[client_id] = {'protocol': protocol, 'address': address}
+        self.__changed(client_id, {
+                'client_id': client_id,
+                'protocol': protocol,
+                'address': address,
+                'timestamp': datetime.datetime.utcnow()
+            })
+
+    def disconnect(self, client_id):
+        if self.clients.pop(client_id, None) is not None:
+            self.__changed(client_id, None)
+
+    # returns the protocol and the address of a client connected to this server, None if it is not connected here
+    def get(self, client_id):
+        return self.clients.get(client_id)
+
+    # returns the protocol and the address of a connected client, None if it is offline
+    # the clients which are connected to another worker are known at once from the bus ({'worker': index}),
+    # the clients of the other servers are read from the mirror
+    async def lookup(self, client_id):
+        info = self.clients.get(client_id)
+        if info is None and self.shared:
+            if self.cacheService.bus is not None:
+                # the workers know where every client is connected, the mirror may not have the change yet
+                worker = self.cacheService.presence.get(client_id)
+                return {'worker': worker} if worker is not None else None
+            self.remoteLookups += 1
+            info = await self.__read_mirror(client_id)
+        return info
+
+    async def __read_mirror(self, client_id):
+        if self.mirror == 'redis':
+            try:
+                data = await self.cacheService.redisWriter.call(self.cacheService.redisConn.hget, self.REDIS_CONNECTIONS_MAP, client_id)
+                return serializer.loads(data) if data is not None else None
+            except Exception as ex:
+                logger.log_error(ex, 'PresenceRegistry(lookup)')
+            return None
+        return await self.dbService.check_connection(client_id)
+
+    def __changed(self, client_id, row):
+        if self.mirror == 'none':
+            return
+        if self.task is None:
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.ensure_future(self.__writer())
+        self.changes[client_id] = row
+        if self.flushTimer is None:
+            self.flushTimer = asyncio.get_event_loop().call_later(self.flushInterval, self.__wake)
+
+    def __wake(self):
+        self.flushTimer = None
+        self.wakeup.set()
+
+    def __write_redis(self, connected, disconnected):
+        pipe = self.cacheService.redisConn.pipeline(transaction = False)
+        if len(disconnected) > 0:
+            pipe.eval(self.REDIS_REMOVE_OWNED, 1, self.REDIS_CONNECTIONS_MAP, *[value for pair in disconnected for value in pair])
+        if len(connected) > 0:
+            pipe.hset(self.REDIS_CONNECTIONS_MAP, mapping = dict((row['client_id'], serializer.dumps({'protocol': row['protocol'], 'address': row['address']})) for row in connected))
+        pipe.execute()
+        return True
+
+    async def __writer(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            changes, self.changes = self.changes, {}
+            connected = [row for row in changes.values() if row is not None]
+            disconnected = [(client_id, self.mirrored[client_id]) for client_id, row in changes.items() if row is None and client_id in self.mirrored]
+            start = time.perf_counter()
+            try:
+                if self.mirror == 'redis':
+                    committed = await self.cacheService.redisWriter.call(self.__write_redis, connected, disconnected)
+                else:
+                    committed = await self.dbService.update_connections(connected, disconnected)
+            except Exception as ex:
+                logger.log_error(ex, 'PresenceRegistry(flush)')
+                committed = False
+            self.maxFlushTime = max(self.maxFlushTime, time.perf_counter() - start)
+            self.flushes += 1
+            if committed:
+                self.rows += len(changes)
+                for client_id, address in disconnected:
+                    del self.mirrored[client_id]
+                for row in connected:
+                    self.mirrored[row['client_id']] = row['address']
+            else:
+                self.errors += 1
+                # written again with the next flush, unless the client has changed meanwhile
+                for client_id, row in changes.items():
+                    if client_id not in self.changes:
+                        self.changes[client_id] = row
+                if self.flushTimer is None:
+                    self.flushTimer = asyncio.get_event_loop().call_later(self.flushInterval, self.__wake)
+
+    def get_metrics(self):
+        return {
+            'online': len(self.clients),
+            'mirror': self.mirror,
+            'pending_changes': len(self.changes),
+            'flushes': self.flushes,
+            'rows': self.rows,
+            'max_flush_ms': self.maxFlushTime * 1000,
+            'remote_lookups': self.remoteLookups,
+            'errors': self.errors
+        }
@@ -0,0 +1,163 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+import re
+import json
+import json.decoder
+
+import pyjmqt.server.logger as logger
+
+from pyjmqt.common.json_backends import BINARY_KEY, StdlibBackend, OrjsonBackend, UjsonBackend, BACKENDS, decode_binary, find_backend
+import pyjmqt.common.json_backends as json_backends
+
+# JSON serialization of the packets, the redis messages and the stored packets
+# the backend is chosen once at startup (JSON_BACKEND), every backend writes plain JSON so the wire format does not depend on it
+
+# a JSON value kept as the text it was received in (PAYLOAD_PASSTHROUGH), it is written as it is
+# in the JSON pushes and the stored packets, and decoded only when something else needs it
+class RawJSON:
+    __slots__ = ('text', '__value')
+
+    def __init__(self, text):
+        self.text = text
+
+    def __len__(self):
+        return len(self.text)
+
+    # the decoded value
+    def value(self):
+        try:
+            return self.__value
+        except AttributeError:
+            self.__value = loads(self.text)
+            return self.__value
+
+# default hook of the backends, encodes the binary values and the RawJSON values
+def json_default(obj):
+    if isinstance(obj, RawJSON):
+        return obj.value()
+    return json_backends.json_default(obj)
+
+backend = StdlibBackend
+# keeps the pub payloads as RawJSON (PAYLOAD_PASSTHROUGH)
+passthrough = False
+# smaller frames are decoded as usual, the envelope scan costs more than it saves on them
+passthroughMinSize = 4096
+
+# chooses the backend (auto = the fastest installed), returns its name
+def set_backend(name = 'auto'):
+    global backend
+    backend = find_backend(name)
+    if backend is None:
+        logger.log_warning(('JSON backend {0} is not available, using {1}').format(name, StdlibBackend.name), 'serializer')
+        backend = StdlibBackend
+    return backend.name
+
+# keeps (or not) the pub payloads of the frames of at least minSize bytes as RawJSON
+def set_passthrough(enabled, minSize = 4096):
+    global passthrough, passthroughMinSize
+    passthrough = bool(enabled)
+    passthroughMinSize = minSize
+    return passthrough
+
+# JSON text of an object
+def dumps(obj):
+    return backend.dumps(obj, json_default)
+
+# JSON utf8 bytes of an object
+def dumps_bytes(obj):
+    return backend.dumps_bytes(obj, json_default)
+
+# loads a JSON document (str or bytes), binary = decode the binary values written by dumps
+def loads(data, binary = False):
+    obj = backend.loads(data)
+    if binary and (BINARY_KEY in data if isinstance(data, str) else BINARY_KEY.encode('ascii') in data):
+        obj = decode_binary(obj)
+    return obj
+
+# JSON text of a dict whose value at key is a RawJSON, the raw text is spliced instead of being encoded again
+def dumps_spliced(obj, key):
+    rest = dict(obj)
+    raw = rest.pop(key)
+    text = dumps(rest)
+    return text[:-1] + (', ' if len(rest) > 0 else '') + dumps(key) + ': ' + raw.text + '}'
+
+# JSON text of a stored packet payload
+def dumps_stored(data):
+    if isinstance(data, RawJSON):
+        return '{"d": ' + data.text + '}'
+    return dumps({'d': data})
+
+# loads a stored packet payload, as RawJSON in passthrough mode unless it holds binary values
+# (e.g. from a msgpack publisher), those are decoded to bytes for the binary codecs
+def loads_stored(text):
+    if passthrough and BINARY_KEY not in text:
+        obj = loads_raw(text, ('d',))
+        if isinstance(obj, dict) and isinstance(obj.get('d'), RawJSON):
+            return obj['d']
+    return loads(text, binary = True)['d']
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+SCANNER = json.decoder.JSONDecoder().scan_once
+
+# loads a JSON document (str or utf8 bytes) keeping the value at path (keys of nested objects) as RawJSON,
+# the other values are decoded as usual, the raw value is scanned once to find its end but not kept decoded
+def loads_raw(data, path):
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode('utf8')
+    idx = WHITESPACE.match(data, 0).end()
+    if data[idx:idx + 1] != '{':
+        return loads(data)
+    obj, end = __raw_object(data, idx, path)
+    if WHITESPACE.match(data, end).end() != len(data):
+        raise ValueError('Extra data at {0}'.format(end))
+    return obj
+
+def __raw_object(text, idx, path):
+    obj = {}
+    ws = WHITESPACE.match
+    idx = ws(text, idx + 1).end()
+    if text[idx:idx + 1] == '}':
+        return obj, idx + 1
+    while True:
+        if text[idx:idx + 1] != '"':
+            raise ValueError('Expecting property name at {0}'.format(idx))
+        key, idx = json.decoder.scanstring(text, idx + 1)
+        idx = ws(text, idx).end()
+        if text[idx:idx + 1] != ':':
+            raise ValueError("Expecting ':' at {0}".format(idx))
+        idx = ws(text, idx + 1).end()
+        try:
+            if key == path[0] and len(path) == 1:
+                end = SCANNER(text, idx)[1]
+                obj[key] = RawJSON(text[idx:end])
+            elif key == path[0] and text[idx:idx + 1] == '{':
+                obj[key], end = __raw_object(text, idx, path[1:])
+            else:
+                obj[key], end = SCANNER(text, idx)
+        except StopIteration:
+            raise ValueError('Expecting value at {0}'.format(idx))
+        idx = ws(text, end).end()
+        if text[idx:idx + 1] == '}':
+            return obj, idx + 1
+        if text[idx:idx + 1] != ',':
+            raise ValueError("Expecting ',' delimiter at {0}".format(idx))
+        idx = ws(text, idx + 1).end()
@@ -22,10 +22,13 @@
 import datetime
 import threading
 import asyncio
+import time
 import uuid
-import json
+import collections
 
 import pyjmqt.server.logger as logger
+from pyjmqt.server.core.services.redis_writer import RedisWriter
+import pyjmqt.server.core.serializer as serializer
 
 # from mongoengine import *
 # from pyjmqt.server.core.services.models import *
@@ -40,7 +43,11 @@ class CacheService():
     REDIS_DISCONNECT_CHANNEL = 'JMQTDisc_{client_id}'
     REDIS_SUB_CHANNEL = 'JMQTSub'
     REDIS_UNSUB_CHANNEL = 'JMQTUnsub'
+    REDIS_RETAIN_CHANNEL = 'JMQTRetain'
     REDIS_PUSH_COUNTER = 'JMQTPckCount'
+    # server routing : client id -> server id map and one inbox channel per server
+    REDIS_PRESENCE_MAP = 'JMQTPresence'
+    REDIS_INBOX_CHANNEL = 'JMQTInbox_{server_id}'
 
     REDIS_PUB_CHANNEL_PACKET = 'p'
     REDIS_PUB_CHANNEL_CLIENT = 'c'
@@ -49,11 +56,49 @@ class CacheService():
     REDIS_SUB_CHANNEL_PERSISTENT = 'p'
     REDIS_DISCONNECT_CHANNEL_CLIENT = 'c'
     REDIS_DISCONNECT_CHANNEL_SERVER_ID = 's'
+    REDIS_INBOX_TYPE = 't'
+    REDIS_INBOX_TYPE_PUB = 'p'
+    REDIS_INBOX_TYPE_DISCONNECT = 'd'
+    REDIS_INBOX_TYPE_SHARED_ACK = 'a'
+    REDIS_INBOX_CLIENTS = 'c'
+    REDIS_RETAIN_CHANNEL_CHANNEL = 'ch'
+    REDIS_RETAIN_CHANNEL_DATA = 'd'
+    REDIS_RETAIN_CHANNEL_SENDER = 'f'
+    REDIS_RETAIN_CHANNEL_SERVER_ID = 's'
+    # pub data of a qos 1 packet given to shared subscription members : the members and the server (or worker) which
+    # picked them, their push acks are sent back to it
+    PUB_SHARED_MEMBERS = 'g'
+    PUB_SHARED_ORIGIN = 'o'
+    # local bus (WORKERS > 1 without redis) : the type of a message, and the worker of a connect, release, join,
+    # leave or presence snapshot (the clients connected to a worker, sent to a worker which joined the bus)
+    BUS_TYPE = 't'
+    BUS_TYPE_CONNECT = 'cn'
+    BUS_TYPE_RELEASE = 'rl'
+    BUS_TYPE_JOINED = 'jn'
+    BUS_TYPE_LEFT = 'lf'
+    BUS_TYPE_PRESENCE = 'ps'
+    BUS_TYPE_PUB = 'p'
+    BUS_TYPE_SUB = 's'
+    BUS_TYPE_UNSUB = 'u'
+    BUS_TYPE_RETAIN = 'r'
+    BUS_TYPE_SHARED_ACK = 'a'
+    BUS_WORKER = 'w'
 
-    def __init__(self, settings, eventLoop, serverId, dbService, pubCallback, disconnectCallback):
+    # seconds the redis reader blocks waiting for a message before checking self.run
+    REDIS_READ_TIMEOUT = 1.0
+    # maximum number of buffered redis messages handed to the event loop at once
+    REDIS_READ_BATCH_SIZE = 256
+
+    def __init__(self, settings, eventLoop, serverId, dbService, pubCallback, disconnectCallback, retainCallback = None, bus = None, sharedAckCallback = None):
         self.settings = settings
         self.dbService = dbService
         self.REDIS_ENABLED = settings.ENABLE_REDIS
+        # the workers of a node use redis if it is enabled, else the local bus
+        self.bus = bus if not self.REDIS_ENABLED else None
+        # client id -> index of the worker it is connected to (local bus)
+        self.presence = {}
+        # 1 = route through the presence map and per server inboxes, 0 = two pub/sub channels per client
+        self.REDIS_SERVER_ROUTING = settings.get('REDIS_SERVER_ROUTING', 1)
         if self.REDIS_ENABLED:
             global redisApi
             import redis
@@ -62,10 +107,17 @@ class CacheService():
         self.loop = eventLoop
         self.run = True
         self.serverId = serverId
+        self.inboxChannel = self.REDIS_INBOX_CHANNEL.format(server_id=serverId)
         self.pubCallback = pubCallback
         self.disconnectCallback = disconnectCallback
-        self.pubChannels = []
-        self.disconnectionChannels = []
+        self.retainCallback = retainCallback
+        self.sharedAckCallback = sharedAckCallback
+        # identifies this server (or worker) as the origin of the shared subscription packets
+        self.nodeId = self.bus.index if self.bus is not None else serverId
+        self.pubChannels = set()
+        self.disconnectionChannels = set()
+        self.redisInbox = collections.deque()
+        self.redisInboxTask = None
         self.connect_redis()
     
     def connect_redis(self):
@@ -76,141 +128,429 @@ class CacheService():
                     db=self.settings.REDIS_DB_INDEX, 
                     password=self.settings.REDIS_PASSWORD)
             response = self.redisConn.client_list()            
+            # publishes are pipelined by the writer, off the event loop
+            self.redisWriter = RedisWriter(self.redisConn, self.loop,
+                    self.settings.get('REDIS_WRITE_BATCH_SIZE', 512),
+                    self.settings.get('REDIS_FLUSH_INTERVAL_US', 500) / 1000000.0,
+                    self.settings.get('REDIS_WRITE_QUEUE_SIZE', 10000))
             # creates a redis pubsub object
             self.redisPubSub = self.redisConn.pubsub()
             # subscribes to a test channel (needed to execute get_message)
             self.redisPubSub.subscribe('test')
             self.redisPubSub.subscribe(self.REDIS_SUB_CHANNEL)
             self.redisPubSub.subscribe(self.REDIS_UNSUB_CHANNEL)
+            self.redisPubSub.subscribe(self.REDIS_RETAIN_CHANNEL)
+            if self.REDIS_SERVER_ROUTING:
+                logger.log_info('Redis server routing enabled, inbox ' + self.inboxChannel, 'CacheService')
+                self.redisPubSub.subscribe(self.inboxChannel)
         else:
             logger.log_info('Redis is disabled. Skip connection..', 'CacheService')
-        # runs a thread to read published data from redis and to clear buffered packets
+        # runs a thread to read published data from redis
         if self.REDIS_ENABLED:
-            t1 = threading.Thread(target=self.__run_redis_thread, args=())
+            t1 = threading.Thread(target=self.__redis_sub_thread, args=())
             t1.start()
-        t2 = threading.Thread(target=self.__run_remove_buffer_thread, args=())
-        t2.start()
 
-    def __run_redis_thread(self):        
-        loop = asyncio.new_event_loop()
-        loop.run_until_complete(self.__redis_sub_thread(loop))
+    # connects to the local bus (called when the server is started), a worker stops if the master is gone
+    def start(self):
+        if self.bus is not None:
+            logger.log_info(('Local bus enabled, worker {0}').format(self.bus.index), 'CacheService')
+            self.bus.connect(self.__handle_bus_message, self.loop.stop if self.bus.index > 0 else None)
 
-    def __run_remove_buffer_thread(self):
-        self.dbService.load_subscriptions()
-        loop = asyncio.new_event_loop()
-        loop.run_until_complete(self.__clear_remove_buffer(loop))
+    # handles a message of another worker (local bus)
+    async def __handle_bus_message(self, data):
+        message_type = data[self.BUS_TYPE]
+        if message_type == self.BUS_TYPE_PUB:
+            self.__deliver_local(data[self.REDIS_INBOX_CLIENTS], data[self.REDIS_PUB_CHANNEL_PACKET])
+        elif message_type == self.BUS_TYPE_CONNECT:
+            client_id, worker = data[self.REDIS_DISCONNECT_CHANNEL_CLIENT], data[self.BUS_WORKER]
+            owner = self.presence.get(client_id)
+            self.presence[client_id] = worker
+            if owner == self.bus.index:
+                # the client has connected to another worker
+                asyncio.Task(self.disconnectCallback(client_id))
+        elif message_type == self.BUS_TYPE_RELEASE:
+            client_id = data[self.REDIS_DISCONNECT_CHANNEL_CLIENT]
+            if self.presence.get(client_id) == data[self.BUS_WORKER]:
+                del self.presence[client_id]
+        elif message_type == self.BUS_TYPE_JOINED:
+            # a worker joined the bus (sent by the hub), it is told which clients are connected here
+            clients = [client_id for client_id, worker in self.presence.items() if worker == self.bus.index]
+            await self.bus.send(data[self.BUS_WORKER], {
+                    self.BUS_TYPE: self.BUS_TYPE_PRESENCE,
+                    self.BUS_WORKER: self.bus.index,
+                    self.REDIS_INBOX_CLIENTS: clients
+                })
+        elif message_type == self.BUS_TYPE_PRESENCE:
+            # a connect received before the snapshot is newer, the messages of a worker arrive in order
+            # so a release sent after the snapshot is handled after it
+            worker = data[self.BUS_WORKER]
+            for client_id in data[self.REDIS_INBOX_CLIENTS]:
+                self.presence.setdefault(client_id, worker)
+        elif message_type == self.BUS_TYPE_LEFT:
+            # a worker left the bus (sent by the hub), its clients are not connected anymore
+            worker = data[self.BUS_WORKER]
+            for client_id in [client_id for client_id, owner in self.presence.items() if owner == worker]:
+                del self.presence[client_id]
+        elif message_type == self.BUS_TYPE_SUB:
+            client_id, channel, persistent_flag = data[self.REDIS_SUB_CHANNEL_CLIENT], data[self.REDIS_SUB_CHANNEL_CHANNEL], data[self.REDIS_SUB_CHANNEL_PERSISTENT]
+            await self.dbService.insert_subscription(client_id, channel, persistent_flag, addtodb = False)
+        elif message_type == self.BUS_TYPE_UNSUB:
+            client_id, channel = data[self.REDIS_SUB_CHANNEL_CLIENT], data[self.REDIS_SUB_CHANNEL_CHANNEL]
+            await self.dbService.remove_subscription(client_id, channel, removefromdb = False)
+        elif message_type == self.BUS_TYPE_RETAIN:
+            if self.retainCallback is not None:
+                self.retainCallback(data[self.REDIS_RETAIN_CHANNEL_SENDER], data[self.REDIS_RETAIN_CHANNEL_CHANNEL], data[self.REDIS_RETAIN_CHANNEL_DATA])
+        elif message_type == self.BUS_TYPE_SHARED_ACK:
+            if self.sharedAckCallback is not None:
+                self.sharedAckCallback(data[self.REDIS_PUB_CHANNEL_CLIENT])
 
-    # thread for redis based subscriptions
-    async def __redis_sub_thread(self, loop):
-        asyncio.set_event_loop(self.loop)
+    # thread for redis based subscriptions, blocks on the redis connection and hands the messages over to the event loop
+    def __redis_sub_thread(self):
         logger.log_info('Starting redis subscription reader..', 'CacheService(redis_sub_thread)')
         while self.run:
-            if self.redisPubSub != None:
-                message = self.redisPubSub.get_message()
-                try:
-                    if message:
-                        if message['type'] != 'subscribe' and message['type'] != 'unsubscribe':
-                            channel_name = message['channel'].decode("utf-8")
-                            data = json.loads(message['data'])
-                            if channel_name in self.pubChannels:
-                                packet = data[self.REDIS_PUB_CHANNEL_PACKET]
-                                client_id = data[self.REDIS_PUB_CHANNEL_CLIENT]
-                                await self.pubCallback(packet['c'], packet['d'], packet['f'], packet['q'], packet['id'], client_id)
-                            elif channel_name in self.disconnectionChannels:
-                                client_id = data[self.REDIS_DISCONNECT_CHANNEL_CLIENT]
-                                server_id = data[self.REDIS_DISCONNECT_CHANNEL_SERVER_ID]
-                                if server_id != self.serverId:
-                                    asyncio.Task(self.disconnectCallback(client_id))
-                            elif channel_name == self.REDIS_SUB_CHANNEL:
-                                client_id, channel, persistent_flag = data[self.REDIS_SUB_CHANNEL_CLIENT], data[self.REDIS_SUB_CHANNEL_CHANNEL], data[self.REDIS_SUB_CHANNEL_PERSISTENT]
-                                await self.dbService.insert_subscription(client_id, channel, persistent_flag, addtodb = False)
-                            elif channel_name == self.REDIS_UNSUB_CHANNEL:
-                                client_id, channel = data[self.REDIS_SUB_CHANNEL_CLIENT], data[self.REDIS_SUB_CHANNEL_CHANNEL]
-                                await self.dbService.remove_subscription(client_id, channel, removefromdb = False)
-                except Exception as ex:
-                    logger.log_error(ex, 'CacheService(redis_sub_thread)')
-            else:
-                await asyncio.sleep(1)
+            try:
+                message = self.redisPubSub.get_message(ignore_subscribe_messages = True, timeout = self.REDIS_READ_TIMEOUT)
+                if message is None:
+                    continue
+                batch = [message]
+                # collect the messages which are already buffered, without blocking
+                while len(batch) < self.REDIS_READ_BATCH_SIZE:
+                    message = self.redisPubSub.get_message(ignore_subscribe_messages = True)
+                    if message is None:
+                        break
+                    batch.append(message)
+                self.loop.call_soon_threadsafe(self.__queue_redis_messages, batch)
+            except Exception as ex:
+                logger.log_error(ex, 'CacheService(redis_sub_thread)')
+                time.sleep(self.REDIS_READ_TIMEOUT)
+        logger.log_info('Stopped redis subscription reader', 'CacheService(redis_sub_thread)')
+
+    # called on the event loop by the redis reader thread
+    def __queue_redis_messages(self, batch):
+        self.redisInbox.extend(batch)
+        if self.redisInboxTask is None:
+            self.redisInboxTask = asyncio.ensure_future(self.__process_redis_messages(), loop = self.loop)
+
+    # processes the queued redis messages one by one, in the order they were received
+    async def __process_redis_messages(self):
+        try:
+            while len(self.redisInbox) > 0:
+                await self.__handle_redis_message(self.redisInbox.popleft())
+        finally:
+            self.redisInboxTask = None
+
+    async def __handle_redis_message(self, message):
+        try:
+            if message['type'] != 'message':
+                return
+            channel_name = message['channel'].decode("utf-8")
+            data = serializer.loads(message['data'], binary = True)
+            if channel_name == self.inboxChannel:
+                await self.__handle_inbox_message(data)
+            elif channel_name in self.pubChannels:
+                packet = data[self.REDIS_PUB_CHANNEL_PACKET]
+                client_id = data[self.REDIS_PUB_CHANNEL_CLIENT]
+                await self.pubCallback(packet['c'], packet['d'], packet['f'], packet['q'], packet['id'], client_id)
+            elif channel_name in self.disconnectionChannels:
+                client_id = data[self.REDIS_DISCONNECT_CHANNEL_CLIENT]
+                server_id = data[self.REDIS_DISCONNECT_CHANNEL_SERVER_ID]
+                if server_id != self.serverId:
+                    asyncio.Task(self.disconnectCallback(client_id))
+            elif channel_name == self.REDIS_SUB_CHANNEL:
+                client_id, channel, persistent_flag = data[self.REDIS_SUB_CHANNEL_CLIENT], data[self.REDIS_SUB_CHANNEL_CHANNEL], data[self.REDIS_SUB_CHANNEL_PERSISTENT]
+                await self.dbService.insert_subscription(client_id, channel, persistent_flag, addtodb = False)
+            elif channel_name == self.REDIS_UNSUB_CHANNEL:
+                client_id, channel = data[self.REDIS_SUB_CHANNEL_CLIENT], data[self.REDIS_SUB_CHANNEL_CHANNEL]
+                await self.dbService.remove_subscription(client_id, channel, removefromdb = False)
+            elif channel_name == self.REDIS_RETAIN_CHANNEL:
+                # another server has stored a retained packet, refresh the in-memory copy
+                if data[self.REDIS_RETAIN_CHANNEL_SERVER_ID] != self.serverId and self.retainCallback is not None:
+                    self.retainCallback(data[self.REDIS_RETAIN_CHANNEL_SENDER], data[self.REDIS_RETAIN_CHANNEL_CHANNEL], data[self.REDIS_RETAIN_CHANNEL_DATA])
+        except Exception as ex:
+            logger.log_error(ex, 'CacheService(redis_sub_thread)')
     
-    # thread for clearing remove buffer from dbService
-    async def __clear_remove_buffer(self, loop):
-        asyncio.set_event_loop(self.loop)
-        c = 0
-        while self.run:
-            if c == 8:
-                c = 0
-                await self.dbService.remove_pubmap_by_channel_from_map()
-                await self.dbService.remove_pubmap_from_map()
-            c += 1
-            await asyncio.sleep(2)
+    # handles a message sent to this server's inbox (server routing)
+    async def __handle_inbox_message(self, data):
+        message_type = data[self.REDIS_INBOX_TYPE]
+        if message_type == self.REDIS_INBOX_TYPE_PUB:
+            self.__deliver_local(data[self.REDIS_INBOX_CLIENTS], data[self.REDIS_PUB_CHANNEL_PACKET])
+        elif message_type == self.REDIS_INBOX_TYPE_DISCONNECT:
+            # the client has connected to another server
+            client_id = data[self.REDIS_DISCONNECT_CHANNEL_CLIENT]
+            if data[self.REDIS_DISCONNECT_CHANNEL_SERVER_ID] != self.serverId:
+                asyncio.Task(self.disconnectCallback(client_id))
+        elif message_type == self.REDIS_INBOX_TYPE_SHARED_ACK:
+            if self.sharedAckCallback is not None:
+                self.sharedAckCallback(data[self.REDIS_PUB_CHANNEL_CLIENT])
 
     # gets the packet counter from redis, increases in exsists, creates if not
     async def get_next_packet_pck_id(self):
         return str(uuid.uuid1())
 
     async def process_connection(self, client_id):
-        if self.REDIS_ENABLED:
-            disconnect_data = json.dumps({
+        if self.bus is not None:
+            # the other workers disconnect the client if it was connected to them
+            self.presence[client_id] = self.bus.index
+            await self.bus.broadcast({
+                    self.BUS_TYPE: self.BUS_TYPE_CONNECT,
                     self.REDIS_DISCONNECT_CHANNEL_CLIENT: client_id,
-                    self.REDIS_DISCONNECT_CHANNEL_SERVER_ID: self.serverId
+                    self.BUS_WORKER: self.bus.index
                 })
+        elif self.REDIS_ENABLED:
+            disconnect_data = {
+                    self.REDIS_DISCONNECT_CHANNEL_CLIENT: client_id,
+                    self.REDIS_DISCONNECT_CHANNEL_SERVER_ID: self.serverId
+                }
+            if self.REDIS_SERVER_ROUTING:
+                # take the ownership of the client and find out the previous owner
+                pipe = self.redisConn.pipeline()
+                pipe.hget(self.REDIS_PRESENCE_MAP, client_id)
+                pipe.hset(self.REDIS_PRESENCE_MAP, client_id, self.serverId)
+                old_server_id = (await self.redisWriter.call(pipe.execute))[0]
+                if old_server_id is not None:
+                    old_server_id = old_server_id.decode('utf-8')
+                    if old_server_id != self.serverId:
+                        # ask the previous owner to disconnect the client
+                        disconnect_data[self.REDIS_INBOX_TYPE] = self.REDIS_INBOX_TYPE_DISCONNECT
+                        await self.redisWriter.publish(self.REDIS_INBOX_CHANNEL.format(server_id=old_server_id), serializer.dumps(disconnect_data))
+                return
             # build the disconnect and pub channel names
             disconnect_channel = self.REDIS_DISCONNECT_CHANNEL.format(client_id=client_id)
             pub_channel = self.REDIS_PUB_CHANNEL.format(client_id=client_id)
             # broadcast to all other server instances to disconnect the client
-            self.redisConn.publish(disconnect_channel, disconnect_data)
+            await self.redisWriter.publish(disconnect_channel, serializer.dumps(disconnect_data))
             # subscribe to the pub and disconnect channel for the client to receive data from __redis_sub_thread
             self.redisPubSub.subscribe(disconnect_channel)
             self.redisPubSub.subscribe(pub_channel)
-            self.pubChannels.append(pub_channel)
-            self.disconnectionChannels.append(disconnect_channel)
+            self.pubChannels.add(pub_channel)
+            self.disconnectionChannels.add(disconnect_channel)
 
     async def process_disconnection(self, client_id):
-        if self.REDIS_ENABLED:
+        if self.bus is not None:
+            # unless the client has already connected to another worker
+            if self.presence.get(client_id) == self.bus.index:
+                del self.presence[client_id]
+                await self.bus.broadcast({
+                        self.BUS_TYPE: self.BUS_TYPE_RELEASE,
+                        self.REDIS_DISCONNECT_CHANNEL_CLIENT: client_id,
+                        self.BUS_WORKER: self.bus.index
+                    })
+        elif self.REDIS_ENABLED:
+            if self.REDIS_SERVER_ROUTING:
+                # release the ownership, unless the client has already connected to another server
+                def release(pipe):
+                    owner = pipe.hget(self.REDIS_PRESENCE_MAP, client_id)
+                    pipe.multi()
+                    if owner is not None and owner.decode('utf-8') == self.serverId:
+                        pipe.hdel(self.REDIS_PRESENCE_MAP, client_id)
+                await self.redisWriter.call(self.redisConn.transaction, release, self.REDIS_PRESENCE_MAP)
+                return
             # build the disconnect and pub channel names
             disconnect_channel = self.REDIS_DISCONNECT_CHANNEL.format(client_id=client_id)
             pub_channel = self.REDIS_PUB_CHANNEL.format(client_id=client_id)
             # unsubscribe from the pub and disconnect channel for the client to receive data from __redis_sub_thread
             self.redisPubSub.unsubscribe(disconnect_channel)
             self.redisPubSub.unsubscribe(pub_channel)
-            if pub_channel in self.pubChannels:
-                self.pubChannels.remove(pub_channel)
-            if disconnect_channel in self.disconnectionChannels:
-                self.disconnectionChannels.remove(disconnect_channel)
-    
-    async def handle_pub(self, client_id, pub_data):
-        if self.REDIS_ENABLED:
-            # build the pub data
-            pub_data = json.dumps({
-                self.REDIS_PUB_CHANNEL_PACKET : pub_data,
+            self.pubChannels.discard(pub_channel)
+            self.disconnectionChannels.discard(disconnect_channel)
+
+    # delivers a pub data to the clients connected to this server
+    def __deliver_local(self, client_ids, pub_data):
+        members = pub_data.get(self.PUB_SHARED_MEMBERS)
+        for client_id in client_ids:
+            if members is not None and client_id in members:
+                # picked for a shared subscription, the push ack is reported to the origin
+                asyncio.Task(self.pubCallback(pub_data['c'], pub_data['d'], pub_data['f'], pub_data['q'], pub_data['id'], client_id, origin = pub_data[self.PUB_SHARED_ORIGIN]))
+            else:
+                asyncio.Task(self.pubCallback(pub_data['c'], pub_data['d'], pub_data['f'], pub_data['q'], pub_data['id'], client_id))
+
+    # returns the set of the clients connected to the other servers (or workers), the clients of this one are
+    # checked by the caller
+    async def online(self, client_ids):
+        if self.bus is not None:
+            return set(client_id for client_id in client_ids if client_id in self.presence)
+        elif self.REDIS_ENABLED:
+            if self.REDIS_SERVER_ROUTING:
+                owners = await self.redisWriter.call(self.redisConn.hmget, self.REDIS_PRESENCE_MAP, client_ids)
+                return set(client_id for client_id, server_id in zip(client_ids, owners) if server_id is not None)
+            # not known without the presence map, all of them are assumed to be connected
+            return set(client_ids)
+        return set()
+
+    # reports the push ack of a shared subscription packet to the server (or worker) which picked the member
+    async def send_shared_ack(self, origin, client_id):
+        if origin == self.nodeId:
+            if self.sharedAckCallback is not None:
+                self.sharedAckCallback(client_id)
+        elif self.bus is not None:
+            await self.bus.send(origin, {
+                self.BUS_TYPE: self.BUS_TYPE_SHARED_ACK,
                 self.REDIS_PUB_CHANNEL_CLIENT: client_id
                 })
-            # build the pub channel name
-            pub_channel = self.REDIS_PUB_CHANNEL.format(client_id=client_id)
-            # broadcast the data (to be read by __redis_sub_thread)
-            self.redisConn.publish(pub_channel, pub_data)
+        elif self.REDIS_ENABLED and self.REDIS_SERVER_ROUTING:
+            await self.redisWriter.publish(self.REDIS_INBOX_CHANNEL.format(server_id=origin), serializer.dumps({
+                self.REDIS_INBOX_TYPE: self.REDIS_INBOX_TYPE_SHARED_ACK,
+                self.REDIS_PUB_CHANNEL_CLIENT: client_id
+                }))
+
+    # groups the clients by the server they are connected to, offline clients are left out
+    async def __group_by_server(self, client_ids):
+        servers = {}
+        owners = await self.redisWriter.call(self.redisConn.hmget, self.REDIS_PRESENCE_MAP, client_ids)
+        for client_id, server_id in zip(client_ids, owners):
+            if server_id is not None:
+                server_id = server_id.decode('utf-8')
+                if server_id not in servers:
+                    servers[server_id] = []
+                servers[server_id].append(client_id)
+        return servers
+
+    # sends a pub data to a list of clients
+    async def handle_pub(self, client_ids, pub_data):
+        if self.bus is not None:
+            # one message per worker, carrying all the receivers connected to that worker, offline clients are left out
+            workers = {}
+            for client_id in client_ids:
+                worker = self.presence.get(client_id)
+                if worker is not None:
+                    if worker not in workers:
+                        workers[worker] = []
+                    workers[worker].append(client_id)
+            for worker, receivers in workers.items():
+                if worker == self.bus.index:
+                    self.__deliver_local(receivers, pub_data)
+                else:
+                    await self.bus.send(worker, {
+                        self.BUS_TYPE: self.BUS_TYPE_PUB,
+                        self.REDIS_PUB_CHANNEL_PACKET: pub_data,
+                        self.REDIS_INBOX_CLIENTS: receivers
+                        })
+        elif self.REDIS_ENABLED:
+            if self.REDIS_SERVER_ROUTING:
+                # one message per server, carrying all the receivers connected to that server
+                for server_id, receivers in (await self.__group_by_server(client_ids)).items():
+                    if server_id == self.serverId:
+                        self.__deliver_local(receivers, pub_data)
+                    else:
+                        inbox_data = serializer.dumps({
+                            self.REDIS_INBOX_TYPE: self.REDIS_INBOX_TYPE_PUB,
+                            self.REDIS_PUB_CHANNEL_PACKET: pub_data,
+                            self.REDIS_INBOX_CLIENTS: receivers
+                            })
+                        await self.redisWriter.publish(self.REDIS_INBOX_CHANNEL.format(server_id=server_id), inbox_data)
+                return
+            for client_id in client_ids:
+                # build the pub data
+                redis_data = serializer.dumps({
+                    self.REDIS_PUB_CHANNEL_PACKET : pub_data,
+                    self.REDIS_PUB_CHANNEL_CLIENT: client_id
+                    })
+                # build the pub channel name
+                pub_channel = self.REDIS_PUB_CHANNEL.format(client_id=client_id)
+                # broadcast the data (to be read by __redis_sub_thread)
+                await self.redisWriter.publish(pub_channel, redis_data)
         else:
-            asyncio.Task(self.pubCallback(pub_data['c'], pub_data['d'], pub_data['f'], pub_data['q'], pub_data['id'], client_id))
+            self.__deliver_local(client_ids, pub_data)
+
+    # sends a p2p pub data to the server or worker the client is connected to (the client is not connected to this one)
+    # returns True if it was sent, False if the client is offline, None if the owner is not known (redis without server routing)
+    async def handle_p2p(self, client_id, pub_data):
+        if self.bus is not None:
+            worker = self.presence.get(client_id)
+            if worker is None:
+                return False
+            if worker == self.bus.index:
+                self.__deliver_local([client_id], pub_data)
+            else:
+                await self.bus.send(worker, {
+                    self.BUS_TYPE: self.BUS_TYPE_PUB,
+                    self.REDIS_PUB_CHANNEL_PACKET: pub_data,
+                    self.REDIS_INBOX_CLIENTS: [client_id]
+                    })
+            return True
+        elif self.REDIS_ENABLED:
+            if self.REDIS_SERVER_ROUTING:
+                server_id = await self.redisWriter.call(self.redisConn.hget, self.REDIS_PRESENCE_MAP, client_id)
+                if server_id is None:
+                    return False
+                server_id = server_id.decode('utf-8')
+                if server_id == self.serverId:
+                    self.__deliver_local([client_id], pub_data)
+                else:
+                    inbox_data = serializer.dumps({
+                        self.REDIS_INBOX_TYPE: self.REDIS_INBOX_TYPE_PUB,
+                        self.REDIS_PUB_CHANNEL_PACKET: pub_data,
+                        self.REDIS_INBOX_CLIENTS: [client_id]
+                        })
+                    await self.redisWriter.publish(self.REDIS_INBOX_CHANNEL.format(server_id=server_id), inbox_data)
+                return True
+            redis_data = serializer.dumps({
+                self.REDIS_PUB_CHANNEL_PACKET : pub_data,
+                self.REDIS_PUB_CHANNEL_CLIENT: client_id
+                })
+            await self.redisWriter.publish(self.REDIS_PUB_CHANNEL.format(client_id=client_id), redis_data)
+            return None
+        return False
 
     async def handle_sub(self, client_id, channel, persistent_flag):
         if self.REDIS_ENABLED:
             # build the sub data
-            sub_data = json.dumps({
+            sub_data = serializer.dumps({
                 self.REDIS_SUB_CHANNEL_CHANNEL : channel,
                 self.REDIS_SUB_CHANNEL_CLIENT: client_id,
                 self.REDIS_SUB_CHANNEL_PERSISTENT: persistent_flag
                 })
             # broadcast the data (to be read by __redis_sub_thread)
-            self.redisConn.publish(self.REDIS_SUB_CHANNEL, sub_data)
+            await self.redisWriter.publish(self.REDIS_SUB_CHANNEL, sub_data)
+        elif self.bus is not None:
+            await self.bus.broadcast({
+                self.BUS_TYPE: self.BUS_TYPE_SUB,
+                self.REDIS_SUB_CHANNEL_CHANNEL : channel,
+                self.REDIS_SUB_CHANNEL_CLIENT: client_id,
+                self.REDIS_SUB_CHANNEL_PERSISTENT: persistent_flag
+                })
         await self.dbService.insert_subscription(client_id, channel, persistent_flag, addtodb = True)
     
     async def handle_unsub(self, client_id, channel):
         if self.REDIS_ENABLED:
             # build the sub data
-            unsub_data = json.dumps({
+            unsub_data = serializer.dumps({
                 self.REDIS_SUB_CHANNEL_CHANNEL : channel,
                 self.REDIS_SUB_CHANNEL_CLIENT: client_id
                 })
             # broadcast the data (to be read by __redis_sub_thread)
-            self.redisConn.publish(self.REDIS_UNSUB_CHANNEL, unsub_data)
-        await self.dbService.remove_subscription(client_id, channel, removefromdb = True)
\ No newline at end of file
+            await self.redisWriter.publish(self.REDIS_UNSUB_CHANNEL, unsub_data)
+        elif self.bus is not None:
+            await self.bus.broadcast({
+                self.BUS_TYPE: self.BUS_TYPE_UNSUB,
+                self.REDIS_SUB_CHANNEL_CHANNEL : channel,
+                self.REDIS_SUB_CHANNEL_CLIENT: client_id
+                })
+        await self.dbService.remove_subscription(client_id, channel, removefromdb = True)
+
+    # tells the other servers about a new retained packet, it is persisted by this server
+    async def handle_retain(self, sender_client_id, channel, data):
+        if self.REDIS_ENABLED:
+            retain_data = serializer.dumps({
+                self.REDIS_RETAIN_CHANNEL_CHANNEL: channel,
+                self.REDIS_RETAIN_CHANNEL_DATA: data,
+                self.REDIS_RETAIN_CHANNEL_SENDER: sender_client_id,
+                self.REDIS_RETAIN_CHANNEL_SERVER_ID: self.serverId
+                })
+            await self.redisWriter.publish(self.REDIS_RETAIN_CHANNEL, retain_data)
+        elif self.bus is not None:
+            await self.bus.broadcast({
+                self.BUS_TYPE: self.BUS_TYPE_RETAIN,
+                self.REDIS_RETAIN_CHANNEL_CHANNEL: channel,
+                self.REDIS_RETAIN_CHANNEL_DATA: data,
+                self.REDIS_RETAIN_CHANNEL_SENDER: sender_client_id
+                })
+
+    # returns the cache layer metrics
+    def get_metrics(self):
+        metrics = {}
+        if self.REDIS_ENABLED:
+            metrics['redis_writer'] = self.redisWriter.get_metrics()
+        if self.bus is not None:
+            metrics['bus'] = self.bus.get_metrics()
+        return metrics
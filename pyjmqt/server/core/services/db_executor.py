@@ -0,0 +1,53 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+import asyncio
+import concurrent.futures
+import functools
+
+# runs the blocking database calls in dedicated threads, each thread keeps its own connection
+class DbExecutor():
+    def __init__(self, db, threads):
+        self.db = db
+        self.threads = threads
+        self.executor = None
+        if threads > 0:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers = threads)
+
+    def __call(self, func, args, kwargs):
+        # peewee keeps the connection state per thread
+        if self.db.is_closed():
+            self.db.connect()
+        return func(*args, **kwargs)
+
+    async def run(self, func, *args, **kwargs):
+        # 0 threads : run on the calling event loop
+        if self.executor is None:
+            return func(*args, **kwargs)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, self.__call, func, args, kwargs)
+
+# turns a blocking PeeweeBase method into a coroutine which runs in the db executor
+def db_call(func):
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        return await self.dbExecutor.run(func, self, *args, **kwargs)
+    return wrapper
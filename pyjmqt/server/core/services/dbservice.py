@@ -27,33 +27,74 @@ import json
 import os
 
 import pyjmqt.server.logger as logger
-from pyjmqt.server.core.services.peewee_base import DB_PROXY, PeeweeBase, Connections, Subscriptions, RetainedPackets, Packets, Pubmaps
+from pyjmqt.server.core.services.peewee_base import DB_PROXY, PeeweeBase, MODELS, Subscriptions
+from pyjmqt.server.core.services import migrations
+from pyjmqt.server.core.services.db_executor import DbExecutor
+from pyjmqt.server.core.services.write_journal import WriteJournal
+from pyjmqt.server.core.services.pubmap_collector import PubmapCollector
 
 from peewee import *
 
+def create_journal(settings, dbExecutor):
+    return WriteJournal(dbExecutor, settings.get('JOURNAL_FLUSH_INTERVAL_MS', 5) / 1000.0, settings.get('JOURNAL_FLUSH_ROWS', 1000))
+
+def create_collector(settings, dbExecutor):
+    return PubmapCollector(dbExecutor, settings.get('GC_INTERVAL_MS', 2000) / 1000.0, settings.get('GC_BATCH_SIZE', 5000))
+
+# creates or migrates the tables, removes the temporary subscriptions of the previous run and closes the
+# connection, called by the master process before the workers are forked so that they do not migrate the same
+# database at once, nor remove the temporary subscriptions made on the workers already serving
+def prepare_database(settings):
+    db = MySQLService.create_database(settings) if settings.ENABLE_MYSQL else SQLiteService.create_database(settings)
+    DB_PROXY.initialize(db)
+    db.connect()
+    migrations.migrate(db, MODELS)
+    db.create_tables(MODELS, safe = True)
+    Subscriptions.delete().where(Subscriptions.is_tmp == True).execute()
+    db.close()
+
 class SQLiteService(PeeweeBase):
     def __init__(self, settings):
         self.settings = settings
         self.connect_sqlite()
+
+    @staticmethod
+    def create_database(settings):
+        db_path = settings.SQLITE_DB_PATH
+        if db_path is None:
+            root_path = os.path.dirname(os.path.realpath(__file__))
+            db_path = os.path.join(root_path, 'jmqt.db')
+        logger.log_info('Connecting SQLite Db ' + db_path, 'SQLiteService')
+        return SqliteDatabase(db_path)
     
     def connect_sqlite(self):
-        root_path = os.path.dirname(os.path.realpath(__file__))
-        db_path = os.path.join(root_path, 'jmqt.db')
-        logger.log_info('Connecting SQLite Db ' + db_path, 'SQLiteService')
-        db = SqliteDatabase(db_path)
+        db = self.create_database(self.settings)
         DB_PROXY.initialize(db)
         db.connect()
-        db.create_tables([Connections, Subscriptions, RetainedPackets, Packets, Pubmaps], safe = True)
+        migrations.migrate(db, MODELS)
+        db.create_tables(MODELS, safe = True)
+        # sqlite allows one writer at a time, so more than one db thread only adds lock contention
+        self.dbExecutor = DbExecutor(db, min(1, self.settings.get('DB_THREADS', 1)))
+        self.journal = create_journal(self.settings, self.dbExecutor)
+        self.collector = create_collector(self.settings, self.dbExecutor)
 
 class MySQLService(PeeweeBase):
     def __init__(self, settings):
         self.settings = settings
         self.connect_mysql()
     
+    @staticmethod
+    def create_database(settings):
+        logger.log_info(('Connecting MySQL/MariaDb {0} on {1}:{2}').format(settings.MYSQL_DB, settings.MYSQL_HOST, settings.MYSQL_PORT), 'MySQLService')
+        return MySQLDatabase(settings.MYSQL_DB, user=settings.MYSQL_USER, password=settings.MYSQL_PSWD,
+                         host=settings.MYSQL_HOST, port=settings.MYSQL_PORT)
+
     def connect_mysql(self):
-        logger.log_info(('Connecting MySQL/MariaDb {0} on {1}:{2}').format(self.settings.MYSQL_DB, self.settings.MYSQL_HOST, self.settings.MYSQL_PORT), 'MySQLService')
-        db = MySQLDatabase(self.settings.MYSQL_DB, user=self.settings.MYSQL_USER, password=self.settings.MYSQL_PSWD,
-                         host=self.settings.MYSQL_HOST, port=self.settings.MYSQL_PORT)
+        db = self.create_database(self.settings)
         DB_PROXY.initialize(db)
         db.connect()
-        db.create_tables([Connections, Subscriptions, RetainedPackets, Packets, Pubmaps])
\ No newline at end of file
+        migrations.migrate(db, MODELS)
+        db.create_tables(MODELS)
+        self.dbExecutor = DbExecutor(db, self.settings.get('DB_THREADS', 4))
+        self.journal = create_journal(self.settings, self.dbExecutor)
+        self.collector = create_collector(self.settings, self.dbExecutor)
\ No newline at end of file
@@ -0,0 +1,109 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import struct
+import asyncio
+
+import pyjmqt.server.logger as logger
+import pyjmqt.server.core.serializer as serializer
+from pyjmqt.server.core.framing import LengthPrefixedBuffer
+
+# connection of a worker process to the bus hub of the master (WORKERS > 1), replaces redis between
+# the workers of one node, the messages are JSON documents in length-prefixed frames
+# each frame starts with the index of its target worker (2 bytes), BROADCAST sends it to all the other workers
+# the messages of a worker reach the others in the order they were sent
+class LocalBus():
+    BROADCAST = 0xFFFF
+    TARGET = struct.Struct('>H')
+
+    def __init__(self, path, index, eventLoop):
+        self.path = path
+        self.index = index
+        self.loop = eventLoop
+        self.writer = None
+        self.task = None
+        self.handler = None
+        self.closeCallback = None
+        # metrics
+        self.sent = 0
+        self.received = 0
+
+    # connects to the hub and starts reading, handler(message) is awaited for each message received
+    # closeCallback() is called when the hub closes the connection
+    def connect(self, handler, closeCallback = None):
+        self.handler = handler
+        self.closeCallback = closeCallback
+        reader, self.writer = self.loop.run_until_complete(asyncio.open_unix_connection(self.path))
+        self.writer.write(LengthPrefixedBuffer.frame(self.TARGET.pack(self.index)))
+        self.task = asyncio.ensure_future(self.__reader(reader), loop = self.loop)
+
+    # returns the frame of a message to a worker
+    @classmethod
+    def frame(cls, target, message):
+        return LengthPrefixedBuffer.frame(cls.TARGET.pack(target) + serializer.dumps_bytes(message))
+
+    # sends a message to a worker
+    async def send(self, target, message):
+        self.writer.write(self.frame(target, message))
+        self.sent += 1
+        await self.writer.drain()
+
+    # sends a message to all the other workers
+    async def broadcast(self, message):
+        await self.send(self.BROADCAST, message)
+
+    # closes the connection, closeCallback is not called
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def __reader(self, reader):
+        buffer = LengthPrefixedBuffer(None)
+        try:
+            while True:
+                data = await reader.read(65536)
+                if data == b'':
+                    break
+                for frame in buffer.feed(data):
+                    self.received += 1
+                    try:
+                        await self.handler(serializer.loads(frame[self.TARGET.size:], binary = True))
+                    except Exception as ex:
+                        logger.log_error(ex, 'LocalBus')
+        except asyncio.CancelledError:
+            return
+        except Exception as ex:
+            logger.log_error(ex, 'LocalBus')
+        logger.log_error(('Worker {0} lost the bus').format(self.index), 'LocalBus')
+        if self.closeCallback is not None:
+            self.closeCallback()
+
+    def get_metrics(self):
+        return {
+            'worker': self.index,
+            'sent': self.sent,
+            'received': self.received
+        }
@@ -0,0 +1,84 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+import pyjmqt.server.logger as logger
+
+from peewee import CharField, MySQLDatabase
+from playhouse.migrate import SchemaMigrator, make_index_name, migrate as run_operations
+
+# brings the tables of an existing database up to the current models
+# the key columns of old mysql tables are converted from TEXT to VARCHAR, duplicate rows are removed
+# (the newest one is kept) and the missing indexes (Meta.indexes) are created with the names create_tables uses
+# a column which can not be converted, or an index which can not be created, is logged and left as it is,
+# the server still starts
+# new tables are left to create_tables, so this must run before it
+def migrate(db, models):
+    migrator = SchemaMigrator.from_database(db)
+    for model in models:
+        table = model._meta.table_name
+        if not db.table_exists(table):
+            continue
+        unconverted = _migrate_columns(db, model) if isinstance(db, MySQLDatabase) else set()
+        existing = set(index.name for index in db.get_indexes(table))
+        for fields, unique in model._meta.indexes:
+            columns = [model._meta.fields[name].column_name for name in fields]
+            name = make_index_name(table, columns)
+            if name in existing:
+                continue
+            if any(column in unconverted for column in columns):
+                logger.log_warning(('Index {0} on {1} not created, a column is still TEXT').format(name, table), 'Migrations')
+                continue
+            logger.log_info(('Creating index {0} on {1}').format(name, table), 'Migrations')
+            try:
+                with db.atomic():
+                    if unique:
+                        _remove_duplicates(db, table, columns)
+                    run_operations(migrator.add_index(table, columns, unique))
+            except Exception as ex:
+                logger.log_error(ex, 'Migrations(index {0})'.format(name))
+
+# converts the TEXT key columns to VARCHAR, returns the columns left as TEXT because a value is longer than
+# the VARCHAR (strict mysql would refuse the conversion)
+def _migrate_columns(db, model):
+    table = model._meta.table_name
+    types = dict((column.name, column.data_type.lower()) for column in db.get_columns(table))
+    unconverted = set()
+    for field in model._meta.sorted_fields:
+        if isinstance(field, CharField) and 'text' in types.get(field.column_name, ''):
+            longest = db.execute_sql(('SELECT MAX(CHAR_LENGTH(`{1}`)) FROM `{0}`').format(table, field.column_name)).fetchone()[0]
+            if longest is not None and longest > field.max_length:
+                logger.log_warning(('{0}.{1} not converted to VARCHAR({2}), it has values of {3} characters').format(table, field.column_name, field.max_length, longest), 'Migrations')
+                unconverted.add(field.column_name)
+                continue
+            logger.log_info(('Converting {0}.{1} to VARCHAR({2})').format(table, field.column_name, field.max_length), 'Migrations')
+            try:
+                db.execute_sql(('ALTER TABLE `{0}` MODIFY `{1}` VARCHAR({2}) NOT NULL').format(table, field.column_name, field.max_length))
+            except Exception as ex:
+                logger.log_error(ex, 'Migrations({0}.{1})'.format(table, field.column_name))
+                unconverted.add(field.column_name)
+    return unconverted
+
+# keeps the newest row of every key, the derived table lets mysql delete from the table it selects from
+def _remove_duplicates(db, table, columns):
+    cursor = db.execute_sql(('DELETE FROM `{0}` WHERE `id` NOT IN (SELECT `id` FROM (SELECT MAX(`id`) AS `id` FROM `{0}` GROUP BY {1}) AS `keep`)')
+                            .format(table, ', '.join('`' + c + '`' for c in columns)))
+    if cursor.rowcount > 0:
+        logger.log_info(('Removed {0} duplicate rows from {1}').format(cursor.rowcount, table), 'Migrations')
@@ -23,11 +23,14 @@ import datetime
 import threading
 import asyncio
 import uuid
-import json
 import os
-from collections import namedtuple
+import operator
+import functools
 
 import pyjmqt.server.logger as logger
+from pyjmqt.server.core.services.subscriptions import SubscriptionIndex
+from pyjmqt.server.core.services.db_executor import db_call
+import pyjmqt.server.core.serializer as serializer
 
 from peewee import *
 
@@ -37,55 +40,92 @@ class BaseModel(Model):
     class Meta:
         database = DB_PROXY
 
+# longest indexable client id / channel / packet id, 191 utf8mb4 characters fit the innodb key prefix limit of mysql
+KEY_LENGTH = 191
+
 class Connections(BaseModel):
-    client_id = TextField()
+    client_id = CharField(max_length = KEY_LENGTH)
     protocol = TextField()
     address = TextField()
     timestamp = DateTimeField()
+    class Meta:
+        indexes = (
+            (('client_id',), True),
+        )
 
 class Subscriptions(BaseModel):
-    client_id = TextField()
-    channel = TextField()
+    client_id = CharField(max_length = KEY_LENGTH)
+    channel = CharField(max_length = KEY_LENGTH)
     is_tmp = BooleanField(default=False)
+    class Meta:
+        indexes = (
+            (('client_id', 'channel'), True),
+        )
 
 class RetainedPackets(BaseModel):
     sender_id = TextField()
-    channel = TextField()
+    channel = CharField(max_length = KEY_LENGTH)
     data = TextField()
     timestamp = DateTimeField()
+    class Meta:
+        indexes = (
+            (('channel',), True),
+        )
 
 class Packets(BaseModel):
-    packet_id = TextField()
+    packet_id = CharField(max_length = KEY_LENGTH)
     sender_id = TextField()
     channel = TextField()
     data = TextField()
     timestamp = DateTimeField()
+    class Meta:
+        indexes = (
+            (('packet_id',), True),
+        )
 
 class Pubmaps(BaseModel):
-    packet_id = TextField()
-    client_id = TextField()
-    channel = TextField()
+    packet_id = CharField(max_length = KEY_LENGTH)
+    client_id = CharField(max_length = KEY_LENGTH)
+    channel = CharField(max_length = KEY_LENGTH)
+    class Meta:
+        indexes = (
+            # also serves the lookups by packet id
+            (('packet_id', 'client_id'), True),
+            (('client_id', 'channel'), False),
+        )
 
-subscription_entry = namedtuple('subscription_entry',['client_id','channel','is_tmp'])
+MODELS = [Connections, Subscriptions, RetainedPackets, Packets, Pubmaps]
 
 class PeeweeBase():
 
-    listRemovedPubmaps = []
-    listRemoveChannelsWithClient = []
-    subscriptions = []
+    # packet ids per select of get_packets, keeps the bound variables below the old sqlite limit of 999
+    PACKETS_PER_QUERY = 500
+    # rows per insert of insert_retained_packets, 4 columns per row
+    RETAINED_PER_STATEMENT = 200
+    # rows per insert or delete of update_connections, 4 columns per inserted row, 2 per deleted row
+    CONNECTIONS_PER_STATEMENT = 200
+    subscriptions = SubscriptionIndex()
+    # set by the database services, runs the queries off the event loop
+    dbExecutor = None
+    # set by the database services, batches the qos 1 packet and pubmap inserts
+    journal = None
+    # set by the database services, removes the acknowledged pubmaps and the unsubscribed channels
+    collector = None
 
     # return nothing
-    async def check_connection(self, client_id):
+    @db_call
+    def check_connection(self, client_id):
         try:
-            connections = Connections.select().where(Connections.client_id == client_id)
-            if connections.count() > 0:
-                return {'address': connections[0].address, 'protocol': connections[0].protocol}
+            c = Connections.get_or_none(Connections.client_id == client_id)
+            if c is not None:
+                return {'address': c.address, 'protocol': c.protocol}
         except Exception as ex:
             logger.log_error(ex, 'PeeweeBase(check_connection)')
         return None
     
     # return list of dict
-    async def get_all_connections(self):
+    @db_call
+    def get_all_connections(self):
         try:
             connections = Connections.select()
             if connections.count() > 0:
@@ -101,21 +141,43 @@ class PeeweeBase():
             logger.log_error(ex, 'PeeweeBase(get_all_connections)')
         return []
 
+    def __remove_connection(self, client_id):
+        Connections.delete().where(Connections.client_id == client_id).execute()
+
     # return nothing
-    async def remove_connection(self, client_id):
+    @db_call
+    def remove_connection(self, client_id):
         try:
-            Connections.delete().where(Connections.client_id == client_id).execute()
+            self.__remove_connection(client_id)
         except Exception as ex:
             logger.log_error(ex, 'PeeweeBase(remove_connection)')
 
+    # writes a batch of changes of the presence registry, connected is a list of rows, disconnected a list of
+    # (client id, address), a row is removed only if it still has the address this server wrote (the client
+    # may have connected to another server meanwhile)
+    # returns True if committed
+    @db_call
+    def update_connections(self, connected, disconnected):
+        try:
+            with DB_PROXY.atomic():
+                for i in range(0, len(disconnected), self.CONNECTIONS_PER_STATEMENT):
+                    rows = [(Connections.client_id == client_id) & (Connections.address == address) for client_id, address in disconnected[i:i + self.CONNECTIONS_PER_STATEMENT]]
+                    Connections.delete().where(functools.reduce(operator.or_, rows)).execute()
+                for i in range(0, len(connected), self.CONNECTIONS_PER_STATEMENT):
+                    Connections.insert_many(connected[i:i + self.CONNECTIONS_PER_STATEMENT]).on_conflict_replace().execute()
+            return True
+        except Exception as ex:
+            logger.log_error(ex, 'PeeweeBase(update_connections)')
+        return False
+
     # return nothing
-    async def insert_or_update_connection(self, client_id, protocol, address):
+    @db_call
+    def insert_or_update_connection(self, client_id, protocol, address):
         try:
-            await self.remove_connection(client_id)
-            Connections.create(client_id = client_id,
+            Connections.insert(client_id = client_id,
                                 protocol = protocol,
                                 address = address,
-                                timestamp = datetime.datetime.utcnow())
+                                timestamp = datetime.datetime.utcnow()).on_conflict_replace().execute()
         except Exception as ex:
             logger.log_error(ex, 'PeeweeBase(insert_or_update_connection)')
     
@@ -123,18 +185,14 @@ class PeeweeBase():
         try:
             subscriptions = Subscriptions.select()
             for s in subscriptions:
-                self.subscriptions.append(subscription_entry(s.client_id, s.channel, s.is_tmp))
+                self.subscriptions.add(s.client_id, s.channel, s.is_tmp)
         except Exception as ex:
             logger.log_error(ex, 'PeeweeBase(load_subscriptions)')
 
     # return string list
     async def get_subscription_by_channel(self, channel):
         try:
-            clients = []
-            for s in self.subscriptions:
-                if s.channel == channel:
-                    clients.append(s.client_id)
-            return clients
+            return list(self.subscriptions.clients(channel))
         except Exception as ex:
             logger.log_error(ex, 'PeeweeBase(get_subscription_by_channel)')
         return []
@@ -143,9 +201,8 @@ class PeeweeBase():
     async def get_subscription_by_client(self, client_id):
         try:
             channels = {}
-            for s in self.subscriptions:
-                if s.client_id == client_id:
-                    channels[s.channel] = 'temp' if s.is_tmp else 'persistent'
+            for channel, is_tmp in self.subscriptions.channels(client_id).items():
+                channels[channel] = 'temp' if is_tmp else 'persistent'
             return channels
         except Exception as ex:
             logger.log_error(ex, 'PeeweeBase(get_subscription_by_client)')
@@ -155,10 +212,10 @@ class PeeweeBase():
     def get_all_subscriptions(self):
         try:
             channels = {}
-            for s in self.subscriptions:
-                if not s.client_id in channels:
-                    channels[s.client_id] = {}
-                channels[s.client_id][s.channel] = 'temp' if s.is_tmp else 'persistent'
+            for client_id, client_channels in self.subscriptions.by_client.items():
+                channels[client_id] = {}
+                for channel, is_tmp in client_channels.items():
+                    channels[client_id][channel] = 'temp' if is_tmp else 'persistent'
             return channels
         except Exception as ex:
             logger.log_error(ex, 'PeeweeBase(get_subscription_by_client)')
@@ -167,9 +224,7 @@ class PeeweeBase():
     # return number
     async def check_subscription(self, client_id, channel):
         try:
-            count = len([s.channel for s in self.subscriptions if (s.client_id == client_id and s.channel == channel)])
-            # count = Subscriptions.select().where(Subscriptions.client_id == client_id, Subscriptions.channel == channel).count()
-            return count
+            return 1 if self.subscriptions.contains(client_id, channel) else 0
         except Exception as ex:
             logger.log_error(ex, 'PeeweeBase(check_subscription)')
         return 0
@@ -177,15 +232,7 @@ class PeeweeBase():
     # return nothing
     async def remove_subscription(self, client_id, channel, removefromdb = True):
         try:
-            i = 0
-            found = False
-            for s in self.subscriptions:
-                if s.channel == channel and s.client_id == client_id:
-                    found = True
-                    break
-                i += 1
-            if found:
-                self.subscriptions.pop(i)
+            self.subscriptions.remove(client_id, channel)
             if removefromdb:
                 await self.remove_pubmap_by_channel(channel, client_id)
         except Exception as ex:
@@ -194,47 +241,74 @@ class PeeweeBase():
     # return nothing
     async def insert_subscription(self, client_id, channel, persistent_flag, addtodb = True):
         try:
-            check = await self.check_subscription(client_id, channel)
-            if check == 0:
-                self.subscriptions.append(subscription_entry(client_id, channel, not persistent_flag))
+            if self.subscriptions.add(client_id, channel, not persistent_flag):
                 if addtodb:
-                    Subscriptions.create(client_id = client_id,
-                                            channel = channel,
-                                            is_tmp = not persistent_flag)
+                    self.collector.cancel_channel(client_id, channel)
+                    await self.__create_subscription(client_id, channel, not persistent_flag)
         except Exception as ex:
             logger.log_error(ex, 'PeeweeBase(insert_subscription)')
 
+    @db_call
+    def __create_subscription(self, client_id, channel, is_tmp):
+        Subscriptions.insert(client_id = client_id,
+                                channel = channel,
+                                is_tmp = is_tmp).on_conflict_ignore().execute()
+
+    @staticmethod
+    def __packet_dict(p):
+        return {
+            'packet_id' : p.packet_id,
+            'sender_id' : p.sender_id,
+            'channel' : p.channel,
+            'data' : serializer.loads_stored(p.data),
+            'timestamp' : p.timestamp
+            }
+
     # return dict 
-    async def get_packet(self, packet_id):
+    @db_call
+    def get_packet(self, packet_id):
         try:
-            packets = Packets.select().where(Packets.packet_id == packet_id)
-            # to do order by timestamp
-            if packets.count() > 0:
-                p = packets[0]
-                return ({
-                    'packet_id' : p.packet_id,
-                    'sender_id' : p.sender_id,
-                    'channel' : p.channel,
-                    'data' : json.loads(p.data)['d'],
-                    'timestamp' : p.timestamp
-                    })
+            p = Packets.get_or_none(Packets.packet_id == packet_id)
+            if p is not None:
+                return self.__packet_dict(p)
         except Exception as ex:
             logger.log_error(ex, 'PeeweeBase(get_packet)')
         return None
 
-    # return nothing 
-    async def insert_packet(self, packet_id, sender_id, channel, data):
+    # return dict of packet id -> packet dict, the missing packets are left out
+    @db_call
+    def get_packets(self, packet_ids):
+        packets = {}
         try:
-            Packets.create(packet_id = packet_id,
-                            sender_id = sender_id,
-                            channel = channel,
-                            data = json.dumps({'d': data}),
-                            timestamp = datetime.datetime.utcnow())
+            for i in range(0, len(packet_ids), self.PACKETS_PER_QUERY):
+                for p in Packets.select().where(Packets.packet_id << packet_ids[i:i + self.PACKETS_PER_QUERY]):
+                    packets[p.packet_id] = self.__packet_dict(p)
+        except Exception as ex:
+            logger.log_error(ex, 'PeeweeBase(get_packets)')
+        return packets
+
+    # return bool, True once the packet and the pubmaps of its receivers are committed
+    async def insert_packet(self, packet_id, sender_id, channel, data, client_ids = None):
+        try:
+            packet = {
+                'packet_id': packet_id,
+                'sender_id': sender_id,
+                'channel': channel,
+                'data': serializer.dumps_stored(data),
+                'timestamp': datetime.datetime.utcnow()
+            }
+            pubmaps = []
+            if client_ids is not None:
+                for client_id in client_ids:
+                    pubmaps.append({'packet_id': packet_id, 'client_id': client_id, 'channel': channel})
+            return await self.journal.write([packet], pubmaps)
         except Exception as ex:
             logger.log_error(ex, 'PeeweeBase(insert_packet)')
+        return False
     
     # return array of dict 
-    async def get_retained_packets(self, channels):
+    @db_call
+    def get_retained_packets(self, channels):
         try:
             packets = RetainedPackets.select().where(RetainedPackets.channel << channels)
             result = []
@@ -242,7 +316,7 @@ class PeeweeBase():
                 result.append({
                     'sender_id' : p.sender_id,
                     'channel' : p.channel,
-                    'data' : json.loads(p.data)['d'],
+                    'data' : serializer.loads_stored(p.data),
                     'timestamp' : p.timestamp
                     })
             return result
@@ -250,21 +324,33 @@ class PeeweeBase():
             logger.log_error(ex, 'PeeweeBase(get_retained_packets)')
         return None
 
-    # return nothing 
-    async def insert_retained_packet(self, sender_id, channel, data):
+    # return bool, True once the rows are committed, a row replaces the retained packet of its channel
+    @db_call
+    def insert_retained_packets(self, rows):
+        try:
+            now = datetime.datetime.utcnow()
+            rows = [{'sender_id': r['sender_id'], 'channel': r['channel'], 'data': serializer.dumps_stored(r['data']), 'timestamp': now} for r in rows]
+            with DB_PROXY.atomic():
+                for i in range(0, len(rows), self.RETAINED_PER_STATEMENT):
+                    RetainedPackets.insert_many(rows[i:i + self.RETAINED_PER_STATEMENT]).on_conflict_replace().execute()
+            return True
+        except Exception as ex:
+            logger.log_error(ex, 'PeeweeBase(insert_retained_packets)')
+        return False
+
+    # return list of string, the channels which have a retained packet
+    def load_retained_channels(self):
         try:
-            RetainedPackets.delete().where(RetainedPackets.channel == channel).execute()
-            RetainedPackets.create(sender_id = sender_id,
-                                    channel = channel,
-                                    data = json.dumps({'d': data}),
-                                    timestamp = datetime.datetime.utcnow())
+            return [r.channel for r in RetainedPackets.select(RetainedPackets.channel)]
         except Exception as ex:
-            logger.log_error(ex, 'PeeweeBase(insert_retained_packet)')
+            logger.log_error(ex, 'PeeweeBase(load_retained_channels)')
+        return []
 
     # return list of string 
-    async def get_pubmap(self, client_id):
+    @db_call
+    def get_pubmap(self, client_id):
         try:
-            pubmaps = Pubmaps.select().where(Pubmaps.client_id == client_id)
+            pubmaps = Pubmaps.select(Pubmaps.packet_id).where(Pubmaps.client_id == client_id).order_by(Pubmaps.id)
             packet_ids = []
             for p in pubmaps:
                 packet_ids.append(p.packet_id)
@@ -274,76 +360,24 @@ class PeeweeBase():
         return []
 
     # return nothing 
-    async def remove_packets_by_pubmap(self, packet_ids):
+    @db_call
+    def remove_packets_by_pubmap(self, packet_ids):
         try:
-            for packet_id in packet_ids:
-                count = Pubmaps.select().where(Pubmaps.packet_id == packet_id).count()
-                if count == 0:
-                    Packets.delete().where(Packets.packet_id == packet_id).execute()
+            self.collector.sweep(packet_ids)
         except Exception as ex:
             logger.log_error(ex, 'PeeweeBase(remove_packets_by_pubmap)')
 
     # return nothing 
     async def remove_pubmap(self, packet_id, client_id):
-        _map = {
-            'p': packet_id, 'c': client_id
-        }
-        self.listRemovedPubmaps.append(_map)
-    
-    # return list of string
-    async def remove_pubmap_by_channel(self, channel, client_id):
-        _map = {
-            'ch': channel, 'c': client_id
-        }
-        self.listRemoveChannelsWithClient.append(_map)
-    
-    # return nothing 
-    async def remove_pubmap_from_map(self):
-        error = False
-        if len(self.listRemovedPubmaps) > 0:
-            logger.log_debug(('Removing {0} maps').format(len(self.listRemovedPubmaps)), 'PeeweeBase(remove_pubmap_from_map)')
-            packet_ids = []
-            for _map in self.listRemovedPubmaps:
-                packet_id, client_id = _map['p'], _map['c']
-                packet_ids.append(packet_id)
-                # print (packet_id, client_id)
-                try:
-                    Pubmaps.delete().where(Pubmaps.packet_id == packet_id, Pubmaps.client_id == client_id).execute()
-                except Exception as ex:
-                    logger.log_error(ex, 'PeeweeBase(remove_pubmap_from_map)')
-                    error = True
-                    break
-            await self.remove_packets_by_pubmap(packet_ids)
-            if not error:
-                self.listRemovedPubmaps.clear()
+        self.collector.ack(packet_id, client_id)
     
     # return nothing
-    async def remove_pubmap_by_channel_from_map(self):
-        error = False
-        if len(self.listRemoveChannelsWithClient) > 0:
-            logger.log_debug(('Removing {0} maps by channels').format(len(self.listRemoveChannelsWithClient)), 'PeeweeBase(remove_pubmap_by_channel_from_map)')
-            for _map in self.listRemoveChannelsWithClient:
-                try:
-                    channel, client_id = _map['ch'], _map['c']
-                    Subscriptions.delete().where(Subscriptions.client_id == client_id, Subscriptions.channel == channel).execute()
-                    pubmaps = Pubmaps.select().where(Pubmaps.channel == channel, Pubmaps.client_id == client_id)
-                    ids = []
-                    for p in pubmaps:
-                        ids.append(p.packet_id)
-                    Pubmaps.delete().where(Pubmaps.channel == channel, Pubmaps.client_id == client_id).execute()
-                    await self.remove_packets_by_pubmap(ids)
-                except Exception as ex:
-                    logger.log_error(ex, 'PeeweeBase(remove_pubmap_by_channel_from_map)')
-                    error = True
-                    break
-            if not error:
-                self.listRemoveChannelsWithClient.clear()
+    async def remove_pubmap_by_channel(self, channel, client_id):
+        self.collector.remove_channel(client_id, channel)
 
-    # return nothing 
-    async def insert_pubmap(self, packet_id, client_id, channel):
-        try:
-            Pubmaps.create(client_id = client_id,
-                            packet_id = packet_id,
-                            channel = channel)
-        except Exception as ex:
-            logger.log_error(ex, 'PeeweeBase(insert_pubmap)')
\ No newline at end of file
+    # returns the storage metrics
+    def get_metrics(self):
+        return {
+            'write_journal': self.journal.get_metrics(),
+            'pubmap_collector': self.collector.get_metrics()
+        }
@@ -0,0 +1,178 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+import asyncio
+import collections
+import time
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.services.peewee_base import DB_PROXY, Subscriptions, Packets, Pubmaps
+
+from peewee import Tuple, fn
+
+# set-based cleanup of the acknowledged qos 1 pubmaps, the unsubscribed channels and the packets left without pubmaps
+# the pending work is deduplicated in memory and removed with bulk deletes, followed by one orphan sweep of the touched packets
+# a pass starts as soon as a batch is full or when the interval expires, so a growing backlog is collected back to back
+class PubmapCollector():
+    # keys per delete statement, keeps the bound variables below the old sqlite limit of 999
+    KEYS_PER_STATEMENT = 400
+
+    def __init__(self, dbExecutor, interval, batchSize):
+        self.dbExecutor = dbExecutor
+        # seconds
+        self.interval = interval
+        self.batchSize = batchSize
+        # (packet_id, client_id) -> time queued
+        self.acks = collections.OrderedDict()
+        # (client_id, channel) -> time queued
+        self.channels = collections.OrderedDict()
+        self.timer = None
+        self.wakeup = None
+        self.task = None
+        # metrics
+        self.passes = 0
+        self.errors = 0
+        self.removedPubmaps = 0
+        self.removedPackets = 0
+        self.totalPassTime = 0.0
+        self.maxPassTime = 0.0
+        self.lastPassTime = 0.0
+
+    # queues the removal of an acknowledged pubmap
+    def ack(self, packet_id, client_id):
+        key = (packet_id, client_id)
+        if key not in self.acks:
+            self.acks[key] = time.monotonic()
+            self.__schedule()
+
+    # queues the removal of a subscription and of the pubmaps of the client on that channel
+    def remove_channel(self, client_id, channel):
+        key = (client_id, channel)
+        if key not in self.channels:
+            self.channels[key] = time.monotonic()
+            self.__schedule()
+
+    # drops a queued channel removal, called when the client subscribes again
+    def cancel_channel(self, client_id, channel):
+        self.channels.pop((client_id, channel), None)
+
+    def backlog(self):
+        return len(self.acks) + len(self.channels)
+
+    def __schedule(self):
+        if self.task is None:
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.ensure_future(self.__collector())
+        if self.backlog() >= self.batchSize:
+            self.__wake()
+        elif self.timer is None:
+            self.timer = asyncio.get_event_loop().call_later(self.interval, self.__wake)
+
+    def __wake(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.wakeup.set()
+
+    @staticmethod
+    def __take(pending, count):
+        batch = []
+        while len(pending) > 0 and len(batch) < count:
+            batch.append(pending.popitem(last = False))
+        return batch
+
+    @staticmethod
+    def __restore(pending, batch):
+        restored = collections.OrderedDict(batch)
+        restored.update(pending)
+        return restored
+
+    def __chunks(self, keys):
+        for i in range(0, len(keys), self.KEYS_PER_STATEMENT):
+            yield keys[i:i + self.KEYS_PER_STATEMENT]
+
+    # deletes the packets among packet_ids that no pubmap refers to anymore, returns the number of deleted packets
+    def sweep(self, packet_ids):
+        deleted = 0
+        for chunk in self.__chunks(list(packet_ids)):
+            referenced = Pubmaps.select(Pubmaps.packet_id).where(Pubmaps.packet_id.in_(chunk))
+            deleted += Packets.delete().where(Packets.packet_id.in_(chunk), Packets.packet_id.not_in(referenced)).execute()
+        return deleted
+
+    def __collect(self, acks, channels):
+        try:
+            removed = 0
+            packet_ids = set()
+            with DB_PROXY.atomic():
+                for chunk in self.__chunks(channels):
+                    key = Tuple(Pubmaps.client_id, Pubmaps.channel)
+                    for p in Pubmaps.select(Pubmaps.packet_id).where(key.in_(chunk)):
+                        packet_ids.add(p.packet_id)
+                    removed += Pubmaps.delete().where(key.in_(chunk)).execute()
+                    Subscriptions.delete().where(Tuple(Subscriptions.client_id, Subscriptions.channel).in_(chunk)).execute()
+                for chunk in self.__chunks(acks):
+                    removed += Pubmaps.delete().where(Tuple(Pubmaps.packet_id, Pubmaps.client_id).in_(chunk)).execute()
+                    packet_ids.update(packet_id for packet_id, _ in chunk)
+                self.removedPackets += self.sweep(packet_ids)
+            self.removedPubmaps += removed
+            return True
+        except Exception as ex:
+            logger.log_error(ex, 'PubmapCollector(collect)')
+        return False
+
+    async def __collector(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.backlog() > 0:
+                acks = self.__take(self.acks, self.batchSize)
+                channels = self.__take(self.channels, self.batchSize - len(acks))
+                logger.log_debug(('Removing {0} pubmaps and {1} channels, {2} pending').format(len(acks), len(channels), self.backlog()), 'PubmapCollector')
+                start = time.perf_counter()
+                collected = await self.dbExecutor.run(self.__collect, [k for k, _ in acks], [k for k, _ in channels])
+                elapsed = time.perf_counter() - start
+                self.passes += 1
+                self.totalPassTime += elapsed
+                self.maxPassTime = max(self.maxPassTime, elapsed)
+                self.lastPassTime = elapsed
+                if not collected:
+                    # retried on the next interval
+                    self.errors += 1
+                    self.acks = self.__restore(self.acks, acks)
+                    self.channels = self.__restore(self.channels, channels)
+                    if self.timer is None:
+                        self.timer = asyncio.get_event_loop().call_later(self.interval, self.__wake)
+                    break
+
+    def get_metrics(self):
+        # the dicts are in queue order, the first entry is the oldest
+        oldest = [next(iter(pending.values())) for pending in (self.acks, self.channels) if len(pending) > 0]
+        return {
+            'backlog': self.backlog(),
+            'oldest_pending_ms': (time.monotonic() - min(oldest)) * 1000 if len(oldest) > 0 else 0,
+            'passes': self.passes,
+            'removed_pubmaps': self.removedPubmaps,
+            'removed_packets': self.removedPackets,
+            'avg_pass_ms': (self.totalPassTime / self.passes * 1000) if self.passes > 0 else 0,
+            'max_pass_ms': self.maxPassTime * 1000,
+            'last_pass_ms': self.lastPassTime * 1000,
+            'errors': self.errors
+        }
@@ -0,0 +1,124 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+import asyncio
+import collections
+import concurrent.futures
+import time
+
+import pyjmqt.server.logger as logger
+
+# writes redis commands from the event loop without blocking it
+# publishes are queued and flushed as one pipeline, either when a batch is full or when the flush timer expires
+# all the redis calls run in one writer thread and the publishes reach redis in the order they were queued
+class RedisWriter():
+    def __init__(self, redisConn, eventLoop, batchSize, flushInterval, queueSize):
+        self.redisConn = redisConn
+        self.loop = eventLoop
+        self.batchSize = batchSize
+        # seconds
+        self.flushInterval = flushInterval
+        self.queueSize = queueSize
+        self.queue = collections.deque()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers = 1)
+        self.flushTimer = None
+        self.wakeup = None
+        self.space = None
+        self.task = None
+        # metrics
+        self.batches = 0
+        self.messages = 0
+        self.maxBatch = 0
+        self.errors = 0
+        self.totalFlushTime = 0.0
+        self.maxFlushTime = 0.0
+        self.lastFlushTime = 0.0
+        self.blocked = 0
+
+    # queues a publish, waits if the queue is full
+    async def publish(self, channel, data):
+        if self.task is None:
+            self.wakeup = asyncio.Event()
+            self.space = asyncio.Event()
+            self.task = asyncio.ensure_future(self.__writer(), loop = self.loop)
+        while len(self.queue) >= self.queueSize:
+            # back-pressure, the caller waits until the writer catches up
+            self.blocked += 1
+            self.space.clear()
+            await self.space.wait()
+        self.queue.append((channel, data))
+        if len(self.queue) >= self.batchSize:
+            self.__wake()
+        elif self.flushTimer is None:
+            self.flushTimer = self.loop.call_later(self.flushInterval, self.__wake)
+
+    # runs a redis call (e.g. a read) in the writer thread and returns its result
+    async def call(self, func, *args):
+        return await self.loop.run_in_executor(self.executor, func, *args)
+
+    def __wake(self):
+        if self.flushTimer is not None:
+            self.flushTimer.cancel()
+            self.flushTimer = None
+        self.wakeup.set()
+
+    def __execute(self, batch):
+        pipe = self.redisConn.pipeline(transaction = False)
+        for channel, data in batch:
+            pipe.publish(channel, data)
+        pipe.execute()
+
+    async def __writer(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while len(self.queue) > 0:
+                batch = []
+                while len(self.queue) > 0 and len(batch) < self.batchSize:
+                    batch.append(self.queue.popleft())
+                self.space.set()
+                start = time.perf_counter()
+                try:
+                    await self.call(self.__execute, batch)
+                except Exception as ex:
+                    self.errors += 1
+                    logger.log_error(ex, 'RedisWriter')
+                elapsed = time.perf_counter() - start
+                self.batches += 1
+                self.messages += len(batch)
+                self.maxBatch = max(self.maxBatch, len(batch))
+                self.totalFlushTime += elapsed
+                self.maxFlushTime = max(self.maxFlushTime, elapsed)
+                self.lastFlushTime = elapsed
+
+    def get_metrics(self):
+        return {
+            'queued': len(self.queue),
+            'batches': self.batches,
+            'messages': self.messages,
+            'avg_batch_size': (self.messages / self.batches) if self.batches > 0 else 0,
+            'max_batch_size': self.maxBatch,
+            'avg_flush_ms': (self.totalFlushTime / self.batches * 1000) if self.batches > 0 else 0,
+            'max_flush_ms': self.maxFlushTime * 1000,
+            'last_flush_ms': self.lastFlushTime * 1000,
+            'blocked_publishes': self.blocked,
+            'errors': self.errors
+        }
@@ -0,0 +1,185 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+import asyncio
+import collections
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.packets import PacketGenerator
+from pyjmqt.server.core.topics import is_wildcard, matches
+
+# retained packets held in memory, keyed by channel, with their push frames already encoded
+# the entries are evicted in lru order once the cache holds more than maxBytes, the evicted channels are
+# loaded again from the database when a client asks for them
+# the channels with a retained packet are all known, so the channels without one never reach the database
+# the writes are persisted behind, the latest packet of a channel is written once per flush
+class RetainedStore():
+    # rough memory used by an entry besides its encoded frame
+    ENTRY_OVERHEAD = 200
+    # seconds between the retained packet writes
+    FLUSH_INTERVAL = 0.05
+
+    def __init__(self, dbService, maxBytes):
+        self.dbService = dbService
+        self.maxBytes = maxBytes
+        # channel -> (frame, size), in lru order
+        self.entries = collections.OrderedDict()
+        # channels with a retained packet, in memory or in the database
+        self.channels = set()
+        self.bytes = 0
+        # channel -> row, not written yet
+        self.dirty = collections.OrderedDict()
+        self.flushTimer = None
+        self.task = None
+        self.wakeup = None
+        # metrics
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.rows = 0
+        self.errors = 0
+
+    # loads the channels which have a retained packet (called once at startup)
+    def load(self):
+        self.channels = set(self.dbService.load_retained_channels())
+
+    # stores the retained packet of a channel, persist is False for the packets already stored by another server
+    def put(self, sender_id, channel, data, persist = True):
+        self.channels.add(channel)
+        self.__cache(channel, PacketGenerator.generate_push_frame(channel, data, 0, sender_id, True, 0))
+        if persist:
+            self.dirty.pop(channel, None)
+            self.dirty[channel] = {'sender_id': sender_id, 'channel': channel, 'data': data}
+            self.__schedule()
+
+    # returns the push frames of the retained packets of the channels, a wildcard filter stands for all the
+    # retained channels it matches
+    async def get(self, channels):
+        frames = []
+        missing = []
+        for channel in self.__expand(channels):
+            if channel not in self.channels:
+                continue
+            entry = self.entries.get(channel)
+            if entry is not None:
+                self.entries.move_to_end(channel)
+                self.hits += 1
+                frames.append(entry[0])
+            elif channel in self.dirty:
+                # evicted before it was written
+                row = self.dirty[channel]
+                frame = PacketGenerator.generate_push_frame(channel, row['data'], 0, row['sender_id'], True, 0)
+                self.__cache(channel, frame)
+                self.hits += 1
+                frames.append(frame)
+            else:
+                missing.append(channel)
+        if len(missing) > 0:
+            self.misses += len(missing)
+            self.loads += 1
+            packets = await self.dbService.get_retained_packets(missing)
+            for packet in packets or []:
+                channel = packet['channel']
+                # a newer packet may have been put while the database was read
+                entry = self.entries.get(channel)
+                if entry is None:
+                    frame = PacketGenerator.generate_push_frame(channel, packet['data'], 0, packet['sender_id'], True, 0)
+                    self.__cache(channel, frame)
+                else:
+                    frame = entry[0]
+                frames.append(frame)
+        return frames
+
+    def __expand(self, channels):
+        if not any(is_wildcard(channel) for channel in channels):
+            return channels
+        # a channel matched by several filters is sent once
+        expanded = collections.OrderedDict()
+        for channel in channels:
+            if is_wildcard(channel):
+                for retained in self.matching_channels(channel):
+                    expanded[retained] = True
+            else:
+                expanded[channel] = True
+        return list(expanded)
+
+    # returns the retained channels which a wildcard filter matches
+    def matching_channels(self, topicFilter):
+        return [channel for channel in self.channels if matches(topicFilter, channel)]
+
+    def __cache(self, channel, frame):
+        old = self.entries.pop(channel, None)
+        if old is not None:
+            self.bytes -= old[1]
+        size = len(frame.socket_frame()) + len(frame.text()) + self.ENTRY_OVERHEAD
+        if size > self.maxBytes:
+            return
+        self.entries[channel] = (frame, size)
+        self.bytes += size
+        while self.bytes > self.maxBytes:
+            _, (_, evicted) = self.entries.popitem(last = False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+    def __schedule(self):
+        if self.task is None:
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.ensure_future(self.__writer())
+        if self.flushTimer is None:
+            self.flushTimer = asyncio.get_event_loop().call_later(self.FLUSH_INTERVAL, self.__wake)
+
+    def __wake(self):
+        self.flushTimer = None
+        self.wakeup.set()
+
+    async def __writer(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            if len(self.dirty) == 0:
+                continue
+            rows, self.dirty = list(self.dirty.values()), collections.OrderedDict()
+            self.flushes += 1
+            self.rows += len(rows)
+            if not await self.dbService.insert_retained_packets(rows):
+                self.errors += 1
+                # retried on the next flush, unless a newer packet has been put meanwhile
+                for row in rows:
+                    if row['channel'] not in self.dirty:
+                        self.dirty[row['channel']] = row
+                self.__schedule()
+
+    def get_metrics(self):
+        return {
+            'channels': len(self.channels),
+            'cached': len(self.entries),
+            'cached_bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'db_loads': self.loads,
+            'evictions': self.evictions,
+            'pending_writes': len(self.dirty),
+            'flushes': self.flushes,
+            'rows': self.rows,
+            'errors': self.errors
+        }
@@ -0,0 +1,188 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+from pyjmqt.server.core.topics import TopicTree, is_wildcard, is_reserved, matches, parse_shared
+
+# in-memory subscription registry, indexed both by channel and by client
+# the wildcard filters are also kept in a topic tree, matched against the published channels (except the p2p
+# and control channels)
+# the shared subscriptions ($share/<group>/<filter>) are indexed by their filter in a separate registry, the
+# members of a group are not subscribers of the filter, one of them is picked for each packet by the caller
+class SubscriptionIndex():
+    def __init__(self):
+        # channel -> set of client ids
+        self.by_channel = {}
+        # client id -> {channel: is_tmp}
+        self.by_client = {}
+        # wildcard filter -> client ids
+        self.tree = TopicTree()
+        # client id -> {wildcard or shared subscription: filter it matches the channels with}
+        self.filters = {}
+        # shared subscription -> list of member client ids, in subscription order
+        self.groups = {}
+        # filter -> set of shared subscriptions, and the wildcard filters in a topic tree
+        self.groupsByFilter = {}
+        self.groupTree = TopicTree()
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    # adds a subscription, returns False if it already exists
+    def add(self, client_id, channel, is_tmp):
+        channels = self.by_client.get(client_id)
+        if channels is None:
+            channels = self.by_client[client_id] = {}
+        elif channel in channels:
+            return False
+        channels[channel] = is_tmp
+        shared = parse_shared(channel)
+        if shared is not None:
+            self.__add_member(client_id, channel, shared[1])
+        else:
+            clients = self.by_channel.get(channel)
+            if clients is None:
+                clients = self.by_channel[channel] = set()
+            clients.add(client_id)
+            if is_wildcard(channel):
+                self.tree.add(channel, client_id)
+                self.__add_filter(client_id, channel, channel)
+        self.count += 1
+        return True
+
+    def __add_filter(self, client_id, channel, topicFilter):
+        filters = self.filters.get(client_id)
+        if filters is None:
+            filters = self.filters[client_id] = {}
+        filters[channel] = topicFilter
+
+    def __remove_filter(self, client_id, channel):
+        filters = self.filters[client_id]
+        del filters[channel]
+        if len(filters) == 0:
+            del self.filters[client_id]
+
+    def __add_member(self, client_id, channel, topicFilter):
+        members = self.groups.get(channel)
+        if members is None:
+            members = self.groups[channel] = []
+            if is_wildcard(topicFilter):
+                self.groupTree.add(topicFilter, channel)
+            else:
+                groups = self.groupsByFilter.get(topicFilter)
+                if groups is None:
+                    groups = self.groupsByFilter[topicFilter] = set()
+                groups.add(channel)
+        members.append(client_id)
+        self.__add_filter(client_id, channel, topicFilter)
+
+    def __remove_member(self, client_id, channel, topicFilter):
+        members = self.groups[channel]
+        members.remove(client_id)
+        if len(members) == 0:
+            del self.groups[channel]
+            if is_wildcard(topicFilter):
+                self.groupTree.remove(topicFilter, channel)
+            else:
+                groups = self.groupsByFilter[topicFilter]
+                groups.discard(channel)
+                if len(groups) == 0:
+                    del self.groupsByFilter[topicFilter]
+        self.__remove_filter(client_id, channel)
+
+    # removes a subscription, returns False if it does not exist
+    def remove(self, client_id, channel):
+        channels = self.by_client.get(client_id)
+        if channels is None or channel not in channels:
+            return False
+        del channels[channel]
+        if len(channels) == 0:
+            del self.by_client[client_id]
+        shared = parse_shared(channel)
+        if shared is not None:
+            self.__remove_member(client_id, channel, shared[1])
+        else:
+            clients = self.by_channel[channel]
+            clients.discard(client_id)
+            if len(clients) == 0:
+                del self.by_channel[channel]
+            if is_wildcard(channel):
+                self.tree.remove(channel, client_id)
+                self.__remove_filter(client_id, channel)
+        self.count -= 1
+        return True
+
+    # checks if a client is subscribed to a channel, directly or through one of its wildcard or shared filters
+    def contains(self, client_id, channel):
+        channels = self.by_client.get(client_id)
+        if channels is None:
+            return False
+        if channel in channels:
+            return True
+        if is_reserved(channel):
+            return False
+        filters = self.filters.get(client_id)
+        if filters is not None:
+            for topicFilter in filters.values():
+                if matches(topicFilter, channel):
+                    return True
+        return False
+
+    # returns the set of clients receiving the packets published to a channel, wildcard filters included
+    # (must not be modified by the caller)
+    def clients(self, channel):
+        clients = self.by_channel.get(channel, frozenset())
+        if len(self.tree) == 0 or is_reserved(channel):
+            return clients
+        return self.tree.match(channel).union(clients)
+
+    # returns the set of clients subscribed to a channel by its name, without the wildcard filters
+    # (must not be modified by the caller)
+    def exact_clients(self, channel):
+        return self.by_channel.get(channel, frozenset())
+
+    # returns the channels subscribed to by name which a wildcard filter matches
+    def matching_channels(self, topicFilter):
+        return [channel for channel in self.by_channel if not is_wildcard(channel) and matches(topicFilter, channel)]
+
+    # returns [(shared subscription, members)] of the groups whose filter matches a channel
+    # (the members must not be modified by the caller)
+    def shared_groups(self, channel):
+        if len(self.groups) == 0 or is_reserved(channel):
+            return []
+        channels = self.groupsByFilter.get(channel, ())
+        if len(self.groupTree) > 0:
+            channels = self.groupTree.match(channel).union(channels)
+        return [(shared, self.groups[shared]) for shared in channels]
+
+    # returns {channel: is_tmp} for a client (must not be modified by the caller)
+    def channels(self, client_id):
+        return self.by_client.get(client_id, {})
+
+    def clear(self):
+        self.by_channel.clear()
+        self.by_client.clear()
+        self.tree.clear()
+        self.filters.clear()
+        self.groups.clear()
+        self.groupsByFilter.clear()
+        self.groupTree.clear()
+        self.count = 0
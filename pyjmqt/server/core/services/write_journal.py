@@ -0,0 +1,122 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+import asyncio
+import time
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.services.peewee_base import DB_PROXY, Packets, Pubmaps
+
+# write-behind journal for the qos 1 packets and pubmaps
+# rows are grouped and inserted with insert_many in one transaction, either when enough rows are pending
+# or when the flush timer expires, the writers are resumed only after their rows are committed
+class WriteJournal():
+    # rows per insert statement, keeps the bound variables below the old sqlite limit of 999
+    ROWS_PER_STATEMENT = 150
+
+    def __init__(self, dbExecutor, flushInterval, flushRows):
+        self.dbExecutor = dbExecutor
+        # seconds
+        self.flushInterval = flushInterval
+        self.flushRows = flushRows
+        self.packets = []
+        self.pubmaps = []
+        self.waiters = []
+        self.flushTimer = None
+        self.wakeup = None
+        self.task = None
+        # metrics
+        self.flushes = 0
+        self.rows = 0
+        self.statements = 0
+        self.errors = 0
+        self.totalFlushTime = 0.0
+        self.maxFlushTime = 0.0
+
+    # queues the rows and waits until they are committed, returns False if the commit failed
+    async def write(self, packets, pubmaps):
+        loop = asyncio.get_event_loop()
+        if self.task is None:
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.ensure_future(self.__writer())
+        future = loop.create_future()
+        self.packets.extend(packets)
+        self.pubmaps.extend(pubmaps)
+        self.waiters.append(future)
+        if len(self.packets) + len(self.pubmaps) >= self.flushRows:
+            self.__wake()
+        elif self.flushTimer is None:
+            self.flushTimer = loop.call_later(self.flushInterval, self.__wake)
+        return await future
+
+    def __wake(self):
+        if self.flushTimer is not None:
+            self.flushTimer.cancel()
+            self.flushTimer = None
+        self.wakeup.set()
+
+    def __insert(self, model, rows):
+        for i in range(0, len(rows), self.ROWS_PER_STATEMENT):
+            # ignores the rows already committed by a previous attempt
+            model.insert_many(rows[i:i + self.ROWS_PER_STATEMENT]).on_conflict_ignore().execute()
+            self.statements += 1
+
+    def __flush(self, packets, pubmaps):
+        try:
+            with DB_PROXY.atomic():
+                self.__insert(Packets, packets)
+                self.__insert(Pubmaps, pubmaps)
+            return True
+        except Exception as ex:
+            logger.log_error(ex, 'WriteJournal(flush)')
+        return False
+
+    async def __writer(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while len(self.waiters) > 0:
+                packets, pubmaps, waiters = self.packets, self.pubmaps, self.waiters
+                self.packets, self.pubmaps, self.waiters = [], [], []
+                start = time.perf_counter()
+                committed = await self.dbExecutor.run(self.__flush, packets, pubmaps)
+                elapsed = time.perf_counter() - start
+                self.flushes += 1
+                self.rows += len(packets) + len(pubmaps)
+                self.totalFlushTime += elapsed
+                self.maxFlushTime = max(self.maxFlushTime, elapsed)
+                if not committed:
+                    self.errors += 1
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(committed)
+
+    def get_metrics(self):
+        return {
+            'pending_rows': len(self.packets) + len(self.pubmaps),
+            'flushes': self.flushes,
+            'rows': self.rows,
+            'statements': self.statements,
+            'avg_rows_per_flush': (self.rows / self.flushes) if self.flushes > 0 else 0,
+            'avg_flush_ms': (self.totalFlushTime / self.flushes * 1000) if self.flushes > 0 else 0,
+            'max_flush_ms': self.maxFlushTime * 1000,
+            'errors': self.errors
+        }
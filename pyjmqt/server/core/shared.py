@@ -0,0 +1,101 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import collections
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.constants import QOS
+
+ROUND_ROBIN = 'round_robin'
+LEAST_OUTSTANDING = 'least_outstanding'
+SHARED_SUB_STRATEGIES = [ROUND_ROBIN, LEAST_OUTSTANDING]
+
+# creates the member selector of the shared subscriptions from the settings, SHARED_SUB_STRATEGY
+def create_shared_selector(settings):
+    strategy = str(settings.get('SHARED_SUB_STRATEGY', ROUND_ROBIN)).lower()
+    if strategy not in SHARED_SUB_STRATEGIES:
+        logger.log_warning('Unknown SHARED_SUB_STRATEGY {0}, using {1}'.format(strategy, ROUND_ROBIN), 'SharedSelector')
+        strategy = ROUND_ROBIN
+    return SharedSelector(strategy)
+
+# picks the member of a shared subscription group which receives a packet
+# round_robin : the connected members in turn
+# least_outstanding : the connected member with the fewest qos 1 packets given by this server and not acknowledged
+# yet, in turn when several are equal, the acks are sent back to this server by the server of the member
+# the offline members are skipped, a qos 1 packet goes to an offline member (as a pending packet) only if none
+# is connected, a qos 0 packet is then dropped
+class SharedSelector():
+    def __init__(self, strategy):
+        self.strategy = strategy
+        # shared subscription -> position of the next member
+        self.cursors = {}
+        # client id -> qos 1 packets given to the client and not acknowledged yet
+        self.outstanding = collections.Counter()
+        # metrics
+        self.selected = 0
+        self.dropped = 0
+
+    # returns the member receiving a packet, None if the packet is dropped
+    # members excludes the sender, online is the set of the members connected to any server
+    def select(self, shared, members, online, qos):
+        candidates = []
+        for member in members:
+            if member in online:
+                candidates.append(member)
+            else:
+                # its packets are sent again when it reconnects, without acks coming back here
+                self.outstanding.pop(member, None)
+        if len(candidates) == 0:
+            if qos != QOS.ONE or len(members) == 0:
+                self.dropped += 1
+                return None
+            candidates = members
+        cursor = self.cursors.get(shared, 0) % len(candidates)
+        if self.strategy == LEAST_OUTSTANDING:
+            best = cursor
+            for i in range(1, len(candidates)):
+                position = (cursor + i) % len(candidates)
+                if self.outstanding[candidates[position]] < self.outstanding[candidates[best]]:
+                    best = position
+            cursor = best
+        member = candidates[cursor]
+        self.cursors[shared] = cursor + 1
+        if qos == QOS.ONE and self.strategy == LEAST_OUTSTANDING:
+            self.outstanding[member] += 1
+        self.selected += 1
+        return member
+
+    # called when a qos 1 packet given to a member is acknowledged
+    def acked(self, client_id):
+        count = self.outstanding.get(client_id, 0)
+        if count > 1:
+            self.outstanding[client_id] = count - 1
+        elif count == 1:
+            del self.outstanding[client_id]
+
+    def get_metrics(self):
+        return {
+            'strategy': self.strategy,
+            'selected': self.selected,
+            'dropped': self.dropped,
+            'outstanding': sum(self.outstanding.values())
+        }
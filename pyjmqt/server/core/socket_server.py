@@ -25,11 +25,14 @@ import ssl
 import time
 import datetime
 from collections import OrderedDict
-import json
 
 import pyjmqt.server.logger as logger
 from pyjmqt.server.core.packets import *
 from pyjmqt.server.core.constants import *
+from pyjmqt.server.core.framing import FrameBuffer, LengthPrefixedBuffer, FramingError, max_frame_size, NUL_FRAMING, LENGTH_FRAMING, COMPRESSED_FRAMING
+from pyjmqt.server.core.inbound import create_inbound_queue
+from pyjmqt.server.core.outbound import create_outbound_queue
+from pyjmqt.server.core.workers import reuse_port
 
 class Peer(object):
     def __init__(self, reader, writer, remoteHost, callbackWrapper, connectionHandler, settings, tag):
@@ -44,47 +47,93 @@ class Peer(object):
         self.client_id = None
         self.connectionHandler = connectionHandler
         self.run = True
+        # JSON until the client negotiates another codec in its conn packet
+        self.codec = JSONCodec
+        self.frameType = NUL_FRAMING
+        self.compressed = False
+        self.framing = FrameBuffer(max_frame_size(settings))
+        self.outbound = create_outbound_queue(self, self.__write, settings, connectionHandler.outboundStats)
 
     async def disconnect(self):
         self.run = False
+        # the frames still queued are handed to the transport, which writes them before closing
+        pending = self.outbound.close()
+        if len(pending) > 0:
+            self.writer.writelines(pending)
         self.writer.close()
         if self.client_id != None:
             logger.log_info(('Conn closed: client {0}, peer {1}'.format(self.client_id, self.id)), self.tag)
         else:
             logger.log_info(('Conn closed: peer {0}'.format(self.id)), self.tag)
 
+    # called by the idle tracker when nothing was received for TIMEOUT_SECONDS, closing the transport
+    # ends the pending read and the peer loop disconnects the client
+    def idle_timeout(self):
+        logger.log_error(('TImeout: client {0}, peer {1}'.format(self.client_id, self.id)), self.tag)
+        self.writer.close()
+
     async def _peer_loop(self):
-        buffer = bytes()
-        while self.run:
-            disconnect = False
-            try:
-                part = await asyncio.wait_for(self.reader.read(1024), timeout=self.settings.TIMEOUT_SECONDS)
-                if part == b'':
+        readSize = self.settings.get('SOCKET_READ_SIZE', 65536)
+        inbound = create_inbound_queue(self.parse_and_respond, self.settings, self.tag)
+        idleTracker = self.connectionHandler.idleTracker
+        idleTracker.add(self)
+        try:
+            while self.run:
+                disconnect = False
+                try:
+                    part = await self.reader.read(readSize)
+                    idleTracker.touch(self)
+                    if part == b'':
+                        disconnect = True
+                    if self.run:                 
+                        await self.__dispatch(part, inbound)
+                    else:
+                        break
+                except FramingError as ex:
+                    logger.log_error(('{0}: client {1}, peer {2}'.format(str(ex), self.client_id, self.id)), self.tag)
                     disconnect = True
-                if self.run:                 
-                    buffer += part
-                    packets = buffer.split(b'\0')
-                    last_index = len(packets) - 1
-                    buffer = packets[last_index]
-                    if len(packets) > 1:
-                        if len(buffer) == 0:
-                            del packets[last_index]
-                        asyncio.Task(self.send_response(packets))
-                else:
+                if disconnect:
+                    # the packets received before the connection was closed are processed first
+                    await inbound.join()
+                    if self.run and self.client_id is None:
+                        await self.disconnect()
+                    else:
+                        await self.connectionHandler.disconnect_client(self.client_id)
                     break
-            except asyncio.TimeoutError:
-                logger.log_error(('TImeout: client {0}, peer {1}'.format(self.client_id, self.id)), self.tag)
-                disconnect = True
-            if disconnect:
-                if self.run and self.client_id is None:
-                    await self.disconnect()
-                else:
-                    await self.connectionHandler.disconnect_client(self.client_id)
-                break
+        finally:
+            idleTracker.remove(self)
+            inbound.close()
                 
+    # frames the bytes read and queues the packets, waits while the queue is full, the socket is not read meanwhile
+    # until the conn is accepted the frames are queued one at a time and processed before the rest of the read is framed,
+    # the conn may switch the codec and the framing and the bytes after it belong to the new framing
+    async def __dispatch(self, part, inbound):
+        while self.client_id is None and self.frameType == NUL_FRAMING:
+            end = part.find(FrameBuffer.DELIMITER)
+            if end == -1:
+                break
+            for packet in self.framing.feed(part[:end + 1]):
+                await inbound.put(packet)
+            part = part[end + 1:]
+            await inbound.join()
+            if not self.run:
+                return
+        for packet in self.framing.feed(part):
+            await inbound.put(packet)
+
+    # switches to a negotiated codec and compression, the next frames are length-prefixed if the codec is binary
+    # or if the frames may be compressed, the bytes already buffered are kept for the new framing
+    def set_codec(self, codec, compressed = False):
+        self.codec = codec
+        self.compressed = compressed
+        if codec.binary or compressed:
+            self.frameType = LENGTH_FRAMING
+            framing = LengthPrefixedBuffer(max_frame_size(self.settings))
+            framing.buffer += self.framing.buffer
+            self.framing = framing
+
     async def parse_and_respond(self, pck):
-        body = pck.decode('utf8')
-        packet, msg = PacketParser.parse_packet(body, self.protocol)
+        packet, msg = PacketParser.parse_packet(pck, self.protocol, self.codec)
         response, data = await self.connectionHandler.create_response(packet, self)
         if response != None:
             await self.send(response)
@@ -93,6 +142,11 @@ class Peer(object):
                 status = PacketParser.get_arg(JSONKeys.statusCode, pckData)
                 if 'client_id' in data and status == StatusCode.OK:
                     self.client_id = data['client_id']
+                    # the connAck is queued already, the next packets use the negotiated codec
+                    codec = PacketParser.get_arg(JSONKeys.codec, pckData)
+                    compression = PacketParser.get_arg(JSONKeys.compression, pckData)
+                    if codec is not None or compression is not None:
+                        self.set_codec(CODECS[codec or JSONCodec.name], compression is not None)
                     # clearing the pending and retained messages
                     asyncio.Task(self.connectionHandler.send_pending_pub(self.client_id))
                     asyncio.Task(self.connectionHandler.send_retained(self.client_id))
@@ -104,19 +158,27 @@ class Peer(object):
                     # clearing the pending messages
                     asyncio.Task(self.connectionHandler.send_retained(self.client_id, channel = channel_name))
 
+    # queues the packet, it is written by the outbound queue
     async def send(self, data):
         try:
-            message = json.dumps(data)
-            if not message.endswith('\0'):
-                message += '\0'
-            self.writer.write(message.encode('utf8'))
-            await self.writer.drain()
+            if not isinstance(data, EncodedPacket):
+                data = EncodedPacket(data)
+            frame = data.socket_frame(self.codec, self.frameType)
+            if self.compressed:
+                policy = self.connectionHandler.compression
+                if policy.should_compress(data.packet, len(frame)):
+                    # the compressed frame is cached by the packet, a push is compressed once for all its subscribers
+                    compressedFrame = data.socket_frame(self.codec, COMPRESSED_FRAMING, policy.level)
+                    if len(compressedFrame) < len(frame):
+                        frame = compressedFrame
+            self.outbound.put(data.packet, frame)
         except Exception as e:
             logger.log_error(e, '[sender] ' + self.tag)
 
-    async def send_response(self, packets):
-        for pck in packets:
-            await self.parse_and_respond(pck)
+    # writes a batch of frames with one call (called by the outbound queue)
+    async def __write(self, frames):
+        self.writer.writelines(frames)
+        await self.writer.drain()
 
 
 class SocketServer(object):
@@ -129,7 +191,7 @@ class SocketServer(object):
 
     def start(self):
         logger.log_info(('Listening on tcp {0}'.format(self.settings.SOCKET_PORT)), self.TAG)
-        self.coro = asyncio.start_server(self.handle_client, '', self.settings.SOCKET_PORT, loop=self.loop)
+        self.coro = asyncio.start_server(self.handle_client, '', self.settings.SOCKET_PORT, reuse_port=reuse_port(self.settings), loop=self.loop)
         self.server = self.loop.run_until_complete(self.coro)
 
     def handle_client(self, reader, writer):
@@ -150,7 +212,7 @@ class SSLSocketServer(object):
         logger.log_info(('Listening on tcp {0}'.format(self.settings.SSL_SOCKET_PORT)), self.TAG)
         sc = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
         sc.load_cert_chain(self.settings.SSL_CERT_PATH, self.settings.SSL_KEY_PATH)
-        self.coro = asyncio.start_server(self.handle_client, '', self.settings.SSL_SOCKET_PORT,  ssl=sc, loop=self.loop)
+        self.coro = asyncio.start_server(self.handle_client, '', self.settings.SSL_SOCKET_PORT,  ssl=sc, reuse_port=reuse_port(self.settings), loop=self.loop)
         self.server = self.loop.run_until_complete(self.coro)
 
     def handle_client(self, reader, writer):
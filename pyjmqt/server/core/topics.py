@@ -0,0 +1,171 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# hierarchical channel names, the levels are separated by '/'
+# a subscription filter may use '+' as a whole level (matches exactly one level) and '*' as the last level
+# (matches the remaining levels, none included, so 'sensors/*' matches 'sensors' and 'sensors/7/temp')
+# a '+' or '*' inside a level is a plain character, the pub channels cannot contain wildcard levels
+# the wildcards are disabled unless WILDCARD_SUBSCRIPTIONS is set, a filter is then a plain channel name
+SEPARATOR = '/'
+SINGLE_WILDCARD = '+'
+MULTI_WILDCARD = '*'
+
+wildcards = False
+
+# enables (or not) the wildcard levels, returns the setting
+def set_wildcards(enabled):
+    global wildcards
+    wildcards = bool(enabled)
+    return wildcards
+
+# a shared subscription '$share/<group>/<filter>' makes the client a member of a group, each packet
+# published to a channel matching the filter is delivered to one member of the group only
+SHARED_PREFIX = '$share/'
+
+# the p2p (#) and control ($) channels are never matched by a wildcard filter, only subscribed to by name
+RESERVED_PREFIXES = ('#', '$')
+
+# returns (group, filter) of a shared subscription, None if the channel is not a well formed one
+def parse_shared(channel):
+    if not channel.startswith(SHARED_PREFIX):
+        return None
+    parts = channel[len(SHARED_PREFIX):].split(SEPARATOR, 1)
+    if len(parts) != 2 or len(parts[0]) == 0 or len(parts[1]) == 0:
+        return None
+    group, topicFilter = parts
+    if SINGLE_WILDCARD in group or MULTI_WILDCARD in group or not is_valid_filter(topicFilter):
+        return None
+    return group, topicFilter
+
+# checks if a channel is a p2p or control channel
+def is_reserved(channel):
+    return channel.startswith(RESERVED_PREFIXES)
+
+# checks if a channel is a filter with wildcard levels
+def is_wildcard(channel):
+    if not wildcards or SINGLE_WILDCARD not in channel and MULTI_WILDCARD not in channel:
+        return False
+    for level in channel.split(SEPARATOR):
+        if level == SINGLE_WILDCARD or level == MULTI_WILDCARD:
+            return True
+    return False
+
+# checks if a subscription filter is well formed, '*' is only allowed as the last level
+def is_valid_filter(channel):
+    if not wildcards:
+        return True
+    levels = channel.split(SEPARATOR)
+    for i, level in enumerate(levels):
+        if level == MULTI_WILDCARD and i != len(levels) - 1:
+            return False
+    return True
+
+# checks if a channel matches a filter
+def matches(topicFilter, channel):
+    if not wildcards or is_reserved(channel):
+        return topicFilter == channel
+    levels = channel.split(SEPARATOR)
+    filterLevels = topicFilter.split(SEPARATOR)
+    for i, level in enumerate(filterLevels):
+        if level == MULTI_WILDCARD:
+            return True
+        if i >= len(levels) or (level != SINGLE_WILDCARD and level != levels[i]):
+            return False
+    return len(filterLevels) == len(levels)
+
+class TopicNode():
+    __slots__ = ('children', 'clients')
+
+    def __init__(self):
+        # level -> TopicNode
+        self.children = {}
+        # clients whose filter ends at this node
+        self.clients = set()
+
+# trie of the wildcard subscription filters, one node per level
+# matching a channel walks its levels and the wildcard branches only, O(depth) instead of O(subscriptions)
+class TopicTree():
+    def __init__(self):
+        self.root = TopicNode()
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    # adds a client to a filter, returns False if it is already there
+    def add(self, topicFilter, client_id):
+        node = self.root
+        for level in topicFilter.split(SEPARATOR):
+            child = node.children.get(level)
+            if child is None:
+                child = node.children[level] = TopicNode()
+            node = child
+        if client_id in node.clients:
+            return False
+        node.clients.add(client_id)
+        self.count += 1
+        return True
+
+    # removes a client from a filter, returns False if it is not there
+    def remove(self, topicFilter, client_id):
+        levels = topicFilter.split(SEPARATOR)
+        path = [self.root]
+        for level in levels:
+            node = path[-1].children.get(level)
+            if node is None:
+                return False
+            path.append(node)
+        if client_id not in path[-1].clients:
+            return False
+        path[-1].clients.discard(client_id)
+        self.count -= 1
+        # prunes the nodes left empty
+        for i in range(len(levels) - 1, -1, -1):
+            node = path[i + 1]
+            if len(node.clients) > 0 or len(node.children) > 0:
+                break
+            del path[i].children[levels[i]]
+        return True
+
+    # returns the set of clients with a filter matching a channel
+    def match(self, channel):
+        clients = set()
+        self.__match(self.root, channel.split(SEPARATOR), 0, clients)
+        return clients
+
+    def __match(self, node, levels, index, clients):
+        multi = node.children.get(MULTI_WILDCARD)
+        if multi is not None:
+            clients.update(multi.clients)
+        if index == len(levels):
+            clients.update(node.clients)
+            return
+        child = node.children.get(levels[index])
+        if child is not None:
+            self.__match(child, levels, index + 1, clients)
+        single = node.children.get(SINGLE_WILDCARD)
+        if single is not None:
+            self.__match(single, levels, index + 1, clients)
+
+    def clear(self):
+        self.root = TopicNode()
+        self.count = 0
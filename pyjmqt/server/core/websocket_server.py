@@ -25,12 +25,16 @@ import ssl
 import time
 import datetime
 from collections import OrderedDict
-import json
 import uuid
 
 import pyjmqt.server.logger as logger
 from pyjmqt.server.core.packets import *
 from pyjmqt.server.core.constants import *
+from pyjmqt.server.core.framing import max_frame_size
+from pyjmqt.server.core.compression import websocket_compression
+from pyjmqt.server.core.workers import reuse_port
+from pyjmqt.server.core.inbound import create_inbound_queue
+from pyjmqt.server.core.outbound import create_outbound_queue
 
 
 class Peer(object):
@@ -45,17 +49,34 @@ class Peer(object):
         self.client_id = None
         self.connectionHandler = connectionHandler
         self.run = True
+        # JSON until the client negotiates another codec in its conn packet
+        self.codec = JSONCodec
+        self.outbound = create_outbound_queue(self, self.__write, settings, connectionHandler.outboundStats)
 
     async def disconnect(self):
+        self.run = False
         try:
-            self.run = False
-            self.websocket.close()
+            # the frames still queued are sent before the websocket is closed
+            pending = await self.outbound.drain()
+            if len(pending) > 0:
+                await asyncio.wait_for(self.__write(pending), 10)
+        except Exception as e:
+            logger.log_error(e, '[disconnect] ' + self.tag)
+        try:
+            await self.websocket.close()
         except Exception as e:
             logger.log_error(e, '[disconnect] ' + self.tag)
                 
+    # called by the idle tracker when nothing was received for TIMEOUT_SECONDS, closing the websocket
+    # ends the pending recv and the handler disconnects the client
+    def idle_timeout(self):
+        logger.log_error(('TImeout: client {0}, peer {1}'.format(self.client_id, self.id)), self.tag)
+        asyncio.ensure_future(self.websocket.close())
+
     async def parse_and_respond(self, message):
-        body = message
-        packet, msg = PacketParser.parse_packet(body, self.protocol)
+        # text messages are JSON, binary messages use the negotiated codec
+        codec = self.codec if isinstance(message, bytes) else JSONCodec
+        packet, msg = PacketParser.parse_packet(message, self.protocol, codec)
         response, data = await self.connectionHandler.create_response(packet, self)
         if response != None:
             await self.send(response)
@@ -64,6 +85,10 @@ class Peer(object):
                 status = PacketParser.get_arg(JSONKeys.statusCode, pckData)
                 if 'client_id' in data and status == StatusCode.OK:
                     self.client_id = data['client_id']
+                    # the connAck is queued already, the next packets use the negotiated codec
+                    codec = PacketParser.get_arg(JSONKeys.codec, pckData)
+                    if codec is not None:
+                        self.codec = CODECS[codec]
                     # clearing the pending and retained messages
                     asyncio.Task(self.connectionHandler.send_pending_pub(self.client_id))
                     asyncio.Task(self.connectionHandler.send_retained(self.client_id))
@@ -75,15 +100,20 @@ class Peer(object):
                     # clearing the pending messages
                     asyncio.Task(self.connectionHandler.send_retained(self.client_id, channel = channel_name))
 
+    # queues the packet, it is written by the outbound queue
     async def send(self, data):
         try:
-            message = json.dumps(data)
-            await self.websocket.send(message)
+            if isinstance(data, EncodedPacket):
+                self.outbound.put(data.packet, data.encoded(self.codec))
+            else:
+                self.outbound.put(data, self.codec.dumps(data))
         except Exception as e:
             logger.log_error(e, '[sender] ' + self.tag)
 
-    async def send_response(self, message):
-        await self.parse_and_respond(message)
+    # writes a batch of messages, one websocket message per packet, text for JSON and binary for the binary codecs (called by the outbound queue)
+    async def __write(self, frames):
+        for message in frames:
+            await self.websocket.send(message)
 
 
 class WebSocketServer(object):
@@ -97,22 +127,33 @@ class WebSocketServer(object):
 
     def start(self):
         logger.log_info(('Listening on tcp {0}'.format(self.settings.WEBSOCKET_PORT)), self.TAG)
-        self.server = self.loop.run_until_complete(websockets.serve(self.handler, '0.0.0.0', self.settings.WEBSOCKET_PORT))
+        self.server = self.loop.run_until_complete(websockets.serve(self.handler, '0.0.0.0', self.settings.WEBSOCKET_PORT, max_size=max_frame_size(self.settings), reuse_port=reuse_port(self.settings), **websocket_compression(self.settings)))
 
     async def handler(self, websocket, path):
         remoteIP, remotePort = websocket.remote_address
         remoteHost = str(remoteIP) + ':' + str(remotePort)
         peer = Peer(websocket, remoteHost, self.__callbackWrapper, self.connectionHandler, self.settings, self.TAG)
+        inbound = create_inbound_queue(peer.parse_and_respond, self.settings, self.TAG)
+        idleTracker = self.connectionHandler.idleTracker
+        idleTracker.add(peer)
         try:
             while peer.run:
-                message = await asyncio.wait_for(websocket.recv(), timeout=self.settings.TIMEOUT_SECONDS)
+                message = await websocket.recv()
+                idleTracker.touch(peer)
                 if peer.run:
-                    asyncio.Task(peer.send_response(message))
+                    # waits while the queue is full, the websocket is not read meanwhile
+                    await inbound.put(message)
+                    if peer.client_id is None:
+                        # the conn is processed before the next message, which may use the codec it negotiates
+                        await inbound.join()
                 else:
                     break
-        except asyncio.TimeoutError:
-            logger.log_error(('TImeout: client {0}, peer {1}'.format(peer.client_id, peer.id)), self.TAG)
+        except websockets.exceptions.ConnectionClosed:
+            # the messages received before the connection was closed are processed first
+            await inbound.join()
         finally:
+            idleTracker.remove(peer)
+            inbound.close()
             if peer.client_id != None:
                 if peer.run:
                     await self.connectionHandler.disconnect_client(peer.client_id)
@@ -120,7 +161,7 @@ class WebSocketServer(object):
             else:
                 logger.log_info(('Conn closed: peer {0}'.format(peer.id)), self.TAG)
             try:
-                websocket.close()
+                await websocket.close()
             except:
                 pass
 
@@ -138,22 +179,33 @@ class SSLWebSocketServer(object):
         logger.log_info(('Listening on tcp {0}'.format(self.settings.SSL_WEBSOCKET_PORT)), self.TAG)
         sc = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
         sc.load_cert_chain(self.settings.SSL_CERT_PATH, self.settings.SSL_KEY_PATH)
-        self.server = self.loop.run_until_complete(websockets.serve(self.handler, '0.0.0.0', self.settings.SSL_WEBSOCKET_PORT, ssl=sc))
+        self.server = self.loop.run_until_complete(websockets.serve(self.handler, '0.0.0.0', self.settings.SSL_WEBSOCKET_PORT, ssl=sc, max_size=max_frame_size(self.settings), reuse_port=reuse_port(self.settings), **websocket_compression(self.settings)))
 
     async def handler(self, websocket, path):
         remoteIP, remotePort = websocket.remote_address
         remoteHost = str(remoteIP) + ':' + str(remotePort)
         peer = Peer(websocket, remoteHost, self.__callbackWrapper, self.connectionHandler, self.settings, self.TAG)
+        inbound = create_inbound_queue(peer.parse_and_respond, self.settings, self.TAG)
+        idleTracker = self.connectionHandler.idleTracker
+        idleTracker.add(peer)
         try:
             while peer.run:
-                message = await asyncio.wait_for(websocket.recv(), timeout=self.settings.TIMEOUT_SECONDS)
+                message = await websocket.recv()
+                idleTracker.touch(peer)
                 if peer.run:
-                    asyncio.Task(peer.send_response(message))
+                    # waits while the queue is full, the websocket is not read meanwhile
+                    await inbound.put(message)
+                    if peer.client_id is None:
+                        # the conn is processed before the next message, which may use the codec it negotiates
+                        await inbound.join()
                 else:
                     break
-        except asyncio.TimeoutError:
-            logger.log_error(('TImeout: client {0}, peer {1}'.format(peer.client_id, peer.id)), self.TAG)
+        except websockets.exceptions.ConnectionClosed:
+            # the messages received before the connection was closed are processed first
+            await inbound.join()
         finally:
+            idleTracker.remove(peer)
+            inbound.close()
             if peer.client_id != None:
                 if peer.run:
                     await self.connectionHandler.disconnect_client(peer.client_id)
@@ -161,7 +213,7 @@ class SSLWebSocketServer(object):
             else:
                 logger.log_info(('Conn closed: peer {0}'.format(peer.id)), self.TAG)
             try:
-                websocket.close()
+                await websocket.close()
             except:
                 pass
             return
\ No newline at end of file
@@ -0,0 +1,172 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 Shubhadeep Banerjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import os
+import signal
+import socket
+import asyncio
+import tempfile
+
+import pyjmqt.server.logger as logger
+from pyjmqt.server.core.framing import LengthPrefixedBuffer
+from pyjmqt.server.core.services.local_bus import LocalBus
+from pyjmqt.server.core.services.cache import CacheService
+
+# returns the number of worker processes from the settings (WORKERS, a number or auto = one per core)
+def worker_count(settings):
+    workers = settings.get('WORKERS', 1)
+    if workers == 'auto':
+        workers = os.cpu_count() or 1
+    if not isinstance(workers, int) or workers < 1:
+        logger.log_warning(('Invalid WORKERS {0}, using 1').format(workers), 'worker_count')
+        return 1
+    if workers > 1 and (not hasattr(os, 'fork') or not hasattr(socket, 'SO_REUSEPORT')):
+        logger.log_warning('fork or SO_REUSEPORT is not available on this platform, using 1 worker', 'worker_count')
+        return 1
+    return workers
+
+# checks if the listeners share their ports with the other workers
+def reuse_port(settings):
+    workers = settings.get('WORKERS', 1)
+    return (workers == 'auto' or (isinstance(workers, int) and workers > 1)) and hasattr(socket, 'SO_REUSEPORT') and hasattr(os, 'fork')
+
+# forks the worker processes of the server, each worker runs its own event loop and listeners,
+# the kernel spreads the incoming connections over the workers (SO_REUSEPORT)
+# the master process (worker 0) runs the bus hub, which relays the messages the workers exchange
+# about the connected clients, the subscriptions and the publishes (see LocalBus)
+class WorkerPool():
+    def __init__(self, settings, count):
+        self.settings = settings
+        self.count = count
+        self.path = settings.get('WORKER_BUS_PATH', os.path.join(tempfile.gettempdir(), 'jmqt-{0}.sock'.format(os.getpid())))
+        # index of this process, 0 = the master
+        self.index = 0
+        self.pids = []
+        self.listener = None
+        self.hub = None
+
+    # forks the workers, returns the index of the calling process (0 in the master)
+    # the listening socket of the bus is created first, the workers may connect before the master runs its loop
+    def fork(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen(self.count)
+        for index in range(1, self.count):
+            pid = os.fork()
+            if pid == 0:
+                self.index = index
+                self.pids = []
+                self.listener.close()
+                self.listener = None
+                return index
+            self.pids.append(pid)
+        logger.log_info(('Forked {0} workers, bus {1}').format(self.count - 1, self.path), 'WorkerPool')
+        return 0
+
+    # starts the bus hub on the loop of the master
+    def start_hub(self, eventLoop):
+        self.hub = BusHub()
+        eventLoop.run_until_complete(asyncio.start_unix_server(self.hub.handle_worker, sock = self.listener))
+
+    # returns the bus client of this process
+    def bus(self, eventLoop):
+        return LocalBus(self.path, self.index, eventLoop)
+
+    # stops the workers (called in the master)
+    def stop(self):
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError as ex:
+                logger.log_error(ex, 'WorkerPool(stop)')
+        self.pids = []
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+# relays the bus frames between the workers, a frame starts with the index of the target worker
+# (LocalBus.BROADCAST = every worker but the sender), the first frame of a worker carries its own index
+# the frames are forwarded as they are, without being decoded
+# the other workers are told when a worker joins (they send it their connected clients) and when it leaves
+# (they forget its clients)
+class BusHub():
+    def __init__(self):
+        # worker index -> stream writer
+        self.workers = {}
+        self.frames = 0
+
+    async def handle_worker(self, reader, writer):
+        buffer = LengthPrefixedBuffer(None)
+        index = None
+        try:
+            while True:
+                data = await reader.read(65536)
+                if data == b'':
+                    break
+                targets = set()
+                for frame in buffer.feed(data):
+                    target = LocalBus.TARGET.unpack_from(frame)[0]
+                    if index is None:
+                        index = target
+                        self.workers[index] = writer
+                        logger.log_info(('Worker {0} joined the bus').format(index), 'BusHub')
+                        self.__notify(index, CacheService.BUS_TYPE_JOINED)
+                        continue
+                    frame = LengthPrefixedBuffer.frame(frame)
+                    self.frames += 1
+                    if target == LocalBus.BROADCAST:
+                        for other, otherWriter in self.workers.items():
+                            if other != index:
+                                otherWriter.write(frame)
+                                targets.add(otherWriter)
+                    elif target in self.workers:
+                        self.workers[target].write(frame)
+                        targets.add(self.workers[target])
+                # the sender waits for the slow workers, the hub is not read meanwhile
+                for targetWriter in targets:
+                    await targetWriter.drain()
+        except Exception as ex:
+            logger.log_error(ex, 'BusHub')
+        finally:
+            if index is not None and self.workers.get(index) is writer:
+                del self.workers[index]
+                logger.log_error(('Worker {0} left the bus').format(index), 'BusHub')
+                self.__notify(index, CacheService.BUS_TYPE_LEFT)
+            writer.close()
+
+    # sends a joined or left message about a worker to the other workers
+    def __notify(self, index, messageType):
+        frame = LocalBus.frame(LocalBus.BROADCAST, {
+            CacheService.BUS_TYPE: messageType,
+            CacheService.BUS_WORKER: index
+        })
+        for other, otherWriter in self.workers.items():
+            if other != index:
+                try:
+                    otherWriter.write(frame)
+                except Exception as ex:
+                    logger.log_error(ex, 'BusHub')